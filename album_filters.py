@@ -1,121 +1,379 @@
+import configparser
 import re
 
-def garbage_album(album):
 
-    if len(album['artists']) > 10:
-        return True
-
-    pat = re.compile('|'.join([
-
-            #Genres
-            r"\bR[n&]B\b",
-            r"\bHip[ -]?Hop\b",
-            r"\bR'N'B\b",
-            r"\bPop\b",
-            r"\bSoul\b",
-            r"\bCountry\b",
-            r"\bJazz\b",
-            r"\bDance\b",
-            r"\bElectronic\b",
-            r"\bRock\b",
-            r"\bAlt(?:ernative)?\b",
-            r"\bFunk\b",
-            r"\bRap\b",
-
-            #Compilations
-            r"[0-9]0(?:[\']?s)?\b",
-            r"\b(?:19|20)[0-9]{2}\b",
-            r"\bCompilation\b",
-            r"\bGreatest\b",
-            r"\bGreat[s]?\b",
-            r"\bBest Of\b",
-            r"\bClassic[s]?\b",
-            r"\bOldies\b",
-            r"\bNow That\'?s What I Call\b",
-            r"\bHits\b",
-            r"\bOne Hit Wonders\b",
-            r"\bCollection\b",
-            r"\bAward[ -]Winning\b",
-            r"\bUltimate\b",
-            r"\bBallads",
-
-            #Playlists
-            r"\b(?:Summer|Autumn|Winter|Spring|Christmas)\b",
-            r"\bSummertime\b",
-            r"\bSeason(?:al|\'s)?\b",
-            r"\bHoliday[s]?\b",
-            r"\bBBQ\b",
-            r"\bBarbecue\b",
-            r"\bPlaylist[s]?\b",
-            r"\bSong[s]?\b",
-            r"\bBanger[sz]?\b",
-            r"\bChilled\b",
-            r"\bBeats\b",
-            r"\bParty\b",
-            r"\bMusic\b",
-            r"\bRomantic\b",
-            r"\bMood[sz]?\b",
-            r"\bKaraoke\b",
-            r"\bThrowback[s]?\b",
-            r"\bRewind[s]?\b",
-            r"\bSnuggle\b",
-            r"\bGroove[sz]?\b",
-            r"\bTune[sz]?\b",
-            r"\bVibe[sz]?\b",
-            r"\bBop[sz]?\b",
-            r"\bJam[sz]?\b",
-            r"\bAnthem[sz]?\b",
-            r"\bMellow\b",
-            r"\bPositive\b",
-            r"\bJukebox\b",
-
-            #Rereleases
-            r"[\]\(][^\(\[\)\]]*Live[^\(\[\)\]]*[\)\]]",
-            r"\bInstrumental[s]?\b",
-            r"\bRemaster(?:ed)?\b",
-            r"\bAcoustic\b",
-            r"\bRemix(?:es)?\b",
-            r"\bVersion\b",
-            r"\bVol(?:\.|ume)?\b",
-            r"\bDeluxe\b",
-            r"\bMix(?:es)?\b",
-            r"\bAlbum[s]?\b",
-
-            #Other
-            r"\bOriginal\b.*\bScore[s]?\b",
-            r"\bSoundtrack[s]?\b",
-            r"\bMovie\b",
-
-            ]),
-        re.IGNORECASE
-        )
-    return re.search(pat, album['name'])
+# Patterns are matched case-insensitively against album names, grouped by the category reported when they match.
+DEFAULT_RULES = {
+    'genre': [
+        r"\bR[n&]B\b",
+        r"\bHip[ -]?Hop\b",
+        r"\bR'N'B\b",
+        r"\bPop\b",
+        r"\bSoul\b",
+        r"\bCountry\b",
+        r"\bJazz\b",
+        r"\bDance\b",
+        r"\bElectronic\b",
+        r"\bRock\b",
+        r"\bAlt(?:ernative)?\b",
+        r"\bFunk\b",
+        r"\bRap\b",
+        ],
+    'compilation': [
+        r"[0-9]0(?:[\']?s)?\b",
+        r"\b(?:19|20)[0-9]{2}\b",
+        r"\bCompilation\b",
+        r"\bGreatest\b",
+        r"\bGreat[s]?\b",
+        r"\bBest Of\b",
+        r"\bClassic[s]?\b",
+        r"\bOldies\b",
+        r"\bNow That\'?s What I Call\b",
+        r"\bHits\b",
+        r"\bOne Hit Wonders\b",
+        r"\bCollection\b",
+        r"\bAward[ -]Winning\b",
+        r"\bUltimate\b",
+        r"\bBallads",
+        ],
+    'playlist': [
+        r"\b(?:Summer|Autumn|Winter|Spring|Christmas)\b",
+        r"\bSummertime\b",
+        r"\bSeason(?:al|\'s)?\b",
+        r"\bHoliday[s]?\b",
+        r"\bBBQ\b",
+        r"\bBarbecue\b",
+        r"\bPlaylist[s]?\b",
+        r"\bSong[s]?\b",
+        r"\bBanger[sz]?\b",
+        r"\bChilled\b",
+        r"\bBeats\b",
+        r"\bParty\b",
+        r"\bMusic\b",
+        r"\bRomantic\b",
+        r"\bMood[sz]?\b",
+        r"\bKaraoke\b",
+        r"\bThrowback[s]?\b",
+        r"\bRewind[s]?\b",
+        r"\bSnuggle\b",
+        r"\bGroove[sz]?\b",
+        r"\bTune[sz]?\b",
+        r"\bVibe[sz]?\b",
+        r"\bBop[sz]?\b",
+        r"\bJam[sz]?\b",
+        r"\bAnthem[sz]?\b",
+        r"\bMellow\b",
+        r"\bPositive\b",
+        r"\bJukebox\b",
+        ],
+    'rerelease': [
+        r"[\]\(][^\(\[\)\]]*Live[^\(\[\)\]]*[\)\]]",
+        r"\bInstrumental[s]?\b",
+        r"\bRemaster(?:ed)?\b",
+        r"\bAcoustic\b",
+        r"\bRemix(?:es)?\b",
+        r"\bVersion\b",
+        r"\bVol(?:\.|ume)?\b",
+        r"\bDeluxe\b",
+        r"\bMix(?:es)?\b",
+        r"\bAlbum[s]?\b",
+        ],
+    'other': [
+        r"\bOriginal\b.*\bScore[s]?\b",
+        r"\bSoundtrack[s]?\b",
+        r"\bMovie\b",
+        ],
+    }
 
-def garbage_filter_test():
-    names = [
-        'Fast Hip-Hop Urban R&B',
-        '80\'s Supershow   ',
-        'Beat the World (Original Motion Picture Soundtrack)',
-        'Sorry To Bother You (Original Score)',
-        'Time for Music: Relaxing Instrumental Playlists for Lovers',
-        'Now That\'s What I Call Music!',
-        '00s Hits',
-        '100 Greatest Hip-Hop',
-        'Vol. 3 (Live Version)',
-        'Classic Rock',
-        'Alt Rock for salt socks',
-        'the alt-rock for malt mocks',
-        ' this (remastered)',
-        'songs (Acoustic version)',
-        'Heartbreak Instrumentals',
-        'Playlist: only the bangers',
-        'hip hop on pop',
-        'Rnb',
-        'old album (new version)',
-        'instrumental',
+
+class RegexMatcher:
+
+    ''' Matches names against every rule at once with a single alternation regex.
+        Like any regex alternation, the leftmost match wins, and ties go to the earlier rule.
+    '''
+
+    def __init__(self, rules):
+        self._pattern = re.compile(
+            '|'.join(f"(?P<{category}>{'|'.join(patterns)})" for category, patterns in rules.items()),
+            re.IGNORECASE
+            )
+
+    def match(self, name):
+        match = self._pattern.search(name)
+        return match.lastgroup if match else None
+
+
+_TOKEN = re.compile(r'\w+|\W+')
+
+class _Unsupported(Exception):
+    pass
+
+def _expand_alternation(pattern, i):
+    strings = set()
+    while True:
+        branch, i = _expand_sequence(pattern, i)
+        strings |= branch
+        if i < len(pattern) and pattern[i] == '|':
+            i += 1
+        else:
+            return strings, i
+
+def _expand_sequence(pattern, i):
+    strings = {''}
+    while i < len(pattern) and pattern[i] not in '|)':
+        atom, i = _expand_atom(pattern, i)
+        if i < len(pattern) and pattern[i] == '?':
+            atom = atom | {''}
+            i += 1
+        if i < len(pattern) and pattern[i] in '*+{':
+            raise _Unsupported
+        strings = {a + b for a in strings for b in atom}
+        if len(strings) > 256:
+            raise _Unsupported
+    return strings, i
+
+def _expand_atom(pattern, i):
+    char = pattern[i]
+    if char == '(':
+        if pattern.startswith('(?:', i):
+            i += 3
+        elif pattern.startswith('(?', i):
+            raise _Unsupported
+        else:
+            i += 1
+        strings, i = _expand_alternation(pattern, i)
+        if i >= len(pattern) or pattern[i] != ')':
+            raise _Unsupported
+        return strings, i + 1
+    elif char == '[':
+        i += 1
+        chars = set()
+        if pattern[i] == '^':
+            raise _Unsupported
+        while pattern[i] != ']':
+            if pattern[i] == '\\':
+                if pattern[i+1].isalnum():
+                    raise _Unsupported
+                chars.add(pattern[i+1])
+                i += 2
+            elif pattern[i] == '-' and pattern[i-1] != '[' and pattern[i+1] != ']':
+                raise _Unsupported
+            else:
+                chars.add(pattern[i])
+                i += 1
+        return chars, i + 1
+    elif char == '\\':
+        if pattern[i+1].isalnum():
+            raise _Unsupported
+        return {pattern[i+1]}, i + 2
+    elif char in '.^$*+?{}])':
+        raise _Unsupported
+    else:
+        return {char}, i + 1
+
+def _is_word(token):
+    return token[0].isalnum() or token[0] == '_'
+
+def keyword_phrases(pattern):
+    ''' Turns a rule like \\bVibe[sz]?\\b into the token sequences it can match:
+        {('vibe',), ('vibes',), ('vibez',)}, where a phrase like 'Hip-Hop' becomes ('hip', '-', 'hop').
+        Returns None for anything that isn't a word-bounded finite set of strings, which has to stay a regex.
+    '''
+    if not (pattern.startswith(r'\b') and pattern.endswith(r'\b')) or pattern.endswith(r'\\b'):
+        return None
+    body = pattern[2:-2]
+    try:
+        strings, i = _expand_alternation(body, 0)
+        if i != len(body):
+            raise _Unsupported
+    except (_Unsupported, IndexError):
+        return None
+
+    phrases = {tuple(_TOKEN.findall(s.lower())) for s in strings}
+    if () in phrases:
+        return None
+    keywords = set()
+    for phrase in phrases:
+        if _is_word(phrase[0]) and _is_word(phrase[-1]):
+            keywords.add(phrase)
+            continue
+        # Something like \bVol\.\b only matches where \bVol\b would match too, so it can be dropped.
+        trimmed = phrase[int(not _is_word(phrase[0])):len(phrase)-int(not _is_word(phrase[-1]))]
+        if trimmed not in phrases:
+            return None
+    return keywords
+
+
+class KeywordMatcher:
+
+    ''' Tokenizes a name once and looks its words up in a precomputed keyword table,
+        leaving only the structural rules that can't be written as keywords to a (much smaller) regex.
+
+        Verdicts are identical to RegexMatcher's, including which category is reported:
+        the hit with the leftmost position wins, and ties go to the earlier rule.
+        Names with non-ASCII characters are handed to the regex matcher,
+        since IGNORECASE and str.lower() don't agree on every Unicode character.
+    '''
+
+    def __init__(self, rules):
+        self._fallback = RegexMatcher(rules)
+        self._words = {}
+        self._phrases = {}
+        self._categories = []
+        structural = []
+        for category, patterns in rules.items():
+            for pattern in patterns:
+                index = len(self._categories)
+                self._categories.append(category)
+                phrases = keyword_phrases(pattern)
+                if phrases is None:
+                    structural.append(f'(?P<r{index}>{pattern})')
+                    continue
+                for phrase in phrases:
+                    table = self._words if len(phrase) == 1 else self._phrases
+                    key = phrase[0] if len(phrase) == 1 else phrase
+                    table.setdefault(key, index)
+        self._heads = {phrase[0] for phrase in self._phrases}
+        self._lengths = sorted({len(phrase) for phrase in self._phrases})
+        self._structural = re.compile('|'.join(structural), re.IGNORECASE) if structural else None
+
+    def match(self, name):
+        if not name.isascii():
+            return self._fallback.match(name)
+
+        best = None
+        tokens = _TOKEN.findall(name.lower())
+        position = 0
+        for i, token in enumerate(tokens):
+            index = self._words.get(token)
+            if token in self._heads:
+                for length in self._lengths:
+                    phrase_index = self._phrases.get(tuple(tokens[i:i+length]))
+                    if phrase_index is not None and (index is None or phrase_index < index):
+                        index = phrase_index
+            if index is not None:
+                best = (position, index)
+                break
+            position += len(token)
+
+        if self._structural:
+            match = self._structural.search(name)
+            if match:
+                found = (match.start(), int(match.lastgroup[1:]))
+                if best is None or found < best:
+                    best = found
+
+        return self._categories[best[1]] if best else None
+
+
+MATCHERS = {
+    'regex': RegexMatcher,
+    'keyword': KeywordMatcher,
+    }
+
+
+class AlbumFilter:
+
+    ''' Classifies albums as garbage (compilations, playlists, rereleases, etc.) or not.
+
+        The rules are compiled once by one of the MATCHERS, which also reports the category that matched.
+        Verdicts are memoized by album ID.
+    '''
+
+    def __init__(self, rules=DEFAULT_RULES, max_artists=10, matcher='keyword'):
+        self.rules = {category: list(patterns) for category, patterns in rules.items() if patterns}
+        self.max_artists = max_artists
+        self._matcher = MATCHERS[matcher](self.rules)
+        self._verdicts = {}
+
+    @classmethod
+    def from_config(cls, path='config.cfg', section='ALBUM_FILTERS'):
+        ''' Loads a rule set from a config file instead of the defaults, with one pattern per line:
+            [ALBUM_FILTERS]
+            max_artists = 10
+            matcher = keyword
+            genre =
+                \\bPop\\b
+                \\bRock\\b
+            Categories that are left out of the section fall back to the default rules.
+        '''
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(path)
+        rules = dict(DEFAULT_RULES)
+        max_artists = 10
+        matcher = 'keyword'
+        if config.has_section(section):
+            for category, value in config.items(section):
+                if category == 'max_artists':
+                    max_artists = int(value)
+                elif category == 'matcher':
+                    matcher = value.strip()
+                else:
+                    rules[category] = [line.strip() for line in value.splitlines() if line.strip()]
+        return cls(rules, max_artists=max_artists, matcher=matcher)
+
+    def classify(self, album):
+        ''' Returns the category of the first rule the album trips, or None if it's a real album.
+        '''
+        album_id = album.get('id')
+        if album_id in self._verdicts:
+            return self._verdicts[album_id]
+
+        if len(album['artists']) > self.max_artists:
+            verdict = 'other'
+        else:
+            verdict = self._matcher.match(album['name'])
+
+        if album_id:
+            self._verdicts[album_id] = verdict
+        return verdict
+
+    def classify_batch(self, albums):
+        ''' Returns a list with the category (or None) for each album, in the same order.
+        '''
+        return [self.classify(album) for album in albums]
+
+    def keep(self, albums):
+        ''' Returns only the albums that didn't trip any rule.
+        '''
+        return [album for album, verdict in zip(albums, self.classify_batch(albums)) if not verdict]
+
+    def clear(self):
+        self._verdicts.clear()
+
+
+DEFAULT_FILTER = AlbumFilter()
+
+def garbage_album(album):
+    ''' Returns the category of garbage the album falls into, or None if it looks like a real album.
+    '''
+    return DEFAULT_FILTER.classify(album)
+
+GARBAGE_TEST_NAMES = [
+    'Fast Hip-Hop Urban R&B',
+    '80\'s Supershow   ',
+    'Beat the World (Original Motion Picture Soundtrack)',
+    'Sorry To Bother You (Original Score)',
+    'Time for Music: Relaxing Instrumental Playlists for Lovers',
+    'Now That\'s What I Call Music!',
+    '00s Hits',
+    '100 Greatest Hip-Hop',
+    'Vol. 3 (Live Version)',
+    'Classic Rock',
+    'Alt Rock for salt socks',
+    'the alt-rock for malt mocks',
+    ' this (remastered)',
+    'songs (Acoustic version)',
+    'Heartbreak Instrumentals',
+    'Playlist: only the bangers',
+    'hip hop on pop',
+    'Rnb',
+    'old album (new version)',
+    'instrumental',
     ]
 
-    tests = [{'name':name, 'artists':[]} for name in names]
+def garbage_filter_test():
+    tests = [{'name':name, 'artists':[]} for name in GARBAGE_TEST_NAMES]
     tests.append({'name': 'collab album', 'artists':['drake' for _ in range(11)]})
 
     for test in tests:
@@ -123,5 +381,68 @@ def garbage_filter_test():
         print(test)
         print(garbage_album(test))
 
+def synthetic_album_names(count, seed=0):
+    ''' Generates album names that mix ordinary words with near-misses and real hits for every kind of rule.
+    '''
+    import random
+    rng = random.Random(seed)
+    words = [
+        'love', 'night', 'blue', 'heart', 'city', 'dream', 'fire', 'river', 'ghost', 'gold', 'street', 'moon',
+        'paper', 'echo', 'glass', 'wild', 'shadow', 'light', 'kind', 'of', 'the', 'a', 'in', 'my', 'salt',
+        'altitude', 'popular', 'rocket', 'jamboree', 'lively', 'originality', 'hitsville', 'R', 'B', 'N',
+        'hip', 'hop', 'best', 'now', 'what', 'I', 'call', 'one', 'hit', 'award', 'winning', 'season', 'that',
+        's', 'volumes', 'mixtape', 'scored', 'Café', 'Straße', 'Ōkami', 'señor', 'x_y', '7',
+        ]
+    keywords = [
+        'Pop', 'ROCK', 'rnb', 'R&B', "r'n'b", 'Hip-Hop', 'hiphop', 'hip hop', 'Hits', 'best of', 'Vibez', 'jams',
+        'Vol.', 'volume', 'Remastered', 'remix', 'Mixes', 'Albums', 'Live', 'Original', 'Score', 'Scores',
+        'Soundtrack', 'Ballads', 'balladsy', "Season's", 'seasonal', 'Award-Winning', "Now That's What I Call",
+        'Now Thats What I Call', 'One Hit Wonders', 'Christmas', 'BBQ', 'Greats', 'Alt', 'alternative',
+        ]
+    numbers = ['1999', '2020', '1850', '80s', "90's", '100', '70', '3', '2000s', '12345']
+    separators = [' ', ' ', ' ', ' ', '  ', '-', ' - ', "'", ': ', '&', ', ', '.', ' (', ') ', '[', '] ', '!']
+
+    names = []
+    for _ in range(count):
+        parts = []
+        for _ in range(rng.randint(1, 7)):
+            roll = rng.random()
+            if roll < 0.08:
+                parts.append(rng.choice(keywords))
+            elif roll < 0.14:
+                parts.append(rng.choice(numbers))
+            else:
+                parts.append(rng.choice(words))
+            parts.append(rng.choice(separators))
+        name = ''.join(parts[:-1])
+        if rng.random() < 0.5:
+            name = name.title() if rng.random() < 0.5 else name.lower()
+        names.append(name)
+    return names
+
+def matcher_benchmark(count=200000, seed=0):
+    ''' Checks that every matcher agrees with the regex on GARBAGE_TEST_NAMES and a synthetic corpus,
+        then prints the throughput of each.
+    '''
+    from time import perf_counter
+
+    corpus = synthetic_album_names(count, seed)
+    matchers = {name: matcher(DEFAULT_RULES) for name, matcher in MATCHERS.items()}
+    reference = matchers['regex']
+    for name, matcher in matchers.items():
+        for test_names in (GARBAGE_TEST_NAMES, corpus):
+            mismatches = [n for n in test_names if matcher.match(n) != reference.match(n)]
+            assert not mismatches, f"{name} matcher disagrees with the regex on: {mismatches[:10]}"
+    hits = sum(1 for n in corpus if reference.match(n))
+    print(f"All matchers agree on {len(GARBAGE_TEST_NAMES)} test names and {count} synthetic names ({hits} garbage).")
+
+    for name, matcher in matchers.items():
+        mark0 = perf_counter()
+        for album_name in corpus:
+            matcher.match(album_name)
+        elapsed = perf_counter() - mark0
+        print(f"{name:>8}: {elapsed:.2f} seconds, {count/elapsed:,.0f} names per second")
+
 if __name__ == '__main__':
-    garbage_filter_test()
\ No newline at end of file
+    garbage_filter_test()
+    matcher_benchmark()
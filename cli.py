@@ -0,0 +1,128 @@
+''' One entry point for the helper scripts:
+
+    python cli.py new-albums [--since yyyy-mm-dd]
+    python cli.py lonely-songs
+    python cli.py song-appearance [song_uri]
+    python cli.py load-graph
+    python cli.py serve
+    python cli.py query song-appearance song=spotify:track:...
+
+Only the modules the chosen subcommand needs get imported, and the Spotify client isn't built
+(config read, token fetched) until the subcommand first asks it for something.
+'''
+from time import perf_counter
+_started = perf_counter()
+
+import argparse
+import sys
+
+
+class LazyClient:
+
+    ''' Stands in for a subSpotify and builds the real one, auth and all, the first time anything is asked of it.
+    '''
+
+    def __init__(self, scope, **options):
+        self._client = None
+        self._scope = scope
+        self._options = options
+        self.auth_seconds = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            mark0 = perf_counter()
+            from spotipyhelper import subSpotify
+            self._client = subSpotify(scope=self._scope, **self._options)
+            self.auth_seconds = perf_counter() - mark0
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+# Each of these imports what its subcommand needs and returns (function to run with the client, scope)
+
+def _new_albums(args):
+    from find_recent_albums import find_new_albums, SCOPE
+    return (lambda sp: find_new_albums(sp, args.since)), SCOPE
+
+def _lonely_songs(args):
+    from lonely_songs import main, SCOPE
+    return main, SCOPE
+
+def _song_appearance(args):
+    from playlistappearance import main, SCOPE
+    return (lambda sp: main(sp, args.song_uri)), SCOPE
+
+def _load_graph(args):
+    from load_data_neo4j import main, SCOPE
+    return main, SCOPE
+
+def _serve(args):
+    from daemon import serve, SCOPE
+    return serve, SCOPE
+
+def _query(args):
+    # Talks to a running daemon, so the client never gets built
+    import configparser
+    import json
+    from daemon import query, address_from_config
+
+    def run(sp):
+        config = configparser.ConfigParser()
+        config.read('config.cfg')
+        params = dict(param.split('=', 1) for param in args.params)
+        try:
+            print(json.dumps(query(args.name, address_from_config(config), **params), indent=2, ensure_ascii=False))
+        except (ConnectionError, LookupError) as error:
+            sys.exit(str(error))
+    return run, None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Spotipyhelper scripts.')
+    parser.add_argument('-q', '--quiet', action='store_true', help="don't report startup and auth times")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('new-albums', help='list albums released since a date by artists in your library')
+    command.add_argument('--since', help='cutoff date, yyyy-mm-dd (asked for if left out)')
+    command.set_defaults(load=_new_albums)
+
+    command = commands.add_parser('lonely-songs', help="sync the songs that aren't in any playlist into 'All the Lonely Songs'")
+    command.set_defaults(load=_lonely_songs)
+
+    command = commands.add_parser('song-appearance', help='list the playlists a song appears in')
+    command.add_argument('song_uri', nargs='?', help='asked for repeatedly if left out')
+    command.set_defaults(load=_song_appearance)
+
+    command = commands.add_parser('load-graph', help='run every stage of load_data_neo4j.py')
+    command.set_defaults(load=_load_graph)
+
+    command = commands.add_parser('serve', help='keep a client and your library in memory and answer queries on localhost')
+    command.set_defaults(load=_serve)
+
+    command = commands.add_parser('query', help='ask a running daemon: status, lonely-songs, song-appearance, playlist-diff, new-releases, refresh')
+    command.add_argument('name')
+    command.add_argument('params', nargs='*', metavar='key=value', help='e.g. song=spotify:track:... or since=2024-01-01')
+    command.set_defaults(load=_query)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    run, scope = args.load(args)
+    sp = LazyClient(scope)
+    if not args.quiet:
+        # Doesn't include the interpreter's own startup
+        print(f"[{args.command} ready in {(perf_counter() - _started)*1000:.0f} ms]", file=sys.stderr)
+
+    run(sp)
+
+    if not args.quiet and sp.auth_seconds is not None:
+        print(f"[client built in {sp.auth_seconds*1000:.0f} ms, {perf_counter() - _started:.1f} s in total]", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
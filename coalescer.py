@@ -0,0 +1,153 @@
+from tracing import carry_helper
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# kind -> (client method, key of the list in its response, most IDs the endpoint takes at once, whether it takes a market)
+BATCH_ENDPOINTS = {
+    'track': ('tracks', 'tracks', 50, True),
+    'album': ('albums', 'albums', 20, True),
+    'artist': ('artists', 'artists', 50, False),
+    }
+
+# kind -> how to look up a single key, for endpoints with no batch version
+SINGLE_ENDPOINTS = {
+    'user': lambda coalescer, user_id: coalescer.sp.user(user_id),
+    'playlist': lambda coalescer, pair: coalescer.sp.playlist(pair[1], fields=coalescer.playlist_fields, market=coalescer.market),
+    }
+
+
+class RequestCoalescer:
+
+    ''' Collects single-object lookups made within a short window and sends them through the batch endpoint,
+        so forty track() calls from forty places turn into one tracks() call.
+
+        get() returns a concurrent.futures.Future. Asking for a key that's already on its way
+        hands back the same future instead of a second request. Lookups that have no batch endpoint
+        (users, playlists) are still deduplicated and run concurrently on the worker pool.
+        market is passed on to the endpoints that take one, see subSpotify.get_tracks_by_id(),
+        and playlist_fields trims playlist lookups the way fields does for subSpotify.get_tracks_from_playlist().
+    '''
+
+    def __init__(self, sp, window=0.005, max_workers=8, market=None, playlist_fields=None):
+        self.sp = sp
+        self.window = window
+        self.market = market
+        self.playlist_fields = playlist_fields
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._pending = {kind: {} for kind in BATCH_ENDPOINTS}
+        self._timers = {}
+        self._in_flight = {}
+
+    def get(self, kind, key):
+        batch = None
+        with self._lock:
+            future = self._in_flight.get((kind, key))
+            if future:
+                return future
+            future = self._in_flight[(kind, key)] = Future()
+
+            if kind in BATCH_ENDPOINTS:
+                pending = self._pending[kind]
+                pending[key] = future
+                if len(pending) >= BATCH_ENDPOINTS[kind][2]:
+                    batch = self._take(kind)
+                elif kind not in self._timers:
+                    timer = self._timers[kind] = threading.Timer(self.window, carry_helper(self._flush), [kind])
+                    timer.daemon = True
+                    timer.start()
+            elif kind in SINGLE_ENDPOINTS:
+                self._executor.submit(carry_helper(self._run_single), kind, key, future)
+            else:
+                del self._in_flight[(kind, key)]
+                raise ValueError(f"RequestCoalescer doesn't know how to look up a {kind}")
+
+        if batch:
+            self._executor.submit(carry_helper(self._run_batch), kind, batch)
+        return future
+
+    def get_many(self, kind, keys):
+        ''' Looks up every key and waits for all of them, returning the results in the same order.
+            Repeated keys are only looked up once, even if the first lookup has already finished.
+        '''
+        keys = list(keys)
+        futures = {key: self.get(kind, key) for key in dict.fromkeys(keys)}
+        self.flush()
+        return [futures[key].result() for key in keys]
+
+    def track(self, track_id):
+        return self.get('track', track_id)
+
+    def album(self, album_id):
+        return self.get('album', album_id)
+
+    def artist(self, artist_id):
+        return self.get('artist', artist_id)
+
+    def user(self, user_id):
+        return self.get('user', user_id)
+
+    def playlist(self, owner_id, playlist_id):
+        return self.get('playlist', (owner_id, playlist_id))
+
+    def _take(self, kind):
+        # Must be called with the lock held
+        batch = self._pending[kind]
+        self._pending[kind] = {}
+        timer = self._timers.pop(kind, None)
+        if timer:
+            timer.cancel()
+        return batch
+
+    def _flush(self, kind):
+        with self._lock:
+            batch = self._take(kind)
+        if batch:
+            self._executor.submit(carry_helper(self._run_batch), kind, batch)
+
+    def flush(self):
+        ''' Sends whatever is waiting right away instead of at the end of the window.
+        '''
+        for kind in BATCH_ENDPOINTS:
+            self._flush(kind)
+
+    def _finish(self, kind, key, future, result=None, error=None):
+        with self._lock:
+            self._in_flight.pop((kind, key), None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _run_batch(self, kind, batch):
+        method, field, _, takes_market = BATCH_ENDPOINTS[kind]
+        kwargs = {'market': self.market} if takes_market and self.market else {}
+        try:
+            results = getattr(self.sp, method)(list(batch), **kwargs)[field]
+        except Exception as error:
+            for key, future in batch.items():
+                self._finish(kind, key, future, error=error)
+            return
+        # Unknown IDs come back as None in their slot
+        for (key, future), result in zip(batch.items(), results):
+            self._finish(kind, key, future, result)
+
+    def _run_single(self, kind, key, future):
+        try:
+            result = SINGLE_ENDPOINTS[kind](self, key)
+        except Exception as error:
+            self._finish(kind, key, future, error=error)
+        else:
+            self._finish(kind, key, future, result)
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
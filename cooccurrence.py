@@ -0,0 +1,173 @@
+import numpy as np
+from scipy import sparse
+
+import json
+import os
+
+
+DEFAULT_INDEX_PATH = 'cooccurrence'
+
+
+class CooccurrenceIndex:
+
+    ''' Song-to-song similarity from which songs share playlists, for "songs like this" lookups
+        without multi-hop graph traversals.
+
+        The playlist x song incidence matrix A is kept as a scipy sparse matrix. A.T @ A counts how many playlists
+        every pair of songs shares, which is normalized to cosine similarity and cut down to the top k neighbors
+        per song. Those neighbor lists are what lookups read, so they're a couple of array indexes each.
+
+        update_playlist() only recomputes the songs whose similarities a playlist change could have moved.
+    '''
+
+    def __init__(self, k=20):
+        self.k = k
+        self.songs = []
+        self.playlists = []
+        self._song_codes = {}
+        self._playlist_codes = {}
+        self._members = []
+        self.incidence = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.neighbors = np.empty((0, k), dtype=np.int32)
+        self.scores = np.empty((0, k), dtype=np.float32)
+
+    @classmethod
+    def from_graph(cls, graph, k=20):
+        ''' Builds the index from the INCLUDES relationships in a graph_backends.GraphBackend.
+        '''
+        playlists = {}
+        for playlist, song, _ in graph.relationships('INCLUDES', 'Playlist', 'Song'):
+            playlists.setdefault(playlist['id'], set()).add(song['id'])
+        return cls.from_playlists(playlists, k)
+
+    @classmethod
+    def from_playlists(cls, playlists, k=20):
+        ''' Builds the index from a mapping of playlist ID -> iterable of song IDs.
+        '''
+        index = cls(k)
+        for playlist_id, song_ids in playlists.items():
+            index._set_members(playlist_id, song_ids)
+        index._rebuild_incidence()
+        index._recompute(np.arange(len(index.songs)))
+        return index
+
+    def _song_code(self, song_id):
+        code = self._song_codes.get(song_id)
+        if code is None:
+            code = self._song_codes[song_id] = len(self.songs)
+            self.songs.append(song_id)
+        return code
+
+    def _set_members(self, playlist_id, song_ids):
+        code = self._playlist_codes.get(playlist_id)
+        if code is None:
+            code = self._playlist_codes[playlist_id] = len(self.playlists)
+            self.playlists.append(playlist_id)
+            self._members.append(set())
+        old = self._members[code]
+        self._members[code] = {self._song_code(song_id) for song_id in song_ids if song_id}
+        return old, self._members[code]
+
+    def _rebuild_incidence(self):
+        rows = np.repeat(np.arange(len(self._members), dtype=np.int32), [len(m) for m in self._members])
+        cols = np.fromiter((song for members in self._members for song in members), dtype=np.int32, count=len(rows))
+        self.incidence = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(self.playlists), len(self.songs)),
+            )
+        self._by_song = self.incidence.tocsc()
+        self._degrees = np.asarray(self.incidence.sum(axis=0)).ravel()
+
+        # Songs that are new since the last build need rows in the neighbor tables
+        missing = len(self.songs) - len(self.neighbors)
+        if missing > 0:
+            self.neighbors = np.vstack([self.neighbors, np.full((missing, self.k), -1, dtype=np.int32)])
+            self.scores = np.vstack([self.scores, np.zeros((missing, self.k), dtype=np.float32)])
+
+    def _recompute(self, songs, chunk_size=2048):
+        ''' Recomputes the top k neighbors of the given song codes, a chunk of songs at a time.
+        '''
+        norms = np.sqrt(np.maximum(self._degrees, 1))
+        for start in range(0, len(songs), chunk_size):
+            chunk = songs[start:start+chunk_size]
+            counts = (self._by_song[:, chunk].T @ self.incidence).tocsr()
+            for row, song in enumerate(chunk):
+                begin, end = counts.indptr[row], counts.indptr[row+1]
+                others = counts.indices[begin:end]
+                similarity = counts.data[begin:end] / (norms[song] * norms[others])
+                keep = others != song
+                others, similarity = others[keep], similarity[keep]
+                if len(others) > self.k:
+                    top = np.argpartition(similarity, -self.k)[-self.k:]
+                    others, similarity = others[top], similarity[top]
+                order = np.argsort(similarity)[::-1]
+                self.neighbors[song] = -1
+                self.scores[song] = 0
+                self.neighbors[song, :len(order)] = others[order]
+                self.scores[song, :len(order)] = similarity[order]
+
+    def update_playlist(self, playlist_id, song_ids):
+        ''' Replaces a playlist's songs and refreshes every neighbor list the change could have touched:
+            the songs that were added or removed, and everything that shares a playlist with them.
+        '''
+        old, new = self._set_members(playlist_id, song_ids)
+        changed = np.fromiter(old ^ new, dtype=np.int32)
+        if not len(changed):
+            return 0
+        self._rebuild_incidence()
+        partners = (self._by_song[:, changed].T @ self.incidence).indices
+        affected = np.union1d(np.union1d(changed, partners), np.fromiter(old | new, dtype=np.int32))
+        self._recompute(affected)
+        return len(affected)
+
+    def remove_playlist(self, playlist_id):
+        return self.update_playlist(playlist_id, ())
+
+    def similar(self, song_id, k=None):
+        ''' Returns up to k (song_id, similarity) pairs for the songs that share the most playlists with song_id.
+        '''
+        code = self._song_codes.get(song_id)
+        if code is None:
+            return []
+        k = k or self.k
+        return [(self.songs[n], float(s)) for n, s in zip(self.neighbors[code, :k], self.scores[code, :k]) if n >= 0]
+
+    def suggest_playlists(self, song_id, k=5):
+        ''' Ranks the playlists a song isn't in yet by how much they have in common with its neighbors,
+            e.g. to find a home for one of the lonely_songs.
+        '''
+        code = self._song_codes.get(song_id)
+        if code is None:
+            return []
+        valid = self.neighbors[code] >= 0
+        weights = np.zeros(len(self.songs), dtype=np.float32)
+        weights[self.neighbors[code][valid]] = self.scores[code][valid]
+        playlist_scores = self.incidence @ weights
+        playlist_scores[self._by_song[:, code].indices] = 0
+        best = np.argsort(playlist_scores)[::-1][:k]
+        return [(self.playlists[p], float(playlist_scores[p])) for p in best if playlist_scores[p] > 0]
+
+    def save(self, path=DEFAULT_INDEX_PATH):
+        os.makedirs(path, exist_ok=True)
+        sparse.save_npz(os.path.join(path, 'incidence.npz'), self.incidence)
+        np.save(os.path.join(path, 'neighbors.npy'), self.neighbors)
+        np.save(os.path.join(path, 'scores.npy'), self.scores)
+        with open(os.path.join(path, 'ids.json'), 'w', encoding='utf-8') as fp:
+            json.dump({'k': self.k, 'songs': self.songs, 'playlists': self.playlists}, fp)
+
+    @classmethod
+    def load(cls, path=DEFAULT_INDEX_PATH):
+        with open(os.path.join(path, 'ids.json'), encoding='utf-8') as fp:
+            ids = json.load(fp)
+        index = cls(ids['k'])
+        index.songs = ids['songs']
+        index.playlists = ids['playlists']
+        index._song_codes = {song: code for code, song in enumerate(index.songs)}
+        index._playlist_codes = {playlist: code for code, playlist in enumerate(index.playlists)}
+        index.neighbors = np.load(os.path.join(path, 'neighbors.npy'))
+        index.scores = np.load(os.path.join(path, 'scores.npy'))
+        incidence = sparse.load_npz(os.path.join(path, 'incidence.npz')).tocsr()
+        index._members = [set(incidence.indices[incidence.indptr[p]:incidence.indptr[p+1]].tolist())
+            for p in range(len(index.playlists))]
+        index._rebuild_incidence()
+        return index
@@ -0,0 +1,276 @@
+import spotipy
+
+import heapq
+import json
+import math
+import os
+from time import sleep, time
+
+
+# How much each signal is worth when ranking what to visit next. Overridden by the [CRAWL] section of config.cfg.
+DEFAULT_WEIGHTS = {
+    'overlap': 10.0,    # times the share of a playlist's songs that were already in the graph, from 0 to 1
+    'size': 1.0,        # times log10(1 + number of tracks) for playlists
+    'depth': 2.0,       # subtracted once per hop away from the seed users
+}
+
+
+class CrawlFrontier:
+
+    ''' A persistent priority queue of users and playlists to visit, plus the set already visited.
+
+        Entries are keyed 'user:<id>' or 'playlist:<id>'. Pushing a key again only takes effect with a better score,
+        and the stale entry is skipped when it comes up, so the heap never has to be searched.
+    '''
+
+    def __init__(self, path='crawl_frontier.json'):
+        self.path = path
+        self.visited = set()
+        self._heap = []
+        self._best = {}
+        self._counter = 0
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as fp:
+                state = json.load(fp)
+            self.visited = set(state['visited'])
+            self._heap = [tuple(entry) for entry in state['frontier']]
+            heapq.heapify(self._heap)
+            self._counter = len(self._heap)
+            for negscore, _, key, _, _ in self._heap:
+                self._best[key] = max(self._best.get(key, -math.inf), -negscore)
+
+    def __len__(self):
+        return len(self._best)
+
+    def __contains__(self, key):
+        return key in self._best
+
+    def push(self, key, score, depth, extra=None):
+        if key in self.visited or score <= self._best.get(key, -math.inf):
+            return False
+        self._best[key] = score
+        self._counter += 1
+        heapq.heappush(self._heap, (-score, self._counter, key, depth, extra or {}))
+        return True
+
+    def pop(self):
+        ''' Returns (key, score, depth, extra) for the best entry that hasn't been visited, or None once it's empty.
+        '''
+        while self._heap:
+            negscore, _, key, depth, extra = heapq.heappop(self._heap)
+            if key in self.visited or -negscore < self._best.get(key, -math.inf):
+                continue
+            del self._best[key]
+            return key, -negscore, depth, extra
+        return None
+
+    def mark_visited(self, key):
+        self.visited.add(key)
+        self._best.pop(key, None)
+
+    def save(self):
+        # Only the live entry for each key is worth keeping
+        frontier = [entry for entry in self._heap if entry[2] in self._best and -entry[0] == self._best[entry[2]]]
+        with open(self.path, 'w', encoding='utf-8') as fp:
+            json.dump({'visited': sorted(self.visited), 'frontier': frontier}, fp)
+
+
+class GraphCrawler:
+
+    ''' Grows the graph outward from the friends already in it, spending a fixed number of API requests per run
+        on whatever looks most likely to turn up songs that connect to the ones the graph already has.
+
+        Visiting a user merges their public playlists, with FOLLOWS and OWNS rels and any new owners,
+        and queues the playlists. Visiting a playlist reads its tracks' IDs, names and popularity and who added them,
+        scores it by the share of its songs already in the graph, and queues its owner and contributors with that score.
+        The songs and INCLUDES rels it read are merged then and there, the same as merge_songs() would,
+        so the stages after the crawl pick them up without the playlist being fetched again.
+        merged holds the song IDs of every playlist merged this run, for the co-occurrence index.
+
+        A visit that runs out of budget partway through a user's or playlist's pages is put back in the frontier
+        and merges nothing, so it's done in full at the start of the next run instead of being left half-read.
+
+        The API has no way to list a user's followers, so owners and contributors of playlists are the only way out
+        from a user besides their own playlists.
+    '''
+
+    def __init__(self, graph, sp, frontier=None, weights=None, max_depth=3, budget=500, rate=0):
+        self.graph = graph
+        self.sp = sp
+        self.frontier = frontier if frontier is not None else CrawlFrontier()
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.max_depth = max_depth
+        self.budget = budget
+        self.rate = rate
+        self.requests = 0
+        self.merged = {}
+        self._last_request = 0.0
+
+    @classmethod
+    def from_config(cls, graph, sp, config):
+        ''' [CRAWL]
+            path = crawl_frontier.json
+            max_depth = 3
+            budget = 500        API requests per run
+            rate = 2            API requests per second, 0 for as fast as Spotify allows
+            overlap = 10        any of the DEFAULT_WEIGHTS
+        '''
+        section = config['CRAWL'] if config.has_section('CRAWL') else {}
+        weights = {name: float(section[name]) for name in DEFAULT_WEIGHTS if name in section}
+        return cls(
+            graph,
+            sp,
+            frontier=CrawlFrontier(section.get('path', 'crawl_frontier.json')),
+            weights=weights,
+            max_depth=int(section.get('max_depth', 3)),
+            budget=int(section.get('budget', 500)),
+            rate=float(section.get('rate', 0)),
+            )
+
+    def _request(self, call, *args, **kwargs):
+        if self.rate:
+            wait = self._last_request + 1/self.rate - time()
+            if wait > 0:
+                sleep(wait)
+            self._last_request = time()
+        self.requests += 1
+        return call(*args, **kwargs)
+
+    def _pages(self, call, *args, **kwargs):
+        ''' Like subSpotify.aggregate_paging_results(), but every page counts against the budget.
+            Returns None if the budget ran out before the last page.
+        '''
+        page = self._request(call, *args, **kwargs)
+        items = page['items']
+        while page['next']:
+            if self.requests >= self.budget:
+                return None
+            page = self._request(self.sp.next, page)
+            items.extend(page['items'])
+        return items
+
+    def score_user(self, overlap, depth):
+        return self.weights['overlap']*overlap - self.weights['depth']*depth
+
+    def score_playlist(self, overlap, total_tracks, depth):
+        return (self.weights['overlap']*overlap
+            + self.weights['size']*math.log10(1 + (total_tracks or 0))
+            - self.weights['depth']*depth)
+
+    def seed(self, user_ids):
+        ''' Queues users to start from. Seeds count as a perfect overlap, so they go first.
+        '''
+        for user_id in user_ids:
+            self.frontier.push(f'user:{user_id}', self.score_user(1.0, 0), 0, {'overlap': 1.0})
+
+    def _queue_users(self, user_ids, overlap, depth):
+        if depth > self.max_depth:
+            return
+        for user_id in user_ids:
+            self.frontier.push(f'user:{user_id}', self.score_user(overlap, depth), depth, {'overlap': overlap})
+
+    def visit_user(self, user_id, depth, overlap):
+        ''' Returns False if the budget ran out before all of the user's playlists were listed.
+        '''
+        try:
+            playlists = self._pages(self.sp.user_playlists, user_id, limit=50)
+        except spotipy.SpotifyException as error:
+            # Deleted accounts and IDs that were never users still turn up as owners and contributors
+            print(f"Skipping user {user_id}: {error}")
+            return True
+        if playlists is None:
+            return False
+        playlists = [p for p in playlists if p]
+        if not playlists:
+            return True
+
+        known_playlists = self.graph.existing_keys('Playlist', {p['id'] for p in playlists})
+        new_playlists = [p for p in playlists if p['id'] not in known_playlists]
+        self.graph.merge_nodes('Playlist', [{'id': p['id'], 'name': p['name'], 'snapshot_id': p['snapshot_id']} for p in playlists])
+        owners = {p['owner']['id']: p['owner'] for p in playlists}
+        known_owners = self.graph.existing_keys('User', owners)
+        self.graph.merge_nodes('User', [{'id': o['id'], 'name': o.get('display_name') or o['id']}
+            for o_id, o in owners.items() if o_id not in known_owners])
+        self.graph.merge_relationships('FOLLOWS', 'User', 'Playlist', [(user_id, p['id'], {}) for p in playlists])
+        self.graph.merge_relationships('OWNS', 'User', 'Playlist', [(p['owner']['id'], p['id'], {}) for p in playlists])
+        print(f"Visited user {user_id}: {len(playlists)} playlists, {len(new_playlists)} of them new.")
+
+        if depth + 1 > self.max_depth:
+            return True
+        for playlist in playlists:
+            self.frontier.push(
+                f"playlist:{playlist['id']}",
+                self.score_playlist(overlap, playlist['tracks']['total'], depth + 1),
+                depth + 1,
+                {'owner': playlist['owner']['id'], 'snapshot_id': playlist['snapshot_id']},
+                )
+        return True
+
+    def visit_playlist(self, playlist_id, depth, owner_id, snapshot_id=None):
+        ''' Returns False if the budget ran out before all of the playlist's tracks were read.
+        '''
+        try:
+            items = self._pages(self.sp.playlist_items, playlist_id, additional_types=('track',),
+                fields='items(added_at,added_by.id,track(id,name,popularity)),next', limit=100)
+        except spotipy.SpotifyException as error:
+            print(f"Skipping playlist {playlist_id}: {error}")
+            return True
+        if items is None:
+            return False
+        # Tracks without an id are usually local files instead of Spotify tracks.
+        items = [item for item in items if item['track'] and item['track']['id']]
+        song_ids = {item['track']['id'] for item in items}
+        known_songs = self.graph.existing_keys('Song', song_ids)
+        overlap = len(known_songs) / len(song_ids) if song_ids else 0.0
+        print(f"Visited playlist {playlist_id}: {len(song_ids)} songs, {overlap:.0%} already known.")
+
+        new_songs = {item['track']['id']: item['track'] for item in items if item['track']['id'] not in known_songs}
+        self.graph.merge_nodes('Song', [{'id': t['id'], 'name': t['name'], 'pop': t.get('popularity')} for t in new_songs.values()])
+        self.graph.merge_relationships('INCLUDES', 'Playlist', 'Song', [
+            (playlist_id, item['track']['id'], {'added_at': item['added_at'], 'added_by': (item.get('added_by') or {}).get('id')})
+            for item in items])
+        if snapshot_id:
+            self.graph.merge_nodes('Playlist', [{'id': playlist_id, 'songs_snapshot_id': snapshot_id}])
+        self.merged[playlist_id] = list(dict.fromkeys(item['track']['id'] for item in items))
+
+        contributors = {(item.get('added_by') or {}).get('id') for item in items} - {None, owner_id}
+        if contributors:
+            known = self.graph.existing_keys('User', contributors)
+            self.graph.merge_nodes('User', [{'id': c, 'name': c} for c in contributors if c not in known])
+        self._queue_users([owner_id, *contributors], overlap, depth + 1)
+        return True
+
+    def run(self):
+        ''' Visits the best-scoring entries until the request budget is spent or the frontier is empty,
+            then saves the frontier so the next run carries on where this one stopped.
+        '''
+        print(f"\ncrawl() called with {len(self.frontier)} entries in the frontier and a budget of {self.budget} requests.")
+        mark0 = time()
+        visits = 0
+        try:
+            while self.requests < self.budget:
+                entry = self.frontier.pop()
+                if entry is None:
+                    break
+                key, score, depth, extra = entry
+                kind, object_id = key.split(':', 1)
+                self.frontier.mark_visited(key)
+                started_at = self.requests
+                if kind == 'user':
+                    finished = self.visit_user(object_id, depth, extra.get('overlap', 0.0))
+                else:
+                    finished = self.visit_playlist(object_id, depth, extra['owner'], extra.get('snapshot_id'))
+                if finished:
+                    visits += 1
+                elif started_at:
+                    # Next run starts on a fresh budget, so put it back to be read in full then
+                    self.frontier.visited.discard(key)
+                    self.frontier.push(key, score, depth, extra)
+                else:
+                    print(f"{key} has more pages than the whole budget of {self.budget} requests; leaving it out.")
+        finally:
+            if self.frontier.path:
+                self.frontier.save()
+        print(f"Crawled {visits} users and playlists with {self.requests} requests in {time()-mark0:.1f} seconds. "
+            f"{len(self.frontier)} left in the frontier.")
+        return visits
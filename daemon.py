@@ -0,0 +1,333 @@
+''' A local daemon that keeps one client and the user's library, playlists and releases in memory,
+so lonely-songs, song-appearance, playlist-diff and new-release questions are answered without going to Spotify.
+
+    python cli.py serve                 (or python daemon.py)
+    python cli.py query lonely-songs
+    python cli.py query song-appearance song=spotify:track:...
+
+It listens on localhost only. State is refreshed in the background every [DAEMON] refresh_interval seconds,
+and each refresh only re-fetches what changed: new saved tracks, playlists whose snapshot_id moved,
+and artists whose releases haven't been checked in a day.
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import configparser
+import datetime
+import json
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+
+DEFAULT_ADDRESS = ('127.0.0.1', 8765)
+
+SCOPE = '''
+    user-library-read
+    playlist-read-private
+    playlist-read-collaborative
+    user-follow-read
+    '''
+
+# Enough of each track to answer queries with, without holding on to the full objects
+PLAYLIST_FIELDS = 'items(track(id,name,uri,artists(id,name)))'
+
+
+def track_id_from(song):
+    ''' Accepts a track ID, a spotify:track: URI or an open.spotify.com link.
+    '''
+    song = song.strip()
+    if song.startswith('spotify:track:'):
+        return song.rsplit(':', 1)[1]
+    if '/track/' in song:
+        return urllib.parse.urlsplit(song).path.rsplit('/', 1)[1]
+    return song
+
+
+def _summary(track):
+    return {'id': track['id'], 'name': track['name'], 'uri': track.get('uri'),
+        'artists': [{'id': a['id'], 'name': a['name']} for a in track['artists']]}
+
+
+class LibraryState:
+
+    ''' Everything the daemon answers from, plus how to bring it up to date.
+
+        refresh() does its fetching without holding the lock, on copies of the snapshot and release index,
+        and only takes it to swap the new state in, so queries never wait on Spotify or see a half-refreshed library.
+        Queries take their references to the state under the lock and read from those.
+    '''
+
+    def __init__(self, sp, snapshot=None, release_index=None, album_filter=None, max_workers=8):
+        from library_snapshot import LibrarySnapshot
+        from release_index import ReleaseIndex
+        from album_filters import AlbumFilter
+        self.sp = sp
+        self.snapshot = snapshot if snapshot is not None else LibrarySnapshot()
+        self.release_index = release_index if release_index is not None else ReleaseIndex()
+        self.album_filter = album_filter if album_filter is not None else AlbumFilter.from_config()
+        self.max_workers = max_workers
+        self.playlists = {}         # playlist ID -> {'id', 'name', 'owner', 'snapshot_id', 'tracks': [track ID, ...]}
+        self.tracks = {}            # track ID -> summary, for every track in a playlist
+        self.appearances = {}       # track ID -> set of playlist IDs
+        self.user_id = None
+        self.lonely_playlist_ids = set()    # what lonely_songs.main() collects into, which doesn't count as a home
+        self.refreshed = None
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        ''' Brings the library, playlists and release index up to date. Returns what changed.
+        '''
+        with self._refresh_lock:
+            mark0 = time()
+            if getattr(self.sp, '_scope', None):
+                # Tokens only last an hour, and refresh() goes through spotipy's cache, which renews them
+                self.sp = self.sp.refresh()
+
+            snapshot = self.snapshot.copy()
+            snapshot.refresh(self.sp)
+            snapshot.save()
+
+            if self.user_id is None:
+                self.user_id = self.sp.me()['id']
+            playlists, tracks, changed = self._fetch_playlists()
+            from lonely_songs import is_lonely_songs_playlist
+            lonely_playlist_ids = {p['id'] for p in playlists.values() if is_lonely_songs_playlist(p, self.user_id)}
+            appearances = {}
+            for playlist_id, playlist in playlists.items():
+                for track_id in playlist['tracks']:
+                    appearances.setdefault(track_id, set()).add(playlist_id)
+
+            release_index = self.release_index.copy()
+            release_index.refresh(self.sp, snapshot.artists(), max_workers=self.max_workers)
+            release_index.save()
+
+            with self._lock:
+                self.snapshot, self.release_index = snapshot, release_index
+                self.playlists, self.tracks, self.appearances = playlists, tracks, appearances
+                self.lonely_playlist_ids = lonely_playlist_ids
+                self.refreshed = datetime.datetime.now()
+            self.ready.set()
+            print(f"Refreshed in {time()-mark0:.1f} seconds: {changed} of {len(playlists)} playlists changed, "
+                f"{len(snapshot)} saved tracks.")
+            return {'playlists_changed': changed, 'seconds': time()-mark0}
+
+    def _fetch_playlists(self):
+        ''' Lists the user's playlists and only re-reads the ones whose snapshot_id changed since last time.
+        '''
+        current = self.sp.aggregate_paging_results(self.sp.current_user_playlists())
+        stale = [p for p in current if p['id'] not in self.playlists or self.playlists[p['id']]['snapshot_id'] != p['snapshot_id']]
+
+        from tracing import carry_helper
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            fetched = list(executor.map(
+                carry_helper(lambda p: self.sp.get_tracks_from_playlist(playlist=p, fields=PLAYLIST_FIELDS)),
+                stale,
+                ))
+
+        playlists = {}
+        tracks = {}
+        for playlist in current:
+            previous = self.playlists.get(playlist['id'])
+            if previous is not None and previous['snapshot_id'] == playlist['snapshot_id']:
+                playlists[playlist['id']] = previous
+                tracks.update((track_id, self.tracks[track_id]) for track_id in previous['tracks'])
+        for playlist, playlist_tracks in zip(stale, fetched):
+            # Tracks without an id are usually local files instead of Spotify tracks.
+            playlist_tracks = [t for t in playlist_tracks if t and t['id']]
+            playlists[playlist['id']] = {
+                'id': playlist['id'],
+                'name': playlist['name'],
+                'owner': playlist['owner']['id'],
+                'snapshot_id': playlist['snapshot_id'],
+                'tracks': [t['id'] for t in playlist_tracks],
+                }
+            tracks.update((t['id'], _summary(t)) for t in playlist_tracks)
+        return playlists, tracks, len(stale)
+
+    def status(self):
+        with self._lock:
+            return {
+                'ready': self.ready.is_set(),
+                'refreshed': self.refreshed.isoformat(timespec='seconds') if self.refreshed else None,
+                'saved_tracks': len(self.snapshot),
+                'playlists': len(self.playlists),
+                'artists_indexed': len(self.release_index),
+                }
+
+    def lonely_songs(self):
+        ''' Same answer as subSpotify.lonely_songs() with the 'All the Lonely Songs' playlist excluded, like lonely_songs.main() asks for.
+        '''
+        with self._lock:
+            snapshot, appearances, excluded = self.snapshot, self.appearances, self.lonely_playlist_ids
+        return [_summary(track) for track in snapshot.tracks() if not appearances.get(track['id'], excluded) - excluded]
+
+    def song_appearance(self, song):
+        track_id = track_id_from(song)
+        with self._lock:
+            playlist_ids = self.appearances.get(track_id, ())
+            return [{'id': p, 'name': self.playlists[p]['name']} for p in playlist_ids]
+
+    def playlist_diff(self, first, second):
+        ''' Tracks that are in one of the two playlists but not the other, split by which one they're in.
+        '''
+        with self._lock:
+            try:
+                a, b = self.playlists[first]['tracks'], self.playlists[second]['tracks']
+            except KeyError as error:
+                raise LookupError(f"Not one of your playlists: {error.args[0]}") from None
+            only_a, only_b = set(a) - set(b), set(b) - set(a)
+            return {
+                first: [self.tracks[t] for t in a if t in only_a],
+                second: [self.tracks[t] for t in b if t in only_b],
+                }
+
+    def new_releases(self, since):
+        with self._lock:
+            snapshot, release_index = self.snapshot, self.release_index
+        new_albums = release_index.albums_after(since, snapshot.artists())
+        releases = []
+        for artist, albums_with_dates in new_albums.values():
+            verdicts = self.album_filter.classify_batch([a for a, _ in albums_with_dates])
+            albums = [{'id': a['id'], 'name': a['name'], 'release_date': str(d)}
+                for (a, d), verdict in zip(albums_with_dates, verdicts) if not verdict]
+            if albums:
+                releases.append({'artist': {'id': artist['id'], 'name': artist['name']}, 'albums': albums})
+        releases.sort(key=lambda r: r['artist']['name'])
+        return releases
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    # GET path -> (LibraryState method, required query parameters)
+    ROUTES = {
+        '/status': ('status', ()),
+        '/lonely-songs': ('lonely_songs', ()),
+        '/song-appearance': ('song_appearance', ('song',)),
+        '/playlist-diff': ('playlist_diff', ('first', 'second')),
+        '/new-releases': ('new_releases', ('since',)),
+        }
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        route = self.ROUTES.get(url.path)
+        if route is None:
+            return self._send(404, {'error': f"Unknown query {url.path}", 'queries': sorted(self.ROUTES)})
+        method, required = route
+        missing = [name for name in required if name not in params]
+        if missing:
+            return self._send(400, {'error': f"Missing parameters: {', '.join(missing)}"})
+
+        state = self.server.state
+        if method != 'status' and not state.ready.wait(self.server.ready_timeout):
+            return self._send(503, {'error': "Still loading; try again shortly"})
+        try:
+            self._send(200, getattr(state, method)(*(params[name] for name in required)))
+        except (LookupError, ValueError) as error:
+            self._send(400, {'error': str(error)})
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path != '/refresh':
+            return self._send(404, {'error': f"Unknown action {self.path}"})
+        self._send(200, self.server.state.refresh())
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryDaemon(ThreadingHTTPServer):
+
+    ''' Serves a LibraryState over HTTP on localhost and refreshes it every refresh_interval seconds.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, state, address=DEFAULT_ADDRESS, refresh_interval=300, ready_timeout=30):
+        super().__init__(address, _Handler)
+        self.state = state
+        self.refresh_interval = refresh_interval
+        self.ready_timeout = ready_timeout
+        self._stop = threading.Event()
+        self._refresher = threading.Thread(target=self._refresh_forever, name='QueryDaemonRefresh', daemon=True)
+
+    def _refresh_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.state.refresh()
+            except Exception as error:
+                print(f"Background refresh failed, keeping the old state:\n{error}")
+            self._stop.wait(self.refresh_interval)
+
+    def serve_forever(self, poll_interval=0.5):
+        if not self._refresher.is_alive():
+            self._refresher.start()
+        super().serve_forever(poll_interval)
+
+    def shutdown(self):
+        self._stop.set()
+        super().shutdown()
+
+
+def address_from_config(config):
+    return (config.get('DAEMON', 'host', fallback=DEFAULT_ADDRESS[0]), config.getint('DAEMON', 'port', fallback=DEFAULT_ADDRESS[1]))
+
+
+def serve(sp=None, config=None):
+    ''' [DAEMON]
+        port = 8765
+        refresh_interval = 300      seconds between background refreshes
+    '''
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read('config.cfg')
+    if sp is None:
+        from spotipyhelper import subSpotify
+        sp = subSpotify(scope=SCOPE)
+    daemon = QueryDaemon(
+        LibraryState(sp),
+        address_from_config(config),
+        refresh_interval=config.getint('DAEMON', 'refresh_interval', fallback=300),
+        )
+    print(f"Serving queries on http://{daemon.server_address[0]}:{daemon.server_address[1]}")
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+
+
+def query(name, address=None, timeout=None, **params):
+    ''' Asks a running daemon a question, e.g. query('song-appearance', song='spotify:track:...').
+        Only needs the standard library, so it's quick to call from anywhere.
+        Pass name='refresh' to make the daemon refresh right away.
+    '''
+    host, port = address or DEFAULT_ADDRESS
+    url = f"http://{host}:{port}/{name}"
+    if params:
+        url += '?' + urllib.parse.urlencode(params)
+    request = urllib.request.Request(url, method='POST' if name == 'refresh' else 'GET')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as error:
+        raise LookupError(json.load(error).get('error', str(error))) from None
+    except urllib.error.URLError as error:
+        raise ConnectionError(f"No daemon answering on {host}:{port} ({error.reason}). Start one with: python cli.py serve") from None
+
+
+if __name__ == '__main__':
+    serve()
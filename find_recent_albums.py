@@ -1,32 +1,47 @@
 from spotipyhelper import *
 from album_filters import *
+from release_index import ReleaseIndex
+from library_snapshot import LibrarySnapshot
 
-import os
 from prettytable import PrettyTable
 import re
 from datetime import datetime
 
 
-def find_new_albums():
+SCOPE = '''
+    user-library-read
+    playlist-read-private 
+    playlist-read-collaborative 
+    user-follow-read 
+    '''
+
+
+def find_new_albums(sp=None, datestring=None):
 
     print("Finding new albums.")
 
-    sp = subSpotify(scope='''
-        playlist-read-private 
-        playlist-read-collaborative 
-        user-follow-read 
-        ''')
+    sp = sp or subSpotify(scope=SCOPE)
 
-    datestring = input('Cutoff date (yyyy-mm-dd): ')
+    if not datestring:
+        datestring = input('Cutoff date (yyyy-mm-dd): ')
 
-    saved_artists = sp.get_saved_artists()
+    snapshot = LibrarySnapshot()
+    saved_artists = sp.get_saved_artists(snapshot)
+    snapshot.save()
 
     print(f'Found {len(saved_artists)} saved artists.')
 
-    new_albums = sp.albums_after(datestring, saved_artists)
-
-    # Filter out garbage albums
-    new_albums = {a_id:(artist, [(a,d) for a,d in a_w_d if not garbage_album(a)]) for a_id, (artist, a_w_d) in new_albums.items()}
+    # Only artists whose releases haven't been checked recently cost any requests
+    release_index = ReleaseIndex()
+    release_index.refresh(sp, saved_artists)
+    release_index.save()
+    new_albums = release_index.albums_after(datestring, saved_artists)
+
+    # Filter out garbage albums, classifying each album only once
+    album_filter = AlbumFilter.from_config()
+    for a_id, (artist, a_w_d) in new_albums.items():
+        verdicts = album_filter.classify_batch([a for a,_ in a_w_d])
+        new_albums[a_id] = (artist, [(a,d) for (a,d), verdict in zip(a_w_d, verdicts) if not verdict])
     # Remove any artists that have no new albums left
     new_albums = {a_id:(artist, a_w_d) for a_id, (artist, a_w_d) in new_albums.items() if a_w_d}
 
@@ -37,12 +52,10 @@ def find_new_albums():
         artists.sort(key= lambda a: a['name'])
         for artist in artists:
             _,albums_with_dates = new_albums[artist['id']]
-            albums_with_dates = [(a,d) for a,d in albums_with_dates if not garbage_album(a)]
-            if albums_with_dates:
-                first_album, first_date = albums_with_dates[0]
-                table.add_row([artist['name'], first_album['name'], first_date])
-                for album, date in albums_with_dates[1:]:
-                    table.add_row(['', album['name'], date])
+            first_album, first_date = albums_with_dates[0]
+            table.add_row([artist['name'], first_album['name'], first_date])
+            for album, date in albums_with_dates[1:]:
+                table.add_row(['', album['name'], date])
 
         with open('New_Albums.txt', 'a', encoding='utf-8') as write_file:
             write_file.write(f'\nNew albums between {datestring} and {datetime.now().date()}\n')
@@ -54,8 +67,6 @@ def find_new_albums():
     else:
         print("No new albums found.")
 
-    os.system('pause')
-
 
 if __name__=='__main__':
     find_new_albums()
\ No newline at end of file
@@ -0,0 +1,312 @@
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+
+
+# The property that identifies a node of each label. Anything not listed here is keyed by 'id'.
+NODE_KEYS = {
+    'Genre': 'name',
+}
+
+def node_key(label):
+    return NODE_KEYS.get(label, 'id')
+
+
+class NoneAsKey(TypeError):
+    ''' Raised when trying to construct a node by passing None as an attribute
+        when that attribute is supposed to be the key for that type of node.
+    '''
+    def __init__(self, msg=None):
+        super().__init__(msg)
+
+
+class GraphBackend(ABC):
+
+    ''' The operations the loader in load_data_neo4j.py needs from a graph store.
+
+        Nodes are identified by (label, key) where the key property depends on the label (see NODE_KEYS).
+        Nodes and relationships are handed around as plain dicts of their properties,
+        and every write is a batched upsert: existing properties are updated, missing ones are left alone.
+    '''
+
+    @abstractmethod
+    def merge_nodes(self, label, rows, extra_labels=()):
+        ''' Upserts a node with the given label for each dict of properties in rows.
+            extra_labels are added to every node, e.g. merge_nodes('User', rows, extra_labels=['Friend']).
+        '''
+
+    @abstractmethod
+    def merge_relationships(self, rel_type, start_label, end_label, rows):
+        ''' Upserts a relationship for each (start_key, end_key, properties) triple in rows.
+            Both end nodes must already exist; rows pointing at missing nodes are ignored.
+        '''
+
+    @abstractmethod
+    def get_node(self, label, key):
+        ''' Returns the properties of a single node, or None if it isn't in the graph.
+        '''
+
+    @abstractmethod
+    def existing_keys(self, label, keys):
+        ''' Returns the subset of keys that already have a node with the given label.
+        '''
+
+    @abstractmethod
+    def nodes(self, label):
+        ''' Returns the properties of every node that has the given label.
+        '''
+
+    @abstractmethod
+    def relationships(self, rel_type, start_label, end_label):
+        ''' Returns a list of (start_node, end_node, relationship_properties) triples.
+        '''
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _check_keys(label, rows):
+    key = node_key(label)
+    for row in rows:
+        if not row.get(key):
+            raise NoneAsKey(f'{label} node must have a {key}.')
+
+
+class Neo4jBackend(GraphBackend):
+
+    ''' Writes to a live Neo4j server through py2neo.
+        Every batch is a single UNWIND query instead of one round trip per node or relationship.
+    '''
+
+    def __init__(self, uri='http://localhost:7474/db/data', user=None, password=None, graph=None):
+        if graph is None:
+            from py2neo import Graph
+            graph = Graph(uri, user=user, password=password)
+        self.graph = graph
+
+    def merge_nodes(self, label, rows, extra_labels=()):
+        rows = [{k: v for k, v in row.items() if v is not None} for row in rows]
+        if not rows:
+            return
+        _check_keys(label, rows)
+        key = node_key(label)
+        set_labels = ''.join(f'SET n:{extra} ' for extra in extra_labels)
+        self.graph.run(
+            f'UNWIND $rows AS row MERGE (n:{label} {{{key}: row.{key}}}) SET n += row {set_labels}',
+            rows=rows,
+            )
+
+    def merge_relationships(self, rel_type, start_label, end_label, rows):
+        rows = [{'start': s, 'end': e, 'props': props or {}} for s, e, props in rows]
+        if not rows:
+            return
+        self.graph.run(
+            f'UNWIND $rows AS row '
+            f'MATCH (a:{start_label} {{{node_key(start_label)}: row.start}}) '
+            f'MATCH (b:{end_label} {{{node_key(end_label)}: row.end}}) '
+            f'MERGE (a)-[r:{rel_type}]->(b) SET r += row.props',
+            rows=rows,
+            )
+
+    def get_node(self, label, key):
+        node = self.graph.evaluate(f'MATCH (n:{label} {{{node_key(label)}: $key}}) RETURN n', key=key)
+        return dict(node) if node else None
+
+    def existing_keys(self, label, keys):
+        key = node_key(label)
+        return {record['k'] for record in self.graph.run(
+            f'UNWIND $keys AS k MATCH (n:{label} {{{key}: k}}) RETURN k',
+            keys=list(keys),
+            )}
+
+    def nodes(self, label):
+        return [dict(record['n']) for record in self.graph.run(f'MATCH (n:{label}) RETURN n')]
+
+    def relationships(self, rel_type, start_label, end_label):
+        return [(dict(record['a']), dict(record['b']), dict(record['r'])) for record in self.graph.run(
+            f'MATCH (a:{start_label})-[r:{rel_type}]->(b:{end_label}) RETURN a, r, b'
+            )]
+
+
+class SQLiteBackend(GraphBackend):
+
+    ''' An embedded graph store in a single SQLite file (or ':memory:').
+        Nodes and relationships live in WITHOUT ROWID tables whose primary keys double as covering indexes
+        for the lookups the loader does, so existence probes and merges never leave the process.
+    '''
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS nodes (
+            label TEXT NOT NULL,
+            key TEXT NOT NULL,
+            props TEXT NOT NULL,
+            PRIMARY KEY (label, key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS node_labels (
+            extra_label TEXT NOT NULL,
+            label TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (extra_label, label, key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS rels (
+            type TEXT NOT NULL,
+            start_label TEXT NOT NULL,
+            start_key TEXT NOT NULL,
+            end_label TEXT NOT NULL,
+            end_key TEXT NOT NULL,
+            props TEXT NOT NULL,
+            PRIMARY KEY (type, start_label, start_key, end_label, end_key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS rels_by_end ON rels (type, end_label, end_key, start_label, start_key);
+    '''
+
+    def __init__(self, path='graph.sqlite3'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SQLiteBackend.SCHEMA)
+
+    def merge_nodes(self, label, rows, extra_labels=()):
+        rows = [{k: v for k, v in row.items() if v is not None} for row in rows]
+        if not rows:
+            return
+        _check_keys(label, rows)
+        key = node_key(label)
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO nodes (label, key, props) VALUES (?, ?, ?) '
+                'ON CONFLICT (label, key) DO UPDATE SET props = json_patch(props, excluded.props)',
+                [(label, row[key], json.dumps(row)) for row in rows],
+                )
+            for extra in extra_labels:
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO node_labels (extra_label, label, key) VALUES (?, ?, ?)',
+                    [(extra, label, row[key]) for row in rows],
+                    )
+
+    def merge_relationships(self, rel_type, start_label, end_label, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        starts = self.existing_keys(start_label, {s for s, _, _ in rows})
+        ends = self.existing_keys(end_label, {e for _, e, _ in rows})
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO rels (type, start_label, start_key, end_label, end_key, props) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (type, start_label, start_key, end_label, end_key) '
+                'DO UPDATE SET props = json_patch(props, excluded.props)',
+                [(rel_type, start_label, s, end_label, e, json.dumps(props or {}))
+                    for s, e, props in rows if s in starts and e in ends],
+                )
+
+    def get_node(self, label, key):
+        row = self.conn.execute('SELECT props FROM nodes WHERE label=? AND key=?', (label, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def existing_keys(self, label, keys):
+        keys = list(keys)
+        found = set()
+        # Stay under SQLite's limit on the number of bound parameters per statement
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            found.update(k for (k,) in self.conn.execute(
+                f'SELECT key FROM nodes WHERE label=? AND key IN ({",".join("?"*len(chunk))})',
+                [label, *chunk],
+                ))
+        return found
+
+    def nodes(self, label):
+        rows = self.conn.execute(
+            'SELECT props FROM nodes WHERE label=? '
+            'UNION ALL '
+            'SELECT n.props FROM node_labels l JOIN nodes n ON n.label=l.label AND n.key=l.key WHERE l.extra_label=?',
+            (label, label),
+            )
+        return [json.loads(props) for (props,) in rows]
+
+    def relationships(self, rel_type, start_label, end_label):
+        rows = self.conn.execute(
+            'SELECT a.props, b.props, r.props FROM rels r '
+            'JOIN nodes a ON a.label=r.start_label AND a.key=r.start_key '
+            'JOIN nodes b ON b.label=r.end_label AND b.key=r.end_key '
+            'WHERE r.type=? AND r.start_label=? AND r.end_label=?',
+            (rel_type, start_label, end_label),
+            )
+        return [(json.loads(a), json.loads(b), json.loads(r)) for a, b, r in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+def backend_from_config(config):
+    ''' Builds the backend named in the [GRAPH] section of a ConfigParser, defaulting to Neo4j.
+        [GRAPH]
+        backend = sqlite
+        path = graph.sqlite3
+    '''
+    kind = config.get('GRAPH', 'backend', fallback='neo4j')
+    if kind == 'sqlite':
+        return SQLiteBackend(os.path.expanduser(config.get('GRAPH', 'path', fallback='graph.sqlite3')))
+    elif kind == 'neo4j':
+        return Neo4jBackend(
+            config.get('NEO4J', 'uri', fallback='http://localhost:7474/db/data'),
+            user=config.get('NEO4J', 'user'),
+            password=config.get('NEO4J', 'password'),
+            )
+    else:
+        raise ValueError(f"Unknown graph backend in config: {kind}")
+
+
+def loader_benchmark(friends=20, playlists_per_friend=10, songs_per_playlist=100, song_pool=20000, seed=0, backends=None):
+    ''' Times the calls load_data_neo4j.py makes, on synthetic friends, playlists and songs:
+        merging nodes, probing which songs exist, merging INCLUDES rels playlist by playlist, and reading them back.
+        By default compares an in-memory SQLite graph with one on disk; pass backends={name: backend} to add others.
+    '''
+    import random
+    import tempfile
+    from time import perf_counter
+
+    rng = random.Random(seed)
+    playlists = [{'id': f'playlist{f}_{p}', 'name': f'Playlist {p}', 'owner': f'friend{f}'}
+        for f in range(friends) for p in range(playlists_per_friend)]
+    includes = {p['id']: rng.sample(range(song_pool), songs_per_playlist) for p in playlists}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if backends is None:
+            backends = {'sqlite (memory)': SQLiteBackend(':memory:'), 'sqlite (file)': SQLiteBackend(os.path.join(tmp_dir, 'graph.sqlite3'))}
+        for name, graph in backends.items():
+            timings = {}
+            mark0 = perf_counter()
+            graph.merge_nodes('User', [{'id': f'friend{f}'} for f in range(friends)], extra_labels=['Friend'])
+            graph.merge_nodes('Playlist', [{'id': p['id'], 'name': p['name']} for p in playlists])
+            graph.merge_relationships('OWNS', 'User', 'Playlist', [(p['owner'], p['id'], {}) for p in playlists])
+            timings['nodes'] = perf_counter() - mark0
+
+            mark1 = perf_counter()
+            for playlist_id, song_numbers in includes.items():
+                song_ids = [f'song{n}' for n in song_numbers]
+                known = graph.existing_keys('Song', set(song_ids))
+                graph.merge_nodes('Song', [{'id': s, 'name': s} for s in song_ids if s not in known])
+                graph.merge_relationships('INCLUDES', 'Playlist', 'Song', [(playlist_id, s, {'added_by': None}) for s in song_ids])
+            timings['songs'] = perf_counter() - mark1
+
+            mark2 = perf_counter()
+            rels = graph.relationships('INCLUDES', 'Playlist', 'Song')
+            songs = graph.nodes('Song')
+            timings['reads'] = perf_counter() - mark2
+            graph.close()
+
+            print(f"{name:>16}: {len(playlists)} playlists, {len(songs)} songs, {len(rels)} INCLUDES rels; "
+                + ', '.join(f"{stage} {seconds:.2f} s" for stage, seconds in timings.items()))
+
+
+if __name__ == '__main__':
+    loader_benchmark()
@@ -0,0 +1,184 @@
+import numpy as np
+
+import json
+import os
+
+
+# column name -> dtype, for every per-row column a LibraryFrame holds
+COLUMNS = {
+    'user': np.int32,
+    'track': np.int32,
+    'album': np.int32,
+    'artist': np.int32,                 # the first credited artist; every artist is in artist_codes
+    'popularity': np.int16,             # -1 where Spotify didn't say
+    'duration_ms': np.int32,
+    'explicit': np.bool_,
+    'added_at': 'datetime64[s]',        # NaT for tracks that weren't added to anything, e.g. from get_tracks_by_id()
+    'release_date': 'datetime64[D]',    # release dates with no month or day fall on the first of the year or month
+    }
+
+VOCABULARIES = ('users', 'tracks', 'albums', 'artists', 'artist_names')
+
+
+class _Interner:
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def __call__(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class LibraryFrameBuilder:
+
+    ''' Accumulates rows from any number of users' saved tracks or playlists, then builds a LibraryFrame.
+    '''
+
+    def __init__(self):
+        self._users = _Interner()
+        self._tracks = _Interner()
+        self._albums = _Interner()
+        self._artists = _Interner()
+        self._artist_names = {}
+        self._rows = {name: [] for name in COLUMNS}
+        self._artist_codes = []
+        self._artist_offsets = [0]
+
+    def add_items(self, items, user=None):
+        ''' items can be saved track objects or playlist track objects ({'added_at': ..., 'track': ...}),
+            bare tracks from get_saved_tracks() and friends, or compact records.TrackRecord objects.
+            Local files and removed tracks are skipped.
+        '''
+        user_code = self._users(user)
+        rows = self._rows
+        for item in items:
+            if item is not None and 'track' in item and 'added_at' in item:
+                track, added_at = item['track'], item['added_at']
+            else:
+                track, added_at = item, None
+            if not track or not track['id']:
+                continue
+
+            album = track.get('album')
+            artists = track.get('artists') or ()
+            rows['user'].append(user_code)
+            rows['track'].append(self._tracks(track['id']))
+            rows['album'].append(self._albums(album['id']) if album else -1)
+            artist_codes = [self._artists(a['id']) for a in artists]
+            for artist, code in zip(artists, artist_codes):
+                self._artist_names.setdefault(code, artist['name'])
+            rows['artist'].append(artist_codes[0] if artist_codes else -1)
+            self._artist_codes.extend(artist_codes)
+            self._artist_offsets.append(len(self._artist_codes))
+
+            popularity = track.get('popularity')
+            rows['popularity'].append(-1 if popularity is None else popularity)
+            rows['duration_ms'].append(track.get('duration_ms') or 0)
+            rows['explicit'].append(bool(track.get('explicit')))
+            # numpy doesn't want the trailing Z on Spotify's UTC timestamps
+            rows['added_at'].append(added_at.rstrip('Z') if added_at else None)
+            release_date = album.get('release_date') if album else None
+            rows['release_date'].append(None if not release_date or release_date.startswith('0000') else release_date)
+        return self
+
+    def build(self):
+        columns = {name: np.array(values, dtype=COLUMNS[name]) for name, values in self._rows.items()}
+        columns['artist_codes'] = np.array(self._artist_codes, dtype=np.int32)
+        columns['artist_offsets'] = np.array(self._artist_offsets, dtype=np.int64)
+        vocabularies = {
+            'users': self._users.values,
+            'tracks': self._tracks.values,
+            'albums': self._albums.values,
+            'artists': self._artists.values,
+            'artist_names': [self._artist_names.get(code) for code in range(len(self._artists.values))],
+            }
+        return LibraryFrame(columns, vocabularies)
+
+
+class LibraryFrame:
+
+    ''' Saved tracks or playlist contents laid out as NumPy columns, one row per (user, track) item.
+
+        IDs are interned to integer codes (see COLUMNS), with the ID strings kept in vocabularies,
+        so aggregates over a million rows are vectorized operations instead of loops over nested dicts.
+        Every artist of every row is in artist_codes, with row i's artists at
+        artist_codes[artist_offsets[i]:artist_offsets[i+1]].
+
+        save() writes one .npy file per column, and load() memory-maps them back,
+        so a frame that's bigger than memory can still be queried.
+    '''
+
+    def __init__(self, columns, vocabularies):
+        self.columns = columns
+        self.vocabularies = vocabularies
+
+    @classmethod
+    def from_items(cls, items, user=None):
+        return LibraryFrameBuilder().add_items(items, user).build()
+
+    def __len__(self):
+        return len(self.columns['track'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(path, f'{name}.npy'), column)
+        with open(os.path.join(path, 'vocabularies.json'), 'w', encoding='utf-8') as fp:
+            json.dump(self.vocabularies, fp)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        columns = {}
+        for name in [*COLUMNS, 'artist_codes', 'artist_offsets']:
+            columns[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+        with open(os.path.join(path, 'vocabularies.json'), encoding='utf-8') as fp:
+            vocabularies = json.load(fp)
+        return cls(columns, vocabularies)
+
+    def user_mask(self, user):
+        ''' A boolean mask of the rows that belong to one user.
+        '''
+        return self.columns['user'] == self.vocabularies['users'].index(user)
+
+    def popularity_histogram(self, bins=10, mask=None):
+        popularity = self.columns['popularity'] if mask is None else self.columns['popularity'][mask]
+        return np.histogram(popularity[popularity >= 0], bins=bins, range=(0, 100))
+
+    def total_duration_ms(self, by_user=False):
+        ''' Total duration of every row, or an array indexed by user code if by_user is set.
+        '''
+        duration = self.columns['duration_ms'].astype(np.int64)
+        if by_user:
+            return np.bincount(self.columns['user'], weights=duration, minlength=len(self.vocabularies['users'])).astype(np.int64)
+        return int(duration.sum())
+
+    def artist_counts(self, top=None, all_artists=True):
+        ''' Returns [(artist_id, artist_name, rows), ...] sorted by the number of rows that credit each artist.
+            With all_artists=False, only the first credited artist of each row counts.
+        '''
+        codes = self.columns['artist_codes'] if all_artists else self.columns['artist']
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.vocabularies['artists']))
+        order = np.argsort(counts)[::-1][:top]
+        return [(self.vocabularies['artists'][code], self.vocabularies['artist_names'][code], int(counts[code]))
+            for code in order if counts[code]]
+
+    def added_per_month(self, mask=None):
+        ''' Returns (months, counts) for the rows with an added_at timestamp.
+        '''
+        added_at = self.columns['added_at'] if mask is None else self.columns['added_at'][mask]
+        months = added_at[~np.isnat(added_at)].astype('datetime64[M]')
+        return np.unique(months, return_counts=True)
+
+    def released_per_year(self, mask=None):
+        release_date = self.columns['release_date'] if mask is None else self.columns['release_date'][mask]
+        years = release_date[~np.isnat(release_date)].astype('datetime64[Y]')
+        return np.unique(years, return_counts=True)
@@ -0,0 +1,158 @@
+import records
+
+import json
+import math
+import os
+
+
+def compact_item(item):
+    ''' Saved tracks that are unavailable or have no id (usually local files) are kept as placeholders,
+        so positions in the snapshot line up with offsets in the API and with the 'total' it reports.
+    '''
+    track = item['track']
+    return {'added_at': item['added_at'], 'track': records.TrackRecord(track).to_dict() if track and track['id'] else None}
+
+def _item_key(item):
+    return (item['added_at'], item['track']['id'] if item['track'] else None)
+
+
+class LibrarySnapshot:
+
+    ''' A local copy of the user's saved tracks, persisted as JSON and kept newest-first like the API returns them.
+
+        refresh() only pages until it reaches a saved track it already knows about,
+        so a repeat run costs a page or two. Removals show up as a mismatch with the 'total' the API reports,
+        and each one is located with a binary search of single-item requests, as long as that's cheaper than a full re-scan.
+        The set of saved artists is kept up to date as tracks come and go.
+    '''
+
+    def __init__(self, path='library_snapshot.json', max_removals=20):
+        self.path = path
+        self.max_removals = max_removals
+        self._items = []
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as fp:
+                self._items = json.load(fp)
+        self._artist_counts = {}
+        self._artists = {}
+        for item in self._items:
+            self._count_artists(item['track'], 1)
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump(self._items, fp)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return sum(1 for item in self._items if item['track'])
+
+    def copy(self):
+        ''' An independent copy to refresh while this one is still being read from.
+            Items are never changed once they're in, so only the containers are copied.
+        '''
+        snapshot = LibrarySnapshot(path=None, max_removals=self.max_removals)
+        snapshot.path = self.path
+        snapshot._items = list(self._items)
+        snapshot._artist_counts = dict(self._artist_counts)
+        snapshot._artists = dict(self._artists)
+        return snapshot
+
+    def _count_artists(self, track, delta):
+        if not track:
+            return
+        for artist in track['artists']:
+            count = self._artist_counts.get(artist['id'], 0) + delta
+            if count > 0:
+                self._artist_counts[artist['id']] = count
+                self._artists[artist['id']] = artist
+            else:
+                self._artist_counts.pop(artist['id'], None)
+                self._artists.pop(artist['id'], None)
+
+    def _reset(self, items):
+        self._items = []
+        self._artist_counts = {}
+        self._artists = {}
+        for item in items:
+            self._items.append(item)
+            self._count_artists(item['track'], 1)
+
+    def refresh(self, sp):
+        ''' Brings the snapshot up to date with the user's saved tracks. Returns the number of requests made.
+        '''
+        known = {_item_key(item) for item in self._items}
+        paging_obj = sp.current_user_saved_tracks(limit=50)
+        total = paging_obj['total']
+        requests = 1
+        new_items = []
+        reached_known = False
+        while True:
+            for item in paging_obj['items']:
+                item = compact_item(item)
+                if _item_key(item) in known:
+                    reached_known = True
+                    break
+                new_items.append(item)
+            if reached_known or not paging_obj['next']:
+                break
+            paging_obj = sp.next(paging_obj)
+            requests += 1
+
+        if not reached_known:
+            # Nothing we had is still at the top of the library, so the whole thing was just paged anyway
+            self._reset(new_items)
+            print(f"Rebuilt library snapshot with {len(self)} saved tracks.")
+            return requests
+
+        for item in new_items:
+            self._count_artists(item['track'], 1)
+        self._items[:0] = new_items
+
+        # Each removal costs about log2(n) probes to find, and a full re-scan costs one request per 50 tracks
+        missing = len(self._items) - total
+        search_cost = missing * math.ceil(math.log2(max(len(self._items), 2)))
+        removals = 0
+        if search_cost <= math.ceil(len(self._items) / 50):
+            while len(self._items) > total and removals < self.max_removals:
+                index, probes = self._find_removed(sp)
+                requests += probes
+                removed = self._items.pop(index)
+                self._count_artists(removed['track'], -1)
+                removals += 1
+
+        if len(self._items) != total:
+            print("Library snapshot drifted too far from Spotify; rebuilding it.")
+            self._reset([compact_item(item)
+                for item in sp.aggregate_paging_results(sp.current_user_saved_tracks(limit=50))])
+            requests += len(self._items) // 50 + 1
+
+        print(f"Library snapshot: {len(new_items)} added, {removals} removed, {len(self)} saved tracks.")
+        return requests
+
+    def _find_removed(self, sp):
+        ''' Everything before the first removed track is still where the snapshot expects it,
+            and everything after it is shifted up by one, so a binary search over offsets finds it.
+        '''
+        low, high = 0, len(self._items) - 1
+        probes = 0
+        while low < high:
+            middle = (low + high) // 2
+            items = sp.current_user_saved_tracks(limit=1, offset=middle)['items']
+            probes += 1
+            if items and _item_key(compact_item(items[0])) == _item_key(self._items[middle]):
+                low = middle + 1
+            else:
+                high = middle
+        return low, probes
+
+    def items(self):
+        ''' Returns the saved track objects as {'added_at': ..., 'track': ...}, newest first.
+        '''
+        return [item for item in self._items if item['track']]
+
+    def tracks(self):
+        return [item['track'] for item in self._items if item['track']]
+
+    def artists(self):
+        return list(self._artists.values())
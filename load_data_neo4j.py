@@ -1,533 +1,351 @@
 import spotipy
 from spotipyhelper import *
- 
-from py2neo import Graph, Node, Relationship, Subgraph
+from graph_backends import *
+from crawler import GraphCrawler
  
 import configparser
 import csv
+import os
 from time import time
 
-class NoneAsKey(TypeError):
-    ''' Raised when trying to construct a node by passing None as an attribute
-        when that attribute is supposed to be the key for that type of node.
-    '''
-    def __init__(self, msg=None):
-        super().__init__(msg)
 
- 
-class UserNode(Node):
-    ''' A subclass of py2neo.Node specifically for User nodes.
-        Node key: id
-        Other properties: name
-    '''
-    def __init__(self, *otherLabels, id=None, name=None, **otherAttrs):
-        if not id:
-            raise NoneAsKey('UserNode must have an id.')
-        if not name:
-            name = id
-        super().__init__('User', *otherLabels, id=id, name=name, **otherAttrs)
-        self.__primarylabel__ = 'User'
-        self.__primarykey__ = 'id'
- 
-class PlaylistNode(Node):
-    ''' A subclass of py2neo.Node specifically for Playlist nodes.
-        Node key: id
-        Other properties: name
-    '''
-    def __init__(self, *otherLabels, id=None, name=None, **otherAttrs):
-        if not id:
-            raise NoneAsKey('PlaylistNode must have an id.')
-        # py2neo.Node treats 'name' attributes specially and it doesn't like receiving a None value for 'name'
-        if name:
-            otherAttrs['name'] = name
-        super().__init__('Playlist', *otherLabels, id=id, **otherAttrs)
-        self.__primarylabel__ = 'Playlist'
-        self.__primarykey__ = 'id'
- 
-class SongNode(Node):
-    ''' A subclass of py2neo.Node specifically for Song nodes.
-        Node key: id
-        Other properties: name, pop, duration
-    '''
-    def __init__(self, *otherLabels, id=None, name=None, **otherAttrs):
-        if not id:
-            raise NoneAsKey('SongNode must have an id.')
-        # py2neo.Node treats 'name' attributes specially and it doesn't like receiving a None value for 'name'
-        if name:
-            otherAttrs['name'] = name
-        super().__init__('Song', *otherLabels, id=id, **otherAttrs)
-        self.__primarylabel__ = 'Song'
-        self.__primarykey__ = 'id'
- 
-class ArtistNode(Node):
-    ''' A subclass of py2neo.Node specifically for Artist nodes.
-        Node key: id
-        Other properties: name, pop
-    '''
-    def __init__(self, *otherLabels, id=None, name=None, **otherAttrs):
-        if not id:
-            raise NoneAsKey('ArtistNode must have an id.')
-        # py2neo.Node treats 'name' attributes specially and it doesn't like receiving a None value for 'name'
-        if name:
-            otherAttrs['name'] = name
-        super().__init__('Artist', *otherLabels, id=id, **otherAttrs)
-        self.__primarylabel__ = 'Artist'
-        self.__primarykey__ = 'id'
- 
-class AlbumNode(Node):
-    ''' A subclass of py2neo.Node specifically for Album nodes.
-        Node key: id
-        Other properties: name, pop, release_date
-    '''
-    def __init__(self, *otherLabels, id=None, name=None, **otherAttrs):
-        if not id:
-            raise NoneAsKey('AlbumNode must have an id.')
-        # py2neo.Node treats 'name' attributes specially and it doesn't like receiving a None value for 'name'
-        if name:
-            otherAttrs['name'] = name
-        super().__init__('Album', *otherLabels, id=id, **otherAttrs)
-        self.__primarylabel__ = 'Album'
-        self.__primarykey__ = 'id'
- 
-class GenreNode(Node):
-    ''' A subclass of py2neo.Node specifically for Genre nodes.
-        Node key: name
+# All merge_songs() reads from each playlist. Pages of tracks past the first come from tracks.next.
+PLAYLIST_FIELDS = 'id,name,snapshot_id,tracks.items(added_at,added_by.id,track(id)),tracks.next'
+
+# Every stage only reads, so they can all share one client with this scope
+SCOPE = '''
+    playlist-read-private 
+    playlist-read-collaborative 
+    user-follow-read 
     '''
-    def __init__(self, *otherLabels, name=None, **otherAttrs):
-        if not name:
-            raise NoneAsKey('GenreNode must have a name.')
-        super().__init__('Genre', *otherLabels, name=name, **otherAttrs)
-        self.__primarylabel__ = 'Genre'
-        self.__primarykey__ = 'name'
 
 
-def merge_friends(graph, user_ids):
+def merge_friends(graph, user_ids, spclient=None):
     ''' Merges Friend nodes into the DB from a list of their IDs.
     '''
     print(f"\nmerge_friends() called.")
     mark0 = time()
-    for user_id in user_ids:
-        with graph.begin() as tx:
-            userNode = tx.run('MATCH (u:User {id:$id}) RETURN u', id=user_id)
-            if not userNode:
-                spclient = subSpotify(scope='''
-                    playlist-read-private 
-                    playlist-read-collaborative 
-                    user-follow-read 
-                    ''')
-                user = spclient.user(user_id)
-                tx.merge(UserNode(
-                    'Friend',
-                    id=user_id,
-                    name=user['name']
-                    ))
-                print(f"Merged new friend: {user['name']}")
-
-
-def merge_playlists(graph):
+    known_friends = {f['id'] for f in graph.nodes('Friend')}
+    new_ids = [user_id for user_id in user_ids if user_id not in known_friends]
+    if new_ids:
+        spclient = spclient or subSpotify(scope=SCOPE)
+        users = spclient.get_users_by_id(new_ids)
+        graph.merge_nodes('User', [{'id': u['id'], 'name': u.get('display_name') or u['id']} for u in users], extra_labels=['Friend'])
+        for user in users:
+            print(f"Merged new friend: {user.get('display_name') or user['id']}")
+    print(f"Merged {len(new_ids)} new friends in {time()-mark0:.1f} seconds.")
+
+
+def merge_playlists(graph, spclient=None):
     ''' Merges playlists that are followed by friends in the DB.
         Also merges FOLLOWS and OWNS relationships for the playlists.
         If the owner of the playlist is not already in the DB, it merges a new User node.
     '''
     print(f"\nmerge_playlists() called.")
     mark0 = time()
-    with graph.begin() as tx:
-        friends_from_db = [record['f'] for record in tx.run('MATCH (f:Friend) RETURN f')]
+    friends_from_db = graph.nodes('Friend')
     print(f"Found {len(friends_from_db)} friends in the DB in {time()-mark0:.1f} seconds.")
 
-    spclient = subSpotify(scope='''
-        playlist-read-private 
-        playlist-read-collaborative 
-        user-follow-read 
-        ''')
-    mark1 = time()
-    users_from_spotify = [spclient.user(friend['id']) for friend in friends_from_db]
-    print(f"Retrieved {len(users_from_spotify)} corresponding users from Spotify in {time()-mark1:.1f} seconds.")
+    spclient = spclient or subSpotify(scope=SCOPE)
 
     owner_counter = 0
     playlist_counter = 0
     follows_counter = 0
     owns_counter = 0
-    assert len(friends_from_db)==len(users_from_spotify), "Numbers of users from DB and Spotify came out uneven."
-    for index, user in enumerate(users_from_spotify):
-        assert user['id']==friends_from_db[index]['id'], "Users from DB and Spotify fell out of sync."
-        for playlist in spclient.aggregate_paging_results(spclient.user_playlists(user['id'])):
-            with graph.begin() as tx:
-                playlistNode = tx.evaluate('MATCH (p:Playlist {id:$id}) RETURN p', id=playlist['id'])
-                if not playlistNode:
-                    playlistNode = PlaylistNode(
-                        id=playlist['id'],
-                        name=playlist['name'],
-                        )
-                    tx.merge(playlistNode)
-                    playlist_counter += 1
-                    print(f"Created a new Playlist node for {playlist['name']}")
-                tx.merge(Relationship(
-                    friends_from_db[index],
-                    'FOLLOWS',
-                    playlistNode,
-                    ))
-                follows_counter += 1
-                ownerNode = tx.evaluate('MATCH (u:User {id:$id}) RETURN u', id=playlist['owner']['id'])
-                if not ownerNode:
-                    ownerNode = UserNode(
-                        id=playlist['owner']['id'],
-                        name=playlist['owner']['name'],
-                        )
-                    tx.merge(ownerNode)
-                    owner_counter += 1
-                    print(f"Created a new User node for {playlist['owner']['id']}")
-                tx.merge(Relationship(
-                    ownerNode,
-                    'OWNS',
-                    playlistNode,
-                    ))
-                owns_counter += 1
+    for friend in friends_from_db:
+        playlists = spclient.aggregate_paging_results(spclient.user_playlists(friend['id']))
+        if not playlists:
+            continue
+
+        known_playlists = graph.existing_keys('Playlist', {p['id'] for p in playlists})
+        new_playlists = [p for p in playlists if p['id'] not in known_playlists]
+        # Known playlists get their snapshot_id updated too, which is how merge_songs() tells which ones changed
+        graph.merge_nodes('Playlist', [{'id': p['id'], 'name': p['name'], 'snapshot_id': p['snapshot_id']} for p in playlists])
+        playlist_counter += len(new_playlists)
+        for playlist in new_playlists:
+            print(f"Created a new Playlist node for {playlist['name']}")
+
+        owners = {p['owner']['id']: p['owner'] for p in playlists}
+        known_owners = graph.existing_keys('User', owners)
+        new_owners = [o for o_id, o in owners.items() if o_id not in known_owners]
+        graph.merge_nodes('User', [{'id': o['id'], 'name': o.get('display_name') or o['id']} for o in new_owners])
+        owner_counter += len(new_owners)
+        for owner in new_owners:
+            print(f"Created a new User node for {owner['id']}")
+
+        graph.merge_relationships('FOLLOWS', 'User', 'Playlist', [(friend['id'], p['id'], {}) for p in playlists])
+        follows_counter += len(playlists)
+        graph.merge_relationships('OWNS', 'User', 'Playlist', [(p['owner']['id'], p['id'], {}) for p in playlists])
+        owns_counter += len(playlists)
     print(f"{playlist_counter} new Playlist nodes merged.")
     print(f"{follows_counter} new FOLLOWS relationships merged.")
     print(f"{owner_counter} new User nodes merged.")
     print(f"{owns_counter} new OWNS relationships merged.")
 
 
-def merge_songs(graph, firstcall=True):
-    ''' Merges Song nodes and INCLUDES relationships based on playlists already in the DB.
+def merge_songs(graph, spclient=None):
+    ''' Merges Song nodes and INCLUDES relationships for the playlists friends follow whose songs changed since they were last merged.
+        Playlists that only the crawl reached are left to GraphCrawler, which merges their songs as it reads them.
+        A playlist counts as changed when the snapshot_id merge_playlists() last listed for it
+        isn't the one its INCLUDES rels were merged at (songs_snapshot_id), so unchanged playlists aren't fetched at all.
+        Returns {playlist ID: [song IDs]} for every playlist that was merged.
     '''
-    print(f"\nmerge_songs() called on {'first' if firstcall else 'second'} pass.")
+    print(f"\nmerge_songs() called.")
     mark0 = time()
-    with graph.begin() as tx:
-        playlists_from_db = [(record['n'], record['p']) for record in tx.run('MATCH (n:User)-[:OWNS]->(p:Playlist) RETURN n, p')]
-    print(f"Found {len(playlists_from_db)} playlists in the DB in {time()-mark0:.1f} seconds.")
+    friend_ids = {f['id'] for f in graph.nodes('Friend')}
+    followed = {playlist['id'] for user, playlist, _ in graph.relationships('FOLLOWS', 'User', 'Playlist') if user['id'] in friend_ids}
+    playlists_from_db = [(owner, playlist) for owner, playlist, _ in graph.relationships('OWNS', 'User', 'Playlist')
+        if playlist['id'] in followed
+        and (not playlist.get('snapshot_id') or playlist.get('songs_snapshot_id') != playlist['snapshot_id'])]
+    print(f"Found {len(playlists_from_db)} changed playlists in the DB in {time()-mark0:.1f} seconds.")
+    if not playlists_from_db:
+        return {}
 
     mark1 = time()
-    spclient = subSpotify(scope='''
-        playlist-read-private 
-        playlist-read-collaborative 
-        user-follow-read 
-        ''')
-    playlists_from_spotify = spclient.get_playlists_by_id([(x[0]['id'], x[1]['id']) for x in playlists_from_db])
+    spclient = spclient or subSpotify(scope=SCOPE)
+    playlists_from_spotify = spclient.get_playlists_by_id(
+        [(x[0]['id'], x[1]['id']) for x in playlists_from_db], fields=PLAYLIST_FIELDS, market='from_token')
     print(f"Retrieved {len(playlists_from_spotify)} playlists from Spotify in {time()-mark1:.1f} seconds.")
     assert len(playlists_from_db)==len(playlists_from_spotify), "Number of playlists from the DB vs. Spotify is uneven."
 
     mark2 = time()
     rel_counter = 0
-    song_ids_to_lookup = set([])
+    merged = {}
+    # INCLUDES rels for songs that aren't in the DB yet, merged once those songs are
+    pending_rels = []
     for index, playlist in enumerate(playlists_from_spotify):
         assert playlist['id']==playlists_from_db[index][1]['id'], "Playlists from the DB and Spotify fell out of sync."
-        for track_obj in spclient.aggregate_paging_results(playlist['tracks']):
-            with graph.begin() as tx:
-                songNode = tx.evaluate('MATCH (s:Song {id:$id}) RETURN s', id=track_obj['track']['id'])
-                if songNode:
-                    tx.merge(Relationship(
-                        playlists_from_db[index][1],
-                        'INCLUDES',
-                        songNode,
-                        added_at=track_obj['added_at'],
-                        added_by=track_obj['added_by']['id'],
-                        ))
-                    rel_counter += 1
-                else:
-                    if track_obj['track']['id']:
-                        assert firstcall, ("All tracks are supposed to be merged after first call. "
-                            f"{track_obj['track']['name']} was missing on {playlist['name']}.")
-                        song_ids_to_lookup.add(track_obj['track']['id'])
-                    else:
-                        # This usually means that the song is a local file instead of a Spotify track.
-                        # print(f"This song from playlist: {playlist['name']} didn't have an id: {song['name']}")
-                        pass
+        # Tracks without an id are usually local files instead of Spotify tracks.
+        track_objs = [t for t in spclient.aggregate_paging_results(playlist['tracks']) if t['track'] and t['track']['id']]
+        merged[playlist['id']] = list(dict.fromkeys(t['track']['id'] for t in track_objs))
+        known_songs = graph.existing_keys('Song', set(merged[playlist['id']]))
+        rels = []
+        for track_obj in track_objs:
+            rel = (
+                playlist['id'],
+                track_obj['track']['id'],
+                {'added_at': track_obj['added_at'], 'added_by': (track_obj['added_by'] or {}).get('id')},
+                )
+            (rels if track_obj['track']['id'] in known_songs else pending_rels).append(rel)
+        graph.merge_relationships('INCLUDES', 'Playlist', 'Song', rels)
+        rel_counter += len(rels)
         if time()-mark2 > 60:
             print(f"{int((time()-mark0)/60)} minutes elapsed. {rel_counter} total INCLUDES relationships merged.")
             mark2 = time()
+
+    song_ids_to_lookup = {song_id for _, song_id, _ in pending_rels}
+    if song_ids_to_lookup:
+        songs_to_merge = [s for s in spclient.get_tracks_by_id(song_ids_to_lookup, market='from_token', compact=True) if s]
+        print(f"Attempting to merge {len(songs_to_merge)} new Song nodes.")
+        graph.merge_nodes('Song', [{'id': s['id'], 'name': s['name'], 'pop': s['popularity']} for s in songs_to_merge])
+        found = {s['id'] for s in songs_to_merge}
+        rels = [rel for rel in pending_rels if rel[1] in found]
+        graph.merge_relationships('INCLUDES', 'Playlist', 'Song', rels)
+        rel_counter += len(rels)
+        if len(found) < len(song_ids_to_lookup):
+            print(f"Spotify had nothing for {len(song_ids_to_lookup) - len(found)} of the new songs; they were left out.")
+    else:
+        print(f"There are no new songs to merge.")
     print(f"{rel_counter} total INCLUDES relationships merged.")
 
-    if firstcall:
-        if song_ids_to_lookup:
-            spclient = subSpotify(scope='''
-                playlist-read-private 
-                playlist-read-collaborative 
-                user-follow-read 
-                ''')
-            songs_to_merge = spclient.get_tracks_by_id(song_ids_to_lookup)
-            print(f"Attempting to merge {len(songs_to_merge)} new Song nodes.")
-            for sublist in splitlist(songs_to_merge, 100):
-                subgraph = Subgraph([SongNode(id=s['id'], name=s['name'], pop=s['popularity']) for s in sublist])
-                with graph.begin() as tx:
-                    tx.merge(subgraph)
-            print(f"Calling merge_songs() for the second pass.")
-            merge_songs(g, firstcall=False)
-        else:
-            print(f"There are no new songs to merge.")
+    # Only now that their songs are in, so an interrupted run fetches these playlists again next time
+    graph.merge_nodes('Playlist', [{'id': p['id'], 'snapshot_id': p['snapshot_id'], 'songs_snapshot_id': p['snapshot_id']}
+        for p in playlists_from_spotify])
+    return merged
+
+# The audio features copied onto Song nodes by merge_audio_features()
+AUDIO_FEATURES = (
+    'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+    'instrumentalness', 'liveness', 'valence', 'tempo', 'time_signature',
+    )
+
+def merge_audio_features(graph, max_workers=8, batch_size=10000, spclient=None):
+    ''' Adds audio features (tempo, energy, danceability, ...) to every Song node in the DB that doesn't have them yet.
+        Every song that's been asked about gets features_fetched=True, so later runs don't ask again,
+        and songs Spotify has no features for also get no_features=True.
+        If Spotify refuses the endpoint altogether (401/403, e.g. for apps without access to it), the stage stops there.
+    '''
+    print(f"\nmerge_audio_features() called.")
+    mark0 = time()
+    song_ids = [s['id'] for s in graph.nodes('Song') if not s.get('features_fetched')]
+    print(f"Found {len(song_ids)} songs without audio features in the DB in {time()-mark0:.1f} seconds.")
+
+    spclient = spclient or subSpotify(scope=SCOPE)
+    enriched = 0
+    for number, batch in enumerate(splitlist(song_ids, batch_size)):
+        try:
+            features = spclient.get_audio_features_by_id(batch, max_workers=max_workers)
+        except spotipy.SpotifyException as error:
+            if error.http_status in (401, 403):
+                # Every other batch would get the same answer
+                print(f"The audio features endpoint isn't available to this client (HTTP {error.http_status}); "
+                    f"skipping audio features for the remaining {len(song_ids) - number*batch_size} songs.")
+                break
+            # Leave the whole batch for the next run rather than marking it as having no features
+            print(f"Spotify threw an error while retrieving audio features, skipping {len(batch)} songs:\n{error}")
+            continue
+        rows = []
+        for song_id, song_features in zip(batch, features):
+            if song_features:
+                rows.append({'id': song_id, 'features_fetched': True, **{f: song_features.get(f) for f in AUDIO_FEATURES}})
+            else:
+                rows.append({'id': song_id, 'features_fetched': True, 'no_features': True})
+        graph.merge_nodes('Song', rows)
+        enriched += sum(1 for f in features if f)
+        print(f"{int((time()-mark0)/60)} minutes elapsed. {enriched} songs enriched with audio features.")
+    print(f"Merged audio features for {enriched} of {len(song_ids)} songs in {time()-mark0:.1f} seconds.")
 
-def merge_albums(graph, firstcall=True):
+
+def merge_albums(graph, firstcall=True, spclient=None):
     ''' Merges Album nodes and ON_ALBUM relationship based on songs already in the DB.
     '''
     print(f"\nmerge_albums() called on {'first' if firstcall else 'second'} pass.")
     mark0 = time()
-    with graph.begin() as tx:
-        songs_from_db = [record['s'] for record in tx.run('MATCH (s:Song) RETURN s')]
+    songs_from_db = graph.nodes('Song')
     print(f"Found {len(songs_from_db)} songs in the DB in {time()-mark0:.1f} seconds.")
 
     mark1 = time()
-    spclient = subSpotify(scope='''
-        playlist-read-private 
-        playlist-read-collaborative 
-        user-follow-read 
-        ''')
-    tracks_from_spotify = spclient.get_tracks_by_id([s['id'] for s in songs_from_db])
+    spclient = spclient or subSpotify(scope=SCOPE)
+    tracks_from_spotify = spclient.get_tracks_by_id([s['id'] for s in songs_from_db], market='from_token', compact=True)
     print(f"Retrieved {len(tracks_from_spotify)} corresponding tracks from Spotify in {time()-mark1:.1f} seconds.")
     assert len(songs_from_db)==len(tracks_from_spotify), "Number of songs in the DB vs. tracks from Spotify is uneven."
 
-    mark2 = time()
-    rel_counter = 0
+    known_albums = graph.existing_keys('Album', {t['album']['id'] for t in tracks_from_spotify})
+    rels = []
     album_ids_to_lookup = set([])
     for index, track in enumerate(tracks_from_spotify):
         assert track['id']==songs_from_db[index]['id'], "Songs from the DB and tracks from Spotify fell out of sync."
-        with graph.begin() as tx:
-            albumNode = tx.evaluate('MATCH (a:Album {id:$id}) RETURN a', id=track['album']['id'])
-            if albumNode:
-                tx.merge(Relationship(
-                    songs_from_db[index],
-                    'ON_ALBUM',
-                    albumNode
-                    ))
-                rel_counter += 1
-            else:
-                assert firstcall, ("All albums are supposed to be merged after first call. "
-                    f"{track['album']['name']} was missing for song: {track['name']}.")
-                album_ids_to_lookup.add(track['album']['id'])
-        if time()-mark2 > 60:
-            print(f"{int((time()-mark0)/60)} minutes elapsed. {rel_counter} total new ON_ALBUM relationships merged.")
-            mark2 = time()
-    print(f"{rel_counter} total new ON_ALBUM relationships merged.")
+        if track['album']['id'] in known_albums:
+            rels.append((track['id'], track['album']['id'], {}))
+        else:
+            assert firstcall, ("All albums are supposed to be merged after first call. "
+                f"{track['album']['name']} was missing for song: {track['name']}.")
+            album_ids_to_lookup.add(track['album']['id'])
+    graph.merge_relationships('ON_ALBUM', 'Song', 'Album', rels)
+    print(f"{len(rels)} total new ON_ALBUM relationships merged.")
 
     if firstcall:
         if album_ids_to_lookup:
-            spclient = subSpotify(scope='''
-                playlist-read-private 
-                playlist-read-collaborative 
-                user-follow-read 
-                ''')
-            albums_to_merge = spclient.get_albums_by_id(album_ids_to_lookup)
+            albums_to_merge = spclient.get_albums_by_id(album_ids_to_lookup, market='from_token', compact=True)
             print(f"Attempting to merge {len(albums_to_merge)} new Album nodes.")
-            for sublist in splitlist(albums_to_merge, 100):
-                subgraph = Subgraph([AlbumNode(id=a['id'], name=a['name'], pop=a['popularity'], release_date=a['release_date']) for a in sublist])
-                with graph.begin() as tx:
-                    tx.merge(subgraph)
+            graph.merge_nodes('Album', [{'id': a['id'], 'name': a['name'], 'pop': a['popularity'], 'release_date': a['release_date']} for a in albums_to_merge])
             print(f"Calling merge_albums for the second pass.")
-            merge_albums(graph, firstcall=False)
+            merge_albums(graph, firstcall=False, spclient=spclient)
         else:
             print(f"There are no new albums to merge.")
 
 
 
 
-def merge_artists(graph, firstcall=True):
+def merge_artists(graph, firstcall=True, spclient=None):
     ''' Merges RELEASED relationships between existing Album and Artist nodes already in the DB.
         Merges a new Artist node if necessary, then its corresponding RELEASED relationship on the second pass.
     '''
     print(f"\nmerge_artists() called on {'first' if firstcall else 'second'} pass.")
     mark0 = time()
-    with graph.begin() as tx:
-        albums_from_db = [record['a'] for record in tx.run('MATCH (a:Album) RETURN a')]
+    albums_from_db = graph.nodes('Album')
     print(f"Found {len(albums_from_db)} albums in the DB in {time()-mark0:.1f} seconds.")
 
     mark1 = time()
-    spclient = subSpotify(scope='''
-        playlist-read-private 
-        playlist-read-collaborative 
-        user-follow-read 
-        ''')
-    albums_from_spotify = spclient.get_albums_by_id([a['id'] for a in albums_from_db])
+    spclient = spclient or subSpotify(scope=SCOPE)
+    albums_from_spotify = spclient.get_albums_by_id([a['id'] for a in albums_from_db], market='from_token', compact=True)
     print(f"Retrieved {len(albums_from_spotify)} corresponding albums from Spotify in {time()-mark1:.1f} seconds.")
     assert len(albums_from_db)==len(albums_from_spotify), "Number of albums from the DB vs. Spotify is uneven."
 
+    known_artists = graph.existing_keys('Artist', {artist['id'] for album in albums_from_spotify for artist in album['artists']})
     artist_ids_to_lookup = set([])
-    rel_counter = 0
-    mark2 = time()
+    rels = []
     for index, album in enumerate(albums_from_spotify):
         assert album['id']==albums_from_db[index]['id'], "Albums from the DB and Spotify fell out of sync."
         for artist in album['artists']:
-            with graph.begin() as tx:
-                artistNode = tx.evaluate('MATCH (a:Artist {id:$id}) RETURN a', id=artist['id'])
-                if artistNode:
-                    tx.merge(Relationship(
-                        artistNode,
-                        'RELEASED',
-                        albums_from_db[index],
-                        ))
-                    rel_counter += 1
-                else:
-                    assert firstcall, ("All artists are supposed to be merged after first call. "
-                        f"{artist['name']} was missing for album: {album['name']}.")
-                    artist_ids_to_lookup.add(artist['id'])
-        if time()-mark2 > 60:
-            print(f"{int((time()-mark0)/60)} minutes elapsed. {rel_counter} total new PERFORMS relationships merged.")
-            mark2 = time()
-    print(f"{rel_counter} total new PERFORMS relationships merged.")
+            if artist['id'] in known_artists:
+                rels.append((artist['id'], album['id'], {}))
+            else:
+                assert firstcall, ("All artists are supposed to be merged after first call. "
+                    f"{artist['name']} was missing for album: {album['name']}.")
+                artist_ids_to_lookup.add(artist['id'])
+    graph.merge_relationships('RELEASED', 'Artist', 'Album', rels)
+    print(f"{len(rels)} total new RELEASED relationships merged.")
 
     if firstcall:
         if artist_ids_to_lookup:
-            spclient = subSpotify(scope='''
-                playlist-read-private 
-                playlist-read-collaborative 
-                user-follow-read 
-                ''')     
-            artists_to_merge = spclient.get_artists_by_id(artist_ids_to_lookup)
+            artists_to_merge = spclient.get_artists_by_id(artist_ids_to_lookup, compact=True)
             print(f"Attempting to merge {len(artists_to_merge)} new Artist nodes.")
-            for sublist in splitlist(artists_to_merge, 100):
-                subgraph = Subgraph([ArtistNode(id=a['id'],name=a['name'],pop=a['popularity']) for a in sublist])
-                with graph.begin() as tx:
-                    tx.merge(subgraph)
-            print(f"Calling merge_performs_rels() for the second pass.")
-            merge_artists(graph, firstcall=False)
+            graph.merge_nodes('Artist', [{'id': a['id'], 'name': a['name'], 'pop': a['popularity']} for a in artists_to_merge])
+            print(f"Calling merge_artists() for the second pass.")
+            merge_artists(graph, firstcall=False, spclient=spclient)
         else:
             print(f"There are no new artists to merge.")
 
 
 
 
-def merge_performs_rels(graph, firstcall=True):
+def merge_performs_rels(graph, firstcall=True, spclient=None):
     ''' Merges PERFORMS relationships between Artist and Song nodes based on Song nodes in the DB.
         Merges a new Artist node if necessary, and then its corresponding PERFORMS relationship on the second pass.
     '''
     print(f"\nmerge_performs_rels() called on {'first' if firstcall else 'second'} pass.")
     mark0 = time()
-    with graph.begin() as tx:
-        query_result = tx.run('MATCH (s:Song) RETURN s')  
-    songs_from_db = [record['s'] for record in query_result]
+    songs_from_db = graph.nodes('Song')
     print(f"Found {len(songs_from_db)} songs in the DB in {time()-mark0:.1f} seconds.")
     
     mark1 = time()
-    spclient = subSpotify(scope='''
-        playlist-read-private 
-        playlist-read-collaborative 
-        user-follow-read 
-        ''')
-    tracks_from_spotify = spclient.get_tracks_by_id([song['id'] for song in songs_from_db])
+    spclient = spclient or subSpotify(scope=SCOPE)
+    tracks_from_spotify = spclient.get_tracks_by_id([song['id'] for song in songs_from_db], market='from_token', compact=True)
     print(f"Retrieved {len(tracks_from_spotify)} corresponding tracks from Spotify in {time()-mark1:.1f} seconds.")
     assert len(songs_from_db) == len(tracks_from_spotify), "Number of songs from the DB and tracks from Spotify are uneven."
    
-    mark2 = time()
-    rel_counter = 0
+    known_artists = graph.existing_keys('Artist', {artist['id'] for track in tracks_from_spotify for artist in track['artists']})
+    rels = []
     artist_ids_to_lookup = set([])
     for index, track in enumerate(tracks_from_spotify):
         assert track['id'] == songs_from_db[index]['id'], "DB songs and Spotify songs fell out of sync."
         for artist in track['artists']:
-            with graph.begin() as tx:
-                artistNode = tx.evaluate('MATCH (a:Artist {id:$id}) RETURN a', id=artist['id'])
-                if artistNode:
-                    tx.merge(Relationship(
-                        artistNode,
-                        'PERFORMS',
-                        songs_from_db[index],
-                        ))
-                    rel_counter += 1
-                else:
-                    assert firstcall, (f"All artists are supposed to be merged after first call. "
-                        f"{artist['name']} was missing for track: {track['name']}.")
-                    artist_ids_to_lookup.add(artist['id'])
-        if time()-mark2 > 60:
-            print(f"{int((time()-mark0)/60)} minutes elapsed. {rel_counter} total new PERFORMS relationships merged.")
-            mark2 = time()
-    print(f"{rel_counter} total new PERFORMS relationships merged.")
+            if artist['id'] in known_artists:
+                rels.append((artist['id'], track['id'], {}))
+            else:
+                assert firstcall, (f"All artists are supposed to be merged after first call. "
+                    f"{artist['name']} was missing for track: {track['name']}.")
+                artist_ids_to_lookup.add(artist['id'])
+    graph.merge_relationships('PERFORMS', 'Artist', 'Song', rels)
+    print(f"{len(rels)} total new PERFORMS relationships merged.")
 
     if firstcall and artist_ids_to_lookup:
-        spclient = subSpotify(scope='''
-            playlist-read-private 
-            playlist-read-collaborative 
-            user-follow-read 
-            ''')
-        artists_to_merge = spclient.get_artists_by_id(artist_ids_to_lookup)
+        artists_to_merge = spclient.get_artists_by_id(artist_ids_to_lookup, compact=True)
         print(f"Attempting to merge {len(artists_to_merge)} new Artist nodes.")
-        for sublist in splitlist(artists_to_merge, 100):
-            subgraph = Subgraph([ArtistNode(id=a['id'],name=a['name'],pop=a['popularity']) for a in sublist])
-            with graph.begin() as tx:
-                tx.merge(subgraph)
+        graph.merge_nodes('Artist', [{'id': a['id'], 'name': a['name'], 'pop': a['popularity']} for a in artists_to_merge])
         print(f"Calling merge_performs_rels() for the second pass.")
-        merge_performs_rels(graph, firstcall=False)
+        merge_performs_rels(graph, firstcall=False, spclient=spclient)
 
 
-def merge_genres(graph):
+def merge_genres(graph, spclient=None):
     ''' Merges Genre nodes from Artist nodes already in the DB.
         Also takes care of GENRE_ASSOC relationships between Artist and Genre nodes.
     '''
     print("\nmerge_genres() called.")
     mark0 = time()
-    with graph.begin() as tx:
-        artists_from_db = [record['a'] for record in tx.run('MATCH (a:Artist) RETURN a')]
-        print(f"Found {len(artists_from_db)} artists in the DB.")
-        #albums_from_db = [record['b'] for record in tx.run('MATCH (b:Album) RETURN b')]
-        #print(f"Found {len(albums_from_db)} albums in the DB.")
-
-    spclient = subSpotify(scope='''
-        playlist-read-private 
-        playlist-read-collaborative 
-        user-follow-read 
-        ''')
-    artists_from_spotify = spclient.get_artists_by_id([a['id'] for a in artists_from_db])
+    artists_from_db = graph.nodes('Artist')
+    print(f"Found {len(artists_from_db)} artists in the DB.")
+
+    spclient = spclient or subSpotify(scope=SCOPE)
+    artists_from_spotify = spclient.get_artists_by_id([a['id'] for a in artists_from_db], compact=True)
     print(f"Retrieved {len(artists_from_spotify)} corresponding artists from Spotify.")
-    #albums_from_spotify = spclient.get_albums_by_id([b['id'] for b in albums_from_db])
-    #print(f"Retrieved {len(albums_from_spotify)} corresponding albums from Spotify.")
 
-    node_counter = 0
-    rel_counter = 0
-    mark1 = mark2 = time()
     assert len(artists_from_db) == len(artists_from_spotify), "Number of artists from DB and Spotify came out uneven."
+    genre_names = {genre_name for artist in artists_from_spotify for genre_name in artist['genres']}
+    new_genres = genre_names - graph.existing_keys('Genre', genre_names)
+    graph.merge_nodes('Genre', [{'name': genre_name} for genre_name in new_genres])
+
+    rels = []
     for index, artist in enumerate(artists_from_spotify):
         assert artist['id'] == artists_from_db[index]['id'], "Artists from Spotify and DB fell out of sync."
-        for genre_name in artist['genres']:
-            with graph.begin() as tx:
-                genreNode = tx.evaluate('MATCH (g:Genre {name:$name}) RETURN g', name=genre_name)
-                if not genreNode:
-                    genreNode = GenreNode(name=genre_name)
-                    node_counter += 1
-                genreRel = Relationship(
-                    artists_from_db[index],
-                    'GENRE_ASSOC',
-                    genreNode,
-                    )
-                rel_counter += 1
-                tx.merge(genreNode | genreRel)
-        if time()-mark1 > 60:
-            print(
-                f"{int((time()-mark0)/60)} minutes elapsed. "
-                f"{node_counter} new Genre nodes created. "
-                f"{rel_counter} GENRE_ASSOC relationships created."
-                )
-            mark1 = time()
+        rels.extend((artist['id'], genre_name, {}) for genre_name in artist['genres'])
+    graph.merge_relationships('GENRE_ASSOC', 'Artist', 'Genre', rels)
 
-    print(f"Artist-genre associations completed in {int((time()-mark2)/60)} minutes.")
-    print(f"{node_counter} new Genre nodes created. {rel_counter} GENRE_ASSOC relationships created.")
+    print(f"Artist-genre associations completed in {int((time()-mark0)/60)} minutes.")
+    print(f"{len(new_genres)} new Genre nodes created. {len(rels)} GENRE_ASSOC relationships created.")
 
     # Currently Spotify doesn't populate the 'genres' attribute of Album objects. They may start in the near future, though.
-    '''
-    mark1 = mark2 = time()
-    assert len(albums_from_db) == len(albums_from_spotify), "Number of albums from DB and Spotify came out uneven."
-    for index, album in enumerate(albums_from_spotify):
-        assert album['id'] == albums_from_db[index]['id'], "Albums from Spotify and DB fell out of sync."
-        for genre_name in album['genres']:
-            with graph.begin() as tx:
-                genreNode = tx.evaluate('MATCH (g:Genre {name:$name}) RETURN g', name=genre_name)
-                if not genreNode:
-                    genreNode = GenreNode(name=genre_name)
-                    genre_counter += 1
-                genreRel = Relationship(
-                    albums_from_db[index],
-                    'GENRE_ASSOC',
-                    genreNode,
-                    )
-                rel_counter += 1
-                tx.merge(Subgraph(genreNode | genreRel))
-        if time()-mark1 > 60:
-            print(
-                f"{int((time()-mark0)/60)} minutes elapsed. "
-                f"{node_counter} new Genre nodes created. "
-                f"{rel_counter} GENRE_ASSOC relationships created."
-                )
-            mark1 = time()
-
-    print(f"Album-genre associations completed in {int((time()-mark2)/60)} minutes.")
-    print(f"{node_counter} new Genre nodes created. {rel_counter} GENRE_ASSOC relationships created.")
-    '''
 
 def sanitize(stringyboi):
     ''' For sanitizing strings to be used in DB queries.
@@ -540,25 +358,59 @@ def sanitize(stringyboi):
         }))
 
 
-if __name__ == '__main__':
+def update_cooccurrence_index(graph, changed_playlists, path=None):
+    ''' Keeps the song similarity index playlistappearance.py uses in step with the graph.
+        The saved index only has the playlists that changed in this load updated;
+        if there isn't one yet, it's built from every INCLUDES rel in the graph. Needs numpy and scipy.
+    '''
+    try:
+        from cooccurrence import CooccurrenceIndex, DEFAULT_INDEX_PATH
+    except ImportError as error:
+        print(f"\nSkipping the co-occurrence index ({error}).")
+        return
+    path = path or DEFAULT_INDEX_PATH
+    mark0 = time()
+    if os.path.exists(os.path.join(path, 'ids.json')):
+        index = CooccurrenceIndex.load(path)
+        affected = sum(index.update_playlist(playlist_id, song_ids) for playlist_id, song_ids in changed_playlists.items())
+        print(f"\nUpdated the co-occurrence index for {len(changed_playlists)} changed playlists "
+            f"({affected} neighbor lists recomputed) in {time()-mark0:.1f} seconds.")
+    else:
+        index = CooccurrenceIndex.from_graph(graph)
+        print(f"\nBuilt the co-occurrence index from the whole graph in {time()-mark0:.1f} seconds.")
+    index.save(path)
+
+
+def main(sp=None, config=None):
+    ''' Runs every stage of the load, sharing one client between them.
+    '''
+    sp = sp or subSpotify(scope=SCOPE)
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read('config.cfg')
+
+    # [GRAPH] backend = sqlite keeps the whole load in-process instead of talking to a Neo4j server
+    g = backend_from_config(config)
+
+    merge_friends(g, [s.strip() for s in config.get('NEO4J', 'friend_ids').split('\n')], spclient=sp)
+    merge_playlists(g, spclient=sp)
+    changed_playlists = merge_songs(g, spclient=sp)
+    if config.has_section('CRAWL'):
+        # Spends [CRAWL] budget requests reaching past the friends, starting where the last run stopped.
+        # It runs after merge_songs() so the friends' songs are there to score overlap against.
+        crawler = GraphCrawler.from_config(g, sp, config)
+        crawler.seed(f['id'] for f in g.nodes('Friend'))
+        crawler.run()
+        changed_playlists.update(crawler.merged)
+    merge_audio_features(g, spclient=sp)
+    merge_albums(g, spclient=sp)
+    merge_artists(g, spclient=sp)
+    merge_performs_rels(g, spclient=sp)
+    merge_genres(g, spclient=sp)
+
+    update_cooccurrence_index(g, changed_playlists)
+    g.close()
 
-    sp = subSpotify(scope='''
-        playlist-read-private 
-        playlist-read-collaborative 
-        user-follow-read 
-        ''')
- 
-    config = configparser.ConfigParser()
-    config.read('config.cfg') 
-    user = config.get('NEO4J', 'user')
-    password = config.get('NEO4J', 'password')
-    
-    g = Graph('http://localhost:7474/db/data', user=user, password=password)
- 
-    merge_friends(g, [s.strip() for s in config.get('NEO4J', 'friend_ids').split('\n')])
-    merge_playlists(g)
-    merge_songs(g)
-    merge_albums(g)
-    merge_artists(g)
-    merge_performs_rels(g)
-    merge_genres(g)
+
+if __name__ == '__main__':
+    main()
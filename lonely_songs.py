@@ -1,27 +1,57 @@
 import spotipy
 from spotipyhelper import *
+from library_snapshot import LibrarySnapshot
 
 
-if __name__ == '__main__':
-    
-    sp = subSpotify(scope='''
-        user-library-read
-        playlist-read-private
-        playlist-modify-private
-        ''')
-    
-    lonely_songs = sp.lonely_songs()
+SCOPE = '''
+    user-library-read
+    playlist-read-private
+    playlist-modify-private
+    '''
+
+PLAYLIST_NAME = 'All the Lonely Songs'
+
+
+def is_lonely_songs_playlist(playlist, user_id):
+    ''' Whether a playlist is the one main() collects into: the user's own playlist with that name.
+        Someone else's playlist with the same name that the user follows doesn't count.
+        The owner can be an owner object or just its ID.
+    '''
+    owner = playlist['owner']
+    return playlist['name'] == PLAYLIST_NAME and (owner['id'] if isinstance(owner, dict) else owner) == user_id
+
+
+def main(sp=None):
+    ''' Collects every saved song that isn't in any of your playlists into a playlist called 'All the Lonely Songs'.
+    '''
+    sp = sp or subSpotify(scope=SCOPE)
+
+    user_id = sp.me()['id']
+    existing = [p for p in sp.aggregate_paging_results(sp.current_user_playlists()) if is_lonely_songs_playlist(p, user_id)]
+
+    snapshot = LibrarySnapshot()
+    # The songs already collected into it would otherwise stop counting as lonely the next time round
+    lonely_songs = sp.lonely_songs(snapshot, exclude=[p['id'] for p in existing])
+    snapshot.save()
 
 
     print(*[s['name'] for s in lonely_songs], sep='\n')
     print(f"You have {len(lonely_songs)} lonely songs")
 
-    if len(lonely_songs) > 0:
+    if existing:
+        # Only the difference from last time gets sent
+        sp.sync_playlist_tracks(existing[0], track_list=lonely_songs)
+
+    elif len(lonely_songs) > 0:
 
         new_playlist = sp.user_playlist_create(
-            user=sp.me()['id'],
-            name='All the Lonely Songs',
+            user=user_id,
+            name=PLAYLIST_NAME,
             public=False
             )
 
         sp.add_tracks_to_playlist(playlist=new_playlist, track_list=lonely_songs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+from tracing import carry_helper
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TrackInterner:
+
+    ''' Hands out a small integer code for every track ID it sees, so playlists can be stored as bitsets.
+    '''
+
+    def __init__(self):
+        self.ids = []
+        self._codes = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, track_id):
+        code = self._codes.get(track_id)
+        if code is None:
+            code = self._codes[track_id] = len(self.ids)
+            self.ids.append(track_id)
+        return code
+
+    def code(self, track_id):
+        return self._codes.get(track_id)
+
+
+class PlaylistSets:
+
+    ''' Set algebra over any number of playlists.
+
+        Each playlist is stored as a bitset (a Python int) over interned track IDs,
+        so unions, intersections and overlap counts are a handful of word-wide operations per playlist.
+        Full track objects are only looked up for the final result, unless keep_tracks is set,
+        in which case the ones seen while fetching are kept around for hydrate() to use.
+    '''
+
+    def __init__(self, sp=None, keep_tracks=False):
+        self.sp = sp
+        self.keep_tracks = keep_tracks
+        self.interner = TrackInterner()
+        self._bits = {}
+        self._tracks = {}
+
+    def __contains__(self, key):
+        return key in self._bits
+
+    def keys(self):
+        return list(self._bits)
+
+    def add(self, key, tracks):
+        ''' Stores a playlist under key from a list of track objects or track IDs.
+        '''
+        codes = []
+        for track in tracks:
+            if isinstance(track, str):
+                track_id = track
+            elif track and track['id']:
+                track_id = track['id']
+                if self.keep_tracks:
+                    self._tracks.setdefault(track_id, track)
+            else:
+                # Local files don't have an id
+                continue
+            codes.append(self.interner.intern(track_id))
+        self._bits[key] = self.from_codes(codes)
+
+    def fetch(self, playlists, max_workers=8):
+        ''' Fetches the tracks of every playlist concurrently and stores each one under its playlist ID.
+        '''
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Without keep_tracks only the IDs are needed, so that's all that gets asked for
+            fields = None if self.keep_tracks else 'items(track(id))'
+            fetched = list(executor.map(carry_helper(lambda p: self.sp.get_tracks_from_playlist(playlist=p, fields=fields)), playlists))
+        for playlist, tracks in zip(playlists, fetched):
+            self.add(playlist['id'], tracks)
+
+    @staticmethod
+    def from_codes(codes):
+        if not codes:
+            return 0
+        bitmap = bytearray(max(codes) // 8 + 1)
+        for code in codes:
+            bitmap[code >> 3] |= 1 << (code & 7)
+        return int.from_bytes(bitmap, 'little')
+
+    def bits(self, key):
+        return self._bits[key]
+
+    def union(self, *keys):
+        result = 0
+        for key in keys:
+            result |= self._bits[key]
+        return result
+
+    def intersection(self, *keys):
+        result = self._bits[keys[0]]
+        for key in keys[1:]:
+            result &= self._bits[key]
+        return result
+
+    def difference(self, key, *others):
+        ''' Tracks in the first playlist that are in none of the others.
+        '''
+        return self._bits[key] & ~self.union(*others)
+
+    def symmetric_difference(self, *keys):
+        ''' Tracks that appear in exactly one of the playlists.
+        '''
+        seen = once = 0
+        for key in keys:
+            bits = self._bits[key]
+            once = (once & ~bits) | (bits & ~seen)
+            seen |= bits
+        return once
+
+    def overlap_matrix(self, keys=None):
+        ''' Returns (keys, matrix) where matrix[i][j] is the number of tracks playlists i and j have in common.
+            The diagonal holds the size of each playlist.
+
+            Computed as A @ A.T over a sparse playlist-by-track incidence matrix, so the work grows with
+            the number of co-occurring track pairs rather than with every pair of playlists. Needs numpy and scipy.
+        '''
+        import numpy as np
+        from scipy import sparse
+
+        keys = list(keys or self._bits)
+        rows = []
+        for bits in (self._bits[key] for key in keys):
+            bitmap = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+            rows.append(np.flatnonzero(np.unpackbits(bitmap, bitorder='little')))
+        lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+        incidence = sparse.csr_matrix(
+            (np.ones(lengths.sum(), dtype=np.int32),
+             np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64),
+             np.concatenate(([0], np.cumsum(lengths)))),
+            shape=(len(keys), len(self.interner)),
+            )
+        return keys, (incidence @ incidence.T).toarray()
+
+    def ids(self, bits):
+        ''' Turns a bitset back into a list of track IDs, in interning order.
+        '''
+        ids = self.interner.ids
+        return [ids[code] for code, bit in enumerate(reversed(bin(bits)[2:])) if bit == '1']
+
+    def hydrate(self, bits):
+        ''' Returns the full track objects for a bitset, only requesting the ones that weren't kept while fetching.
+        '''
+        ids = self.ids(bits)
+        missing = [track_id for track_id in ids if track_id not in self._tracks]
+        if missing:
+            for track in self.sp.get_tracks_by_id(missing):
+                if track:
+                    self._tracks[track['id']] = track
+        return [self._tracks[track_id] for track_id in ids if track_id in self._tracks]
@@ -0,0 +1,148 @@
+import bisect
+
+
+def _label_occurrences(track_ids):
+    ''' Turns ['a', 'b', 'a'] into [('a', 0), ('b', 0), ('a', 1)] so duplicates can be told apart.
+    '''
+    seen = {}
+    labels = []
+    for track_id in track_ids:
+        count = seen.get(track_id, 0)
+        seen[track_id] = count + 1
+        labels.append((track_id, count))
+    return labels
+
+def _longest_increasing_subsequence(values):
+    ''' Returns the indexes of one longest strictly increasing subsequence of values.
+    '''
+    tails = []
+    tail_indexes = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        position = bisect.bisect_left(tails, value)
+        if position == len(tails):
+            tails.append(value)
+            tail_indexes.append(i)
+        else:
+            tails[position] = value
+            tail_indexes[position] = i
+        previous[i] = tail_indexes[position-1] if position else -1
+    indexes = []
+    i = tail_indexes[-1] if tail_indexes else -1
+    while i != -1:
+        indexes.append(i)
+        i = previous[i]
+    return set(indexes)
+
+
+def plan_playlist_sync(current_ids, desired_ids):
+    ''' Works out the edits that turn a playlist's current track IDs into the desired ones.
+
+        Returns a list of operations to apply in order, each against the playlist as the previous ones left it:
+            ('remove', [(track_id, [positions]), ...])   positions are all higher than anything in later removes
+            ('move', range_start, insert_before, range_length)   like the reorder endpoint
+            ('add', [track_ids], position)
+        Only tracks that aren't wanted are removed, only tracks that aren't there are added,
+        and tracks are only moved if they fall outside the longest run that's already in the desired order.
+        Tracks that sit next to each other and belong next to each other in the same new place move as one range.
+        Entries of current_ids that are None (local files) are left alone.
+    '''
+    operations = []
+    desired_labels = _label_occurrences(desired_ids)
+    desired_set = set(desired_labels)
+    current = [label if label[0] is not None else None for label in _label_occurrences(current_ids)]
+
+    # Removals, highest positions first so each batch leaves the positions of the next one untouched
+    doomed = [i for i, label in enumerate(current) if label is not None and label not in desired_set]
+    for start in range(len(doomed), 0, -100):
+        batch = doomed[max(0, start-100):start]
+        positions = {}
+        for i in batch:
+            positions.setdefault(current[i][0], []).append(i)
+        operations.append(('remove', list(positions.items())))
+    for i in reversed(doomed):
+        del current[i]
+
+    # Moves, for every kept track that isn't part of the longest run already in desired order
+    target_index = {label: i for i, label in enumerate(desired_labels)}
+    kept_labels = {label for label in current if label is not None}
+    kept = [(i, target_index[label]) for i, label in enumerate(current) if label is not None]
+    in_place = _longest_increasing_subsequence([t for _, t in kept])
+    to_move = sorted((t, current[i]) for n, (i, t) in enumerate(kept) if n not in in_place)
+    kept_rank = {label: rank for rank, label in enumerate(l for l in desired_labels if l in kept_labels)}
+    n = 0
+    while n < len(to_move):
+        t, label = to_move[n]
+        range_start = current.index(label)
+        # Extend the range while the next track to move is both the next one along and the next kept one in desired order
+        range_length = 1
+        while (n + range_length < len(to_move)
+                and kept_rank[to_move[n + range_length][1]] == kept_rank[label] + range_length
+                and current[range_start + range_length:range_start + range_length + 1] == [to_move[n + range_length][1]]):
+            range_length += 1
+        n += range_length
+        previous = next((desired_labels[p] for p in range(t-1, -1, -1) if desired_labels[p] in kept_labels), None)
+        insert_before = current.index(previous) + 1 if previous else 0
+        if range_start <= insert_before <= range_start + range_length:
+            continue
+        operations.append(('move', range_start, insert_before, range_length))
+        moved = current[range_start:range_start + range_length]
+        del current[range_start:range_start + range_length]
+        position = insert_before if insert_before < range_start else insert_before - range_length
+        current[position:position] = moved
+
+    # Additions, in runs of up to 100 consecutive new tracks
+    present = set(current)
+    run = []
+    run_position = 0
+    previous_label = None
+    for label in desired_labels + [None]:
+        if label is not None and label not in present:
+            if not run:
+                previous_index = current.index(previous_label) if previous_label else -1
+                run_position = previous_index + 1
+            run.append(label)
+            if len(run) < 100:
+                previous_label = label
+                continue
+        if run:
+            operations.append(('add', [track_id for track_id, _ in run], run_position))
+            current[run_position:run_position] = run
+            present.update(run)
+            run = []
+        previous_label = label
+    return operations
+
+
+def sync_playlist(sp, playlist, desired_ids):
+    ''' Makes an existing playlist hold exactly desired_ids, in order, with as few requests as possible.
+        Every remove and reorder is made against the snapshot_id the previous edit returned,
+        so a playlist that's being edited somewhere else at the same time makes the API reject the change.
+        (The add endpoint doesn't take a snapshot_id, but the one it returns is carried on to the next edit.)
+        Returns the number of write requests made.
+    '''
+    current = sp.playlist(playlist['id'], fields='snapshot_id,tracks.items(track(id)),tracks.next')
+    snapshot_id = current['snapshot_id']
+    current_ids = [t['track']['id'] if t['track'] else None for t in sp.aggregate_paging_results(current['tracks'])]
+
+    operations = plan_playlist_sync(current_ids, desired_ids)
+    for operation in operations:
+        if operation[0] == 'remove':
+            result = sp.playlist_remove_specific_occurrences_of_items(
+                playlist['id'],
+                [{'uri': track_id, 'positions': positions} for track_id, positions in operation[1]],
+                snapshot_id=snapshot_id,
+                )
+        elif operation[0] == 'move':
+            result = sp.playlist_reorder_items(
+                playlist['id'],
+                range_start=operation[1],
+                insert_before=operation[2],
+                range_length=operation[3],
+                snapshot_id=snapshot_id,
+                )
+        else:
+            result = sp.playlist_add_items(playlist['id'], operation[1], position=operation[2])
+        snapshot_id = result['snapshot_id']
+    print(f"Synced {playlist.get('name', playlist['id'])} with {len(operations)} edits.")
+    return len(operations)
@@ -1,14 +1,54 @@
 import spotipy
 from spotipyhelper import *
 
+import os
+
+
+SCOPE = '''
+	playlist-read-private 
+	playlist-read-collaborative 
+	user-follow-read 
+	'''
+
+# Where load_data_neo4j.py saves its cooccurrence.CooccurrenceIndex. It's spelled out here
+# so numpy and scipy only get imported when there's an index to read.
+INDEX_PATH = 'cooccurrence'
+
+
+def show_appearances(sp, song_uri, index=None):
+	song = sp.track(song_uri)
+
+	playlists = sp.playlists_where_song_appears(sp.me()['id'], song['id'])
+
+	if playlists:
+		print(f"\n{song['name']} appears in: \n")
+		for playlist in playlists:
+			print(f"* {playlist['name']}")
+
+	else:
+		print(f"\n{song['name']} doesn't appear in any of your playlists.")
+		suggestions = index.suggest_playlists(song['id']) if index else []
+		if suggestions:
+			print(f"\nIt might fit in: \n")
+			for playlist_id, _ in suggestions:
+				print(f"* {sp.playlist(playlist_id, fields='name')['name']}")
 
-if __name__ == '__main__':
 
-	sp = subSpotify(scope='''
-		playlist-read-private 
-		playlist-read-collaborative 
-		user-follow-read 
-		''')
+def main(sp=None, song_uri=None):
+	''' Answers for song_uri if it's given, otherwise keeps asking for songs until it gets an x.
+	'''
+	sp = sp or subSpotify(scope=SCOPE)
+
+	# Used to suggest a home for songs that aren't in any playlist yet
+	if os.path.exists(INDEX_PATH):
+		from cooccurrence import CooccurrenceIndex
+		index = CooccurrenceIndex.load(INDEX_PATH)
+	else:
+		index = None
+
+	if song_uri:
+		show_appearances(sp, song_uri, index)
+		return
 
 	song_uri = input("\nPaste song URI here: ")
 
@@ -16,17 +56,7 @@ if __name__ == '__main__':
 		while (song_uri != "x"):
 
 			try:
-				song = sp.track(song_uri)
-
-				playlists = sp.playlists_where_song_appears(sp.me()['id'], song['id'])
-
-				if playlists:
-					print(f"\n{song['name']} appears in: \n")
-					for playlist in playlists:
-						print(f"* {playlist['name']}")
-
-				else:
-					print(f"\n{song['name']} doesn't appear in any of your playlists.")
+				show_appearances(sp, song_uri, index)
 
 			except spotipy.SpotifyException:
 				print("Invalid URI")
@@ -35,4 +65,8 @@ if __name__ == '__main__':
 
 	except Exception as error:
 		print(f"something went wrong:\n{error}")
-		input()
\ No newline at end of file
+		input()
+
+
+if __name__ == '__main__':
+	main()
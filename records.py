@@ -0,0 +1,113 @@
+class Record:
+
+    ''' A compact, read-only stand-in for a Spotify JSON object that keeps only a few fields.
+
+        Records can still be read like the dicts they replace (record['id'], record.get('name')),
+        so code written against the full objects keeps working, but each one is a handful of slots
+        instead of a dict holding every nested object the API sent back.
+    '''
+
+    __slots__ = ()
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def __contains__(self, field):
+        return field in self.__slots__
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __hash__(self):
+        return hash((type(self), self.id))
+
+    def __repr__(self):
+        fields = ', '.join(f'{f}={getattr(self, f)!r}' for f in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+    def to_dict(self):
+        ''' The record as plain JSON-ready dicts and lists, e.g. for the snapshot and index files.
+        '''
+        return {f: _to_plain(getattr(self, f)) for f in self.__slots__}
+
+def _to_plain(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    elif isinstance(value, tuple):
+        return [_to_plain(v) for v in value]
+    return value
+
+
+class UserRecord(Record):
+    __slots__ = ('id', 'name')
+
+    def __init__(self, obj):
+        self.id = obj['id']
+        self.name = obj.get('display_name') or obj.get('name') or obj['id']
+
+
+class ArtistRecord(Record):
+    ''' popularity and genres are None for the simplified artists nested in tracks and albums.
+    '''
+    __slots__ = ('id', 'name', 'popularity', 'genres')
+
+    def __init__(self, obj):
+        self.id = obj['id']
+        self.name = obj['name']
+        self.popularity = obj.get('popularity')
+        genres = obj.get('genres')
+        self.genres = tuple(genres) if genres is not None else None
+
+
+class AlbumRecord(Record):
+    __slots__ = ('id', 'name', 'release_date', 'album_type', 'album_group', 'popularity', 'artists')
+
+    def __init__(self, obj):
+        self.id = obj['id']
+        self.name = obj['name']
+        self.release_date = obj.get('release_date')
+        self.album_type = obj.get('album_type')
+        self.album_group = obj.get('album_group')
+        self.popularity = obj.get('popularity')
+        self.artists = tuple(ArtistRecord(a) for a in obj.get('artists', ()))
+
+
+class TrackRecord(Record):
+    ''' When a market is given, Spotify may relink a track to a playable copy with a different ID.
+        The record keeps the ID that was asked for, so it still lines up with the request.
+    '''
+    __slots__ = ('id', 'name', 'popularity', 'duration_ms', 'explicit', 'uri', 'artists', 'album')
+
+    def __init__(self, obj):
+        linked_from = obj.get('linked_from')
+        self.id = linked_from['id'] if linked_from else obj['id']
+        self.name = obj.get('name')
+        self.popularity = obj.get('popularity')
+        self.duration_ms = obj.get('duration_ms')
+        self.explicit = obj.get('explicit')
+        self.uri = obj.get('uri')
+        self.artists = tuple(ArtistRecord(a) for a in obj.get('artists', ()))
+        self.album = AlbumRecord(obj['album']) if obj.get('album') else None
+
+
+class PlaylistRecord(Record):
+    __slots__ = ('id', 'name', 'owner', 'snapshot_id', 'total_tracks')
+
+    def __init__(self, obj):
+        self.id = obj['id']
+        self.name = obj.get('name')
+        self.owner = UserRecord(obj['owner']) if obj.get('owner') else None
+        self.snapshot_id = obj.get('snapshot_id')
+        self.total_tracks = obj.get('tracks', {}).get('total')
+
+
+def compact(record_type, obj):
+    ''' Builds a record from a JSON object, passing None (unknown IDs, removed tracks) straight through.
+    '''
+    return record_type(obj) if obj is not None else None
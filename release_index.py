@@ -0,0 +1,122 @@
+import records
+import requests
+import spotipy
+from spotipyhelper import parse_date
+from tracing import carry_helper
+
+import bisect
+import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ReleaseIndex:
+
+    ''' A local index of each artist's releases, kept sorted by release date and persisted as JSON.
+
+        Every artist has a watermark of when it was last refreshed. A stale artist only has its releases
+        since its newest known one fetched again, and "what came out after X" is a bisect instead of a crawl.
+    '''
+
+    def __init__(self, path='release_index.json'):
+        self.path = path
+        self._artists = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as fp:
+                self._artists = json.load(fp)
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump(self._artists, fp)
+        os.replace(tmp_path, self.path)
+
+    def __contains__(self, artist_id):
+        return artist_id in self._artists
+
+    def copy(self):
+        ''' An independent copy to refresh while this one is still being read from.
+            The album dicts themselves are never changed once they're in, so only the containers are copied.
+        '''
+        index = ReleaseIndex(path=None)
+        index.path = self.path
+        index._artists = {artist_id: {**entry, 'dates': list(entry['dates']), 'albums': list(entry['albums'])}
+            for artist_id, entry in self._artists.items()}
+        return index
+
+    def __len__(self):
+        return len(self._artists)
+
+    def add_albums(self, artist, albums, refreshed=None):
+        ''' Inserts albums into an artist's entry, keeping it sorted by release date and skipping ones already there.
+        '''
+        entry = self._artists.setdefault(artist['id'], {
+            'artist': {'id': artist['id'], 'name': artist['name']},
+            'refreshed': None,
+            'dates': [],
+            'albums': [],
+            })
+        known = {a['id'] for a in entry['albums']}
+        for album in albums:
+            if album['id'] in known:
+                continue
+            known.add(album['id'])
+            ordinal = parse_date(album['release_date']).toordinal()
+            index = bisect.bisect_right(entry['dates'], ordinal)
+            entry['dates'].insert(index, ordinal)
+            entry['albums'].insert(index, records.AlbumRecord(album).to_dict())
+        if refreshed:
+            entry['refreshed'] = refreshed.isoformat()
+
+    def stale_artists(self, artists, max_age=datetime.timedelta(days=1)):
+        now = datetime.datetime.now()
+        return [a for a in artists if a['id'] not in self._artists
+            or not self._artists[a['id']]['refreshed']
+            or now - datetime.datetime.fromisoformat(self._artists[a['id']]['refreshed']) > max_age]
+
+    def refresh(self, sp, artists, max_age=datetime.timedelta(days=1), include_groups=('album', 'single'), max_workers=8):
+        ''' Brings every artist that hasn't been refreshed within max_age up to date.
+            Artists that are new to the index get their whole discography fetched;
+            known artists only get pages down to their newest release already in the index.
+        '''
+        stale = self.stale_artists(artists, max_age)
+
+        def fetch(artist):
+            entry = self._artists.get(artist['id'])
+            since = datetime.date.fromordinal(entry['dates'][-1]) if entry and entry['dates'] else None
+            try:
+                return sp.artist_albums_since(artist['id'], since, include_groups)
+            except (spotipy.SpotifyException, requests.exceptions.RequestException) as error:
+                # Left stale, so the next refresh tries this artist again
+                print(f"Couldn't refresh releases for {artist['id']}:\n{error}")
+                return None
+
+        refreshed = datetime.datetime.now()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for artist, albums in zip(stale, executor.map(carry_helper(fetch), stale)):
+                if albums is not None:
+                    self.add_albums(artist, albums, refreshed)
+        print(f"Refreshed releases for {len(stale)} of {len(artists)} artists.")
+
+    def releases_after(self, artist_id, cutoff):
+        ''' Returns a list of (album, date) pairs released on or after the cutoff date, oldest first.
+        '''
+        entry = self._artists.get(artist_id)
+        if not entry:
+            return []
+        start = bisect.bisect_left(entry['dates'], cutoff.toordinal())
+        return [(album, datetime.date.fromordinal(ordinal))
+            for ordinal, album in zip(entry['dates'][start:], entry['albums'][start:])]
+
+    def albums_after(self, datestring, artists):
+        ''' Same shape of result as subSpotify.albums_after(), but answered from the index:
+            a dict of artist id -> (artist, [(album, date), ...]) for artists with anything new.
+        '''
+        cutoff = parse_date(datestring)
+        new_albums = {}
+        for artist in artists:
+            albums_with_dates = self.releases_after(artist['id'], cutoff)
+            if albums_with_dates:
+                new_albums[artist['id']] = (artist, albums_with_dates)
+        return new_albums
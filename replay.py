@@ -0,0 +1,189 @@
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from transport import make_session
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import zlib
+from time import sleep, time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+def request_key(method, url, body=None):
+    ''' Identifies a request independently of query parameter order.
+    '''
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    key = f"{method} {urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))}"
+    if body:
+        if isinstance(body, str):
+            body = body.encode()
+        key += f" {hashlib.sha1(body).hexdigest()}"
+    return key
+
+
+class ResponseArchive:
+
+    ''' An append-only archive of request/response pairs in a directory:
+            responses.bin  each response as its own zlib-compressed record, so any one can be read on its own
+            index.jsonl    one line per record with its request key, offset and length
+        The same request can be recorded more than once; replays hand the recordings back in order.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._data_path = os.path.join(path, 'responses.bin')
+        self._index_path = os.path.join(path, 'index.jsonl')
+        self._lock = threading.Lock()
+        self._index = {}
+        self._replayed = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding='utf-8') as fp:
+                for line in fp:
+                    entry = json.loads(line)
+                    self._index.setdefault(entry['key'], []).append((entry['offset'], entry['length']))
+
+    def __len__(self):
+        return sum(len(records) for records in self._index.values())
+
+    def append(self, key, status, reason, headers, body, elapsed):
+        header = json.dumps({'status': status, 'reason': reason, 'headers': headers, 'elapsed': elapsed, 'recorded': time()})
+        record = zlib.compress(header.encode() + b'\n' + body)
+        with self._lock:
+            with open(self._data_path, 'ab') as fp:
+                fp.seek(0, os.SEEK_END)
+                offset = fp.tell()
+                fp.write(record)
+            with open(self._index_path, 'a', encoding='utf-8') as fp:
+                fp.write(json.dumps({'key': key, 'offset': offset, 'length': len(record)}) + '\n')
+            self._index.setdefault(key, []).append((offset, len(record)))
+
+    def next_response(self, key):
+        ''' Returns (header, body) for the next recording of key, repeating the last one once they run out,
+            or None if the request was never recorded.
+        '''
+        with self._lock:
+            records = self._index.get(key)
+            if not records:
+                return None
+            count = self._replayed.get(key, 0)
+            self._replayed[key] = count + 1
+            offset, length = records[min(count, len(records) - 1)]
+            with open(self._data_path, 'rb') as fp:
+                fp.seek(offset)
+                record = zlib.decompress(fp.read(length))
+        header, body = record.split(b'\n', 1)
+        return json.loads(header), body
+
+    def rewind(self):
+        with self._lock:
+            self._replayed.clear()
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+def open_archive(path):
+    ''' Every client in the process shares one ResponseArchive per path,
+        so replays stay in order even when a script builds several subSpotify instances.
+    '''
+    path = os.path.abspath(path)
+    with _archives_lock:
+        if path not in _archives:
+            _archives[path] = ResponseArchive(path)
+        return _archives[path]
+
+
+class RecordingAdapter(BaseAdapter):
+
+    ''' Sends requests through another adapter and writes every response into an archive on the way back.
+    '''
+
+    def __init__(self, archive, adapter):
+        super().__init__()
+        self.archive = archive
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        # The body gets stored decompressed, so the headers describing the compression don't apply to it
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        self.archive.append(
+            request_key(request.method, request.url, request.body),
+            response.status_code,
+            response.reason,
+            headers,
+            response.content,
+            response.elapsed.total_seconds(),
+            )
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+
+    ''' Answers requests from an archive without touching the network.
+        Each response can be delayed by latency_scale times the latency it was recorded with, plus a fixed latency.
+    '''
+
+    def __init__(self, archive, latency_scale=0.0, latency=0.0):
+        super().__init__()
+        self.archive = archive
+        self.latency_scale = latency_scale
+        self.latency = latency
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.body)
+        recorded = self.archive.next_response(key)
+        if recorded is None:
+            raise ConnectionError(f"No recorded response for {key}", request=request)
+        header, body = recorded
+
+        delay = self.latency + self.latency_scale * header['elapsed']
+        if delay > 0:
+            sleep(delay)
+
+        response = Response()
+        response.status_code = header['status']
+        response.reason = header['reason']
+        response.headers = CaseInsensitiveDict(header['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=header['elapsed'])
+        return response
+
+    def close(self):
+        pass
+
+
+def recording_session(path, **session_options):
+    ''' A transport.make_session() session that also records every response into the archive at path.
+    '''
+    archive = open_archive(path)
+    session = make_session(**session_options)
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, RecordingAdapter(archive, session.get_adapter(prefix)))
+    return session
+
+def replay_session(path, latency_scale=0.0, latency=0.0, **session_options):
+    ''' A session that serves every request from the archive at path and never goes to the network.
+    '''
+    archive = open_archive(path)
+    session = make_session(**session_options)
+    adapter = ReplayAdapter(archive, latency_scale, latency)
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, adapter)
+    session.offline = True
+    return session
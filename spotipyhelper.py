@@ -1,11 +1,30 @@
+import requests
 import spotipy
 import spotipy.util as util
 from spotipy.oauth2 import SpotifyClientCredentials
 
+from playlist_sets import PlaylistSets
+from playlist_sync import sync_playlist
+from coalescer import RequestCoalescer
+from transport import make_session
+import records
+from replay import recording_session, replay_session
+from tracing import Tracer, traced, carry_helper
+
+import atexit
 import configparser
 import os
+import threading
 from json import JSONDecodeError
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+# The order Spotify returns an artist's albums in when asked for more than one album group
+ALBUM_GROUPS = ('album', 'single', 'compilation', 'appears_on')
+
+# Built on first use by subSpotify.default_tracer()
+_default_tracer = False
 
 
 class subSpotify(spotipy.Spotify):
@@ -13,11 +32,27 @@ class subSpotify(spotipy.Spotify):
     ''' This is a subclass of spotipy.Spotify for the purpose of defining new methods.
     '''
 
-    def __init__(self, token=None, scope=None):
+    def __init__(self, token=None, scope=None, transport=None, tracer=None):
+        ''' transport is the requests.Session to send API calls through, see transport.make_session().
+            By default it's built from the [TRANSPORT] section of config.cfg, see default_transport().
+            tracer is a tracing.Tracer to record every call in, by default the one from default_tracer().
+            Pass tracer=False to leave this client untraced whatever config.cfg says.
+        '''
+        if transport is None:
+            transport = subSpotify.default_transport()
+        if tracer is None:
+            tracer = subSpotify.default_tracer()
+        if tracer:
+            tracer.attach(transport)
+        else:
+            tracer = None
         if not token:
-            token = subSpotify.generate_token(scope)
+            # Replayed responses don't need a real token
+            token = 'offline' if getattr(transport, 'offline', False) else subSpotify.generate_token(scope)
         assert token, "Failed to get token on subSpotify initialization."
-        super().__init__(token)
+        super().__init__(token, requests_session=transport)
+        self.transport = transport
+        self.tracer = tracer
         self._scope = scope
 
     @staticmethod
@@ -55,82 +90,156 @@ class subSpotify(spotipy.Spotify):
             
         return token
 
+    @staticmethod
+    def default_transport():
+        ''' Reads an optional [TRANSPORT] section from config.cfg:
+            [TRANSPORT]
+            pool_size = 16
+            record = recordings/run1        (write every response into this archive)
+            replay = recordings/run1        (answer every request from this archive, offline)
+            latency_scale = 1.0             (when replaying, wait as long as the recorded request took)
+        '''
+        config = configparser.ConfigParser()
+        config.read('config.cfg')
+        pool_size = config.getint('TRANSPORT', 'pool_size', fallback=16)
+        if config.has_option('TRANSPORT', 'replay'):
+            return replay_session(
+                config.get('TRANSPORT', 'replay'),
+                latency_scale=config.getfloat('TRANSPORT', 'latency_scale', fallback=0.0),
+                pool_size=pool_size,
+                )
+        elif config.has_option('TRANSPORT', 'record'):
+            return recording_session(config.get('TRANSPORT', 'record'), pool_size=pool_size)
+        else:
+            return make_session(pool_size=pool_size)
+
+    @staticmethod
+    def default_tracer():
+        ''' The Tracer every client in the process shares if config.cfg has a [TRACE] section (see Tracer.from_config()),
+            otherwise None. With report = yes, its summary is printed when the process exits.
+        '''
+        global _default_tracer
+        if _default_tracer is False:
+            config = configparser.ConfigParser()
+            config.read('config.cfg')
+            if config.has_section('TRACE'):
+                _default_tracer = Tracer.from_config(config)
+                if config.getboolean('TRACE', 'report', fallback=False):
+                    atexit.register(lambda: print(f"\n{_default_tracer.report()}"))
+                atexit.register(_default_tracer.close)
+            else:
+                _default_tracer = None
+        return _default_tracer
+
     def refresh(self):
-        ''' Supposed to get a freshly authorized client, but doesn't seem to be working at the moment.
+        ''' Gets a freshly authorized client using the scope this one was constructed with.
         '''
         if self._scope:
-            return subSpotify(self._scope)
+            return subSpotify(scope=self._scope, transport=self.transport, tracer=self.tracer or False)
         else:
             raise TypeError("Cannot refresh client without a scope available."
                 + "\nTry constructing the original client by passing the scope instead of a whole token.")
 
+    @traced
     def get_users_by_id(self, user_ids):
-        ''' Handles looking up an iterable of user IDs one at a time, then returning an aggregated list of users.
+        ''' Handles looking up an iterable of user IDs concurrently (there's no batch endpoint for users),
+            then returning an aggregated list of users. Repeated IDs are only looked up once.
         '''
         if user_ids:
-            users = []
-            for user_id in user_id_list:
-                users.append(self.user(user_id))
-            return users
+            with RequestCoalescer(self) as coalescer:
+                return coalescer.get_many('user', user_ids)
         else:
             return []
 
-    def get_tracks_by_id(self, track_ids):
-        ''' Handles splitting an iterable of IDs into appropriately-sized chunks (50), then then returning a single list of aggregated tracks.
+    @traced
+    def get_tracks_by_id(self, track_ids, market=None, compact=False):
+        ''' Handles splitting an iterable of IDs into appropriately-sized chunks (50) and fetching them concurrently,
+            then returning a single list of aggregated tracks. Repeated IDs are only looked up once.
+
+            Passing a market (an ISO country code or 'from_token') makes Spotify leave out the available_markets arrays,
+            which are most of a track's size. compact=True returns records.TrackRecord objects instead of the full JSON.
         '''
         if track_ids:
-            tracks = []
-            for sublist in splitlist(list(track_ids), 50):
-                tracks.extend(self.tracks(sublist)['tracks'])
-            return tracks
+            with RequestCoalescer(self, market=market) as coalescer:
+                tracks = coalescer.get_many('track', track_ids)
+            return [records.compact(records.TrackRecord, t) for t in tracks] if compact else tracks
         else:
             return []
 
-    def get_albums_by_id(self, album_ids):
-        ''' Handles splitting an iterable of IDs into appropriately-sized chunks (20), then returning a single list of aggregated albums.
+    @traced
+    def get_albums_by_id(self, album_ids, market=None, compact=False):
+        ''' Handles splitting an iterable of IDs into appropriately-sized chunks (20) and fetching them concurrently,
+            then returning a single list of aggregated albums.
+            market and compact work like they do for get_tracks_by_id(), but albums come back as records.AlbumRecord objects.
         '''
         if album_ids:
-            albums = []
-            for sublist in splitlist(list(album_ids), 20):
-                albums.extend(self.albums(sublist)['albums'])
-            return albums
+            with RequestCoalescer(self, market=market) as coalescer:
+                albums = coalescer.get_many('album', album_ids)
+            return [records.compact(records.AlbumRecord, a) for a in albums] if compact else albums
         else:
             return []
 
-    def get_artists_by_id(self, artist_ids):
-        ''' Handles splitting an iterable of IDs into appropriately-sized chunks (50), then returning a single list of aggregated artists.
+    @traced
+    def get_artists_by_id(self, artist_ids, compact=False):
+        ''' Handles splitting an iterable of IDs into appropriately-sized chunks (50) and fetching them concurrently,
+            then returning a single list of aggregated artists.
+            compact=True returns records.ArtistRecord objects instead of the full JSON.
         '''
         if artist_ids:
-            artists = []
-            for sublist in splitlist(list(artist_ids), 50):
-                try:
-                    artists.extend(self.artists(sublist)['artists'])
-                except JSONDecodeError as error:
-                    print(f"Encountered JSONDecodeError while attempting to retreive artists for these ids: {sublist}")
-                    continue
-            return artists
+            with RequestCoalescer(self) as coalescer:
+                artists = coalescer.get_many('artist', artist_ids)
+            return [records.compact(records.ArtistRecord, a) for a in artists] if compact else artists
+        else:
+            return []
+
+    @traced
+    def get_audio_features_by_id(self, track_ids, max_workers=8):
+        ''' Handles splitting an iterable of IDs into appropriately-sized chunks (100) and fetching them concurrently,
+            then returning a single list of audio features lined up with the IDs.
+            Tracks Spotify has no features for come back as None.
+        '''
+        track_ids = list(track_ids)
+        if track_ids:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pages = list(executor.map(carry_helper(self.audio_features), splitlist(track_ids, 100)))
+            return [features for page in pages for features in page]
         else:
             return []
 
-    def get_playlists_by_id(self, id_pairs):
-        ''' Handles looking up playlists one at a time with pairs of IDs
+    @traced
+    def get_playlists_by_id(self, id_pairs, fields=None, market=None):
+        ''' Handles looking up playlists concurrently with pairs of IDs
             where an ID pair looks like: (owner_id, playlist_id)
+            fields and market trim the response like they do for get_tracks_from_playlist(),
+            e.g. fields='id,name,tracks.items(track(id)),tracks.next'.
         '''
         if id_pairs:
-            playlists = []
-            for pair in id_pairs:
-                playlists.append(self.user_playlist(pair[0], pair[1]))
-            return playlists
+            with RequestCoalescer(self, market=market, playlist_fields=fields) as coalescer:
+                return coalescer.get_many('playlist', [tuple(pair) for pair in id_pairs])
         else:
             return []
 
-    def get_saved_tracks(self):
-        return [t['track'] for t in self.aggregate_paging_results(self.current_user_saved_tracks())]
-
-    def get_saved_artists(self):
+    @traced
+    def get_saved_tracks(self, snapshot=None, market=None, compact=False):
+        ''' Pass a library_snapshot.LibrarySnapshot to only fetch what changed since it was last refreshed.
+            The tracks then come back in the snapshot's compact form.
+            Otherwise market and compact work like they do for get_tracks_by_id().
+        '''
+        if snapshot is not None:
+            snapshot.refresh(self)
+            return snapshot.tracks()
+        parse = (lambda t: records.compact(records.TrackRecord, t['track'])) if compact else (lambda t: t['track'])
+        return self.aggregate_paging_results(self.current_user_saved_tracks(limit=50, market=market), parse)
+
+    @traced
+    def get_saved_artists(self, snapshot=None):
+        if snapshot is not None:
+            snapshot.refresh(self)
+            return snapshot.artists()
         return list({artist['id'] : artist for song in self.get_saved_tracks() for artist in song["artists"]}.values())
 
-    def get_tracks_from_playlist(self, playlist_owner=None, playlist_id=None, playlist=None):
+    @traced
+    def get_tracks_from_playlist(self, playlist_owner=None, playlist_id=None, playlist=None, fields=None, market=None, compact=False):
         ''' user_playlist_tracks() returns a "paging object" which only holds 100 items at once,
             so this calls aggregate_paging_results() to get a single list of all the "playlist track objects".
 
@@ -138,6 +247,9 @@ class subSpotify(spotipy.Spotify):
             so this method resolves the pointers and returns the actual tracks.
 
             If you want the time the track was added or the user who added it, this method is not for you.
+
+            fields trims the response server-side, e.g. fields='items(track(id,name,artists(id,name)))'.
+            market leaves out available_markets, and compact=True returns records.TrackRecord objects.
         '''
         if playlist:
             playlist_owner = playlist['owner']['id']
@@ -146,46 +258,48 @@ class subSpotify(spotipy.Spotify):
             raise TypeError("get_tracks_from_playlist() requires a playlist, or a username and playlist id as arguments")
 
         try:
-            query_result = self.user_playlist_tracks(playlist_owner, playlist_id)
+            if fields and 'next' not in fields.split(','):
+                # aggregate_paging_results() needs it to find the rest of the pages
+                fields += ',next'
+            query_result = self.user_playlist_tracks(playlist_owner, playlist_id, fields=fields, market=market)
         except spotipy.SpotifyException as error:
             print(f"Spotify threw and error while retrieving tracks from"
                 + " spotify:user:{playlist_owner}:playlist:{playlist_id}:\n{error}")
             return []
 
-        track_objs = self.aggregate_paging_results(query_result)
-        return [t['track'] for t in track_objs]
+        parse = (lambda t: records.compact(records.TrackRecord, t['track'])) if compact else (lambda t: t['track'])
+        return self.aggregate_paging_results(query_result, parse)
 
-    def aggregate_paging_results(self, paging_obj):
+    def aggregate_paging_results(self, paging_obj, parse=None):
         ''' Paging objects only contain a limited number of items,
             so this method aggregates all of the requested items into one list
+            If parse is given, each item is replaced by parse(item) as its page arrives,
+            so the full pages don't have to be held in memory all at once.
         '''
-        return_list = paging_obj['items']
+        return_list = paging_obj['items'] if parse is None else [parse(item) for item in paging_obj['items']]
         while paging_obj['next']:
             paging_obj = self.next(paging_obj)
-            return_list.extend(paging_obj['items'])
+            return_list.extend(paging_obj['items'] if parse is None else map(parse, paging_obj['items']))
         return return_list
 
+    @traced
     def diff_between_playlists(self, playlist1, playlist2):
         ''' Returns a list of songs that only appear in one playlist or the other
+            For anything beyond two playlists, use playlist_sets.PlaylistSets directly.
         '''
-        tracklist1 = self.get_tracks_from_playlist(playlist=playlist1)
-        tracklist2 = self.get_tracks_from_playlist(playlist=playlist2)
-
-        diff_ids = list( set([x['id'] for x in tracklist1]).symmetric_difference(set([x['id'] for x in tracklist2])) )
-
-        lookup_ref = {x['id']:x for x in tracklist1}
-        lookup_ref.update({y['id']:y for y in tracklist2})
-
-        return [lookup_ref[x] for x in diff_ids]
+        sets = PlaylistSets(self, keep_tracks=True)
+        sets.fetch([playlist1, playlist2])
+        return sets.hydrate(sets.symmetric_difference(playlist1['id'], playlist2['id']))
 
 
+    @traced
     def playlists_where_song_appears(self, username, song_id):
         ''' Returns a list of playlists that the given song appears in for the given user
         '''
         return_list = []
 
         for playlist in self.aggregate_paging_results(self.user_playlists(username)):
-            tracks = self.get_tracks_from_playlist(playlist=playlist)
+            tracks = self.get_tracks_from_playlist(playlist=playlist, fields='items(track(id))')
             for song in tracks:
                 if song['id'] == song_id:
                     return_list.append(playlist)
@@ -193,6 +307,7 @@ class subSpotify(spotipy.Spotify):
 
         return return_list
 
+    @traced
     def add_tracks_to_playlist(self,
         username=None, playlist_id=None, playlist=None, track_list=None, track_id_list=None, position=None):
         ''' The Spotify API will only add 100 songs to a playlist at a time,
@@ -217,42 +332,116 @@ class subSpotify(spotipy.Spotify):
                 position=position
                 )
 
-    def lonely_songs(self):
+    @traced
+    def sync_playlist_tracks(self, playlist, track_list=None, track_id_list=None):
+        ''' Makes an existing playlist hold exactly the given tracks, in order,
+            by removing, moving and adding only what differs instead of re-adding everything.
+        '''
+        if track_list is not None:
+            track_id_list = [x['id'] for x in track_list]
+        elif track_id_list is None:
+            raise TypeError("sync_playlist_tracks() requires a list of tracks or a list of track ids as an argument")
+        return sync_playlist(self, playlist, track_id_list)
+
+    @traced
+    def lonely_songs(self, snapshot=None, exclude=()):
         ''' Returns a list of the songs in the user's library that do not appear in any of their playlists
+            Playlists whose IDs are in exclude don't count, e.g. the one the lonely songs get collected into.
         '''
-        pointers = self.aggregate_paging_results(self.current_user_saved_tracks())
-        lonely_songs = { p['track']['id'] : p['track'] for p in pointers }
+        lonely_songs = { t['id'] : t for t in self.get_saved_tracks(snapshot) }
 
+        exclude = set(exclude)
         playlists = self.aggregate_paging_results(self.current_user_playlists())
         for playlist in playlists:
-            tracks = self.get_tracks_from_playlist(playlist=playlist)
+            if playlist['id'] in exclude:
+                continue
+            tracks = self.get_tracks_from_playlist(playlist=playlist, fields='items(track(id))')
             for track in tracks:
-                lonely_songs.pop(track['id'], None)
+                if track:
+                    lonely_songs.pop(track['id'], None)
 
         return list(lonely_songs.values())
 
-    def albums_after(self, datestring, artists=[]):
+    @traced
+    def artist_albums_since(self, artist_id, cutoff=None, include_groups=('album', 'single'), market=None):
+        ''' Returns an artist's albums from the requested album groups, asking the API for one group at a time.
+
+            Spotify returns each group newest-first, so once a group's page drops below the cutoff date,
+            the rest of that group can be skipped. Each group stops on its own, so a long list of albums
+            doesn't have to be paged through to reach the singles.
+            If a page ever comes back out of order, that group falls back to paging through everything.
+            Albums older than the cutoff may still be included; callers are expected to filter by date themselves.
+            Passing a market leaves the available_markets arrays out of the response.
+        '''
+        albums = []
+        for group in sorted(include_groups, key=ALBUM_GROUPS.index):
+            paging_obj = self.artist_albums(artist_id, include_groups=group, country=market, limit=50)
+            last_date = None
+            in_order = True
+            while True:
+                for album in paging_obj['items']:
+                    date = parse_date(album['release_date'])
+                    if last_date and date > last_date:
+                        in_order = False
+                    last_date = date
+                    albums.append(album)
+
+                if not paging_obj['next']:
+                    break
+                if cutoff and in_order and last_date and last_date < cutoff:
+                    break
+                paging_obj = self.next(paging_obj)
+        return albums
+
+    @traced
+    def albums_after(self, datestring, artists=[], include_groups=('album', 'single'), max_workers=8, market=None):
         ''' datestring: 'yyyymmdd'
             Returns a dict of all albums released after the given date from artists in your saved library.
+            Discographies are fetched concurrently, max_workers artists at a time.
+            Artists whose albums couldn't be retrieved are reported, and left out of the result.
         '''
         cutoff = parse_date(datestring)
         if not artists:
             artists = self.get_saved_artists()
 
-        new_albums = {}
-        for artist in artists:
+        # Workers that see the token expire share one fresh client rather than each authorizing their own
+        refresh_lock = threading.Lock()
+        refreshed = []
+
+        def fresh_client():
+            with refresh_lock:
+                if not refreshed:
+                    refreshed.append(self.refresh())
+                return refreshed[0]
+
+        def fetch(artist):
+            try:
+                return (refreshed[0] if refreshed else self).artist_albums_since(artist['id'], cutoff, include_groups, market)
+            except spotipy.SpotifyException as error:
+                if error.http_status != 401 or not self._scope:
+                    print(f"Spotify threw an error while retrieving albums for {artist['id']}:\n{error}")
+                    return None
+                # The token expired partway through, so try once more with a fresh client
+                client = fresh_client()
+            except requests.exceptions.RequestException as error:
+                # A dropped connection or timeout that outlasted the transport's own retries
+                print(f"Couldn't reach Spotify while retrieving albums for {artist['id']}, trying once more:\n{error}")
+                client = refreshed[0] if refreshed else self
             try:
-                albums = sp.aggregate_paging_results(sp.artist_albums(artist['id']))
-            except:
-                #Refresh token
-                sp = subSpotify(scope='''
-                    playlist-read-private 
-                    playlist-read-collaborative 
-                    user-follow-read 
-                    ''')
-                albums = sp.aggregate_paging_results(sp.artist_albums(artist['id']))
-
-            if albums:
+                return client.artist_albums_since(artist['id'], cutoff, include_groups, market)
+            except (spotipy.SpotifyException, requests.exceptions.RequestException) as error:
+                print(f"Giving up on albums for {artist['id']}:\n{error}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            discographies = list(executor.map(carry_helper(fetch), artists))
+
+        new_albums = {}
+        failed = []
+        for artist, albums in zip(artists, discographies):
+            if albums is None:
+                failed.append(artist['id'])
+            elif albums:
                 albums_with_dates = [ (a,parse_date(a['release_date'])) for a in albums]
                 albums_with_dates = [ (a,d) for a,d in albums_with_dates if d>=cutoff]
                 albums_with_dates.sort(key=lambda p: p[1])
@@ -260,6 +449,8 @@ class subSpotify(spotipy.Spotify):
             else:
                 print(f'Couldn\'t find any albums for {artist["id"]}')
                 continue
+        if failed:
+            print(f"Couldn't retrieve albums for {len(failed)} of {len(artists)} artists because of the errors above: {', '.join(failed)}")
         return new_albums
 
 
@@ -277,7 +468,7 @@ def gen_creds():
 def splitlist(input_list, size):
     ''' splits a list into a list of regularly-sized sublists
     '''
-    return [input_list[size*i:size*(i+1)] for i in range(int(len(input_list)/size + 1))]
+    return [input_list[i:i+size] for i in range(0, len(input_list), size)]
 
 def parse_date(datestring):
     ''' date: yyyy[-mm[-dd]?]? -> datetime.date(yyyy, mm, dd)
@@ -0,0 +1,156 @@
+import json
+import os
+import re
+import sys
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import pytest
+import requests
+import spotipy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spotipyhelper import subSpotify
+
+
+def make_track(track_id, name=None, artist_id='artist0'):
+    return {
+        'id': track_id,
+        'name': name or f'Song {track_id}',
+        'uri': f'spotify:track:{track_id}',
+        'artists': [{'id': artist_id, 'name': f'Artist {artist_id}'}],
+        'album': {'id': f'album{track_id}', 'name': f'Album {track_id}', 'release_date': '2020-01-01'},
+        }
+
+
+class FakeSpotify(subSpotify):
+
+    ''' A subSpotify whose HTTP calls are answered from an in-memory library and set of playlists.
+        Every call is recorded in self.calls as (method, path, params, payload), so tests can check what was sent.
+        Edits that pass a snapshot_id are rejected unless it's the playlist's current one, like a conflicting edit would be.
+    '''
+
+    prefix = 'https://api.spotify.com/v1/'
+
+    def __init__(self, user_id='me'):
+        super().__init__(token='test', transport=requests.Session(), tracer=False)
+        self.user_id = user_id
+        self.catalog = {}        # track ID -> track object
+        self.saved = []          # newest first, like the API
+        self.playlists = {}      # playlist ID -> {'id', 'name', 'owner', 'snapshot_id', 'items': [track ID, ...]}
+        self.calls = []
+        self._version = 0
+
+    def save_tracks(self, *tracks):
+        for track in tracks:
+            self.catalog[track['id']] = track
+            self.saved.insert(0, {'added_at': f'2024-01-01T00:00:{len(self.saved):02d}Z', 'track': track})
+
+    def add_playlist(self, name, track_ids, owner=None):
+        playlist_id = f'playlist{len(self.playlists)}'
+        self.playlists[playlist_id] = {
+            'id': playlist_id,
+            'name': name,
+            'owner': {'id': owner or self.user_id},
+            'snapshot_id': self._next_snapshot(),
+            'items': list(track_ids),
+            }
+        return playlist_id
+
+    def writes(self):
+        return [call for call in self.calls if call[0] != 'GET']
+
+    def _next_snapshot(self):
+        self._version += 1
+        return f'snapshot{self._version}'
+
+    def _page(self, path, items, params):
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 50))
+        end = offset + limit
+        return {
+            'items': items[offset:end],
+            'total': len(items),
+            'next': f"{self.prefix}{path}?{urlencode({'offset': end, 'limit': limit})}" if end < len(items) else None,
+            }
+
+    def _summary(self, playlist):
+        return {key: playlist[key] for key in ('id', 'name', 'owner', 'snapshot_id')} | {'tracks': {'total': len(playlist['items'])}}
+
+    def _playlist_items(self, playlist):
+        return [{'added_at': '2024-01-01T00:00:00Z', 'added_by': playlist['owner'], 'track': self.catalog.get(track_id)}
+            for track_id in playlist['items']]
+
+    def _edit(self, playlist, payload):
+        snapshot_id = (payload or {}).get('snapshot_id') if isinstance(payload, dict) else None
+        if snapshot_id and snapshot_id != playlist['snapshot_id']:
+            raise spotipy.SpotifyException(400, -1, f"Stale snapshot_id {snapshot_id}")
+        playlist['snapshot_id'] = self._next_snapshot()
+        return {'snapshot_id': playlist['snapshot_id']}
+
+    def _internal_call(self, method, url, payload, params):
+        split = urlsplit(url)
+        url = split.path.split('/v1/', 1)[1] if url.startswith('http') else split.path
+        params = {**dict(parse_qsl(split.query)), **params}
+        params = {key: value for key, value in params.items() if value is not None}
+        path = url.rstrip('/')
+        self.calls.append((method, path, params, json.loads(json.dumps(payload))))
+
+        if (method, path) == ('GET', 'me'):
+            return {'id': self.user_id}
+        if (method, path) == ('GET', 'me/tracks'):
+            return self._page(path, self.saved, params)
+        if method == 'GET' and path in ('tracks', 'albums', 'artists'):
+            return {path: [self.catalog.get(object_id) if path == 'tracks' else {'id': object_id, 'name': object_id}
+                for object_id in params['ids'].split(',')]}
+        if method == 'GET' and re.fullmatch(r'artists/[^/]+/albums', path):
+            return self._page(path, [], params)
+        if (method, path) == ('GET', 'me/playlists'):
+            return self._page(path, [self._summary(p) for p in self.playlists.values()], params)
+        user_playlists = re.fullmatch(r'users/([^/]+)/playlists', path)
+        if method == 'GET' and user_playlists:
+            user_id = user_playlists.group(1)
+            owned = [self._summary(p) for p in self.playlists.values() if p['owner']['id'] == user_id]
+            if not owned and user_id != self.user_id:
+                raise spotipy.SpotifyException(404, -1, f"{self.prefix}{path}:\n No such user")
+            return self._page(path, owned, params)
+        if method == 'POST' and re.fullmatch(r'(users/[^/]+|me)/playlists', path):
+            playlist_id = self.add_playlist(payload['name'], [])
+            return self._summary(self.playlists[playlist_id])
+
+        match = re.fullmatch(r'playlists/([^/]+)(/items)?', path)
+        if not match:
+            raise AssertionError(f"FakeSpotify doesn't know {method} {path}")
+        playlist = self.playlists[match.group(1)]
+        if not match.group(2):
+            return {**self._summary(playlist), 'tracks': self._page(f"{path}/items", self._playlist_items(playlist), {'limit': 100})}
+        if method == 'GET':
+            return self._page(path, self._playlist_items(playlist), params)
+
+        result = self._edit(playlist, payload)
+        items = playlist['items']
+        if method == 'POST':
+            ids = [uri.rsplit(':', 1)[1] for uri in payload]
+            position = int(params['position']) if 'position' in params else len(items)
+            items[position:position] = ids
+        elif method == 'PUT':
+            start, length, before = payload['range_start'], payload.get('range_length', 1), payload['insert_before']
+            moved = items[start:start+length]
+            del items[start:start+length]
+            position = before if before < start else before - length
+            items[position:position] = moved
+        elif method == 'DELETE':
+            doomed = set()
+            for entry in payload['items']:
+                track_id = entry['uri'].rsplit(':', 1)[1]
+                for position in entry['positions']:
+                    assert items[position] == track_id, f"{track_id} isn't at position {position}"
+                    doomed.add(position)
+            playlist['items'] = [t for i, t in enumerate(items) if i not in doomed]
+        return result
+
+
+@pytest.fixture
+def fake_spotify(tmp_path, monkeypatch):
+    # LibrarySnapshot and the client's config lookups work relative to the current directory
+    monkeypatch.chdir(tmp_path)
+    return FakeSpotify()
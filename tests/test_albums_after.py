@@ -0,0 +1,58 @@
+import re
+
+import spotipy
+
+from conftest import FakeSpotify
+
+
+class ReleasingSpotify(FakeSpotify):
+
+    ''' Answers artists/{id}/albums with one album per artist, and can pretend its token has expired.
+        Artists named 'broken...' always fail with a server error.
+    '''
+
+    def __init__(self, expired=False):
+        super().__init__()
+        self._scope = 'user-library-read'
+        self.expired = expired
+        self.refreshes = []
+
+    def refresh(self):
+        client = ReleasingSpotify()
+        self.refreshes.append(client)
+        return client
+
+    def _internal_call(self, method, url, payload, params):
+        artist = re.search(r'artists/([^/]+)/albums', url)
+        if not artist:
+            return super()._internal_call(method, url, payload, params)
+        if self.expired:
+            raise spotipy.SpotifyException(401, -1, "The access token expired")
+        if artist.group(1).startswith('broken'):
+            raise spotipy.SpotifyException(500, -1, "Server error")
+        album = {'id': f'album_{artist.group(1)}', 'name': 'New', 'release_date': '2024-06-01'}
+        return {'items': [album] if params.get('include_groups') == 'album' else [], 'next': None}
+
+
+def test_expired_token_is_refreshed_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sp = ReleasingSpotify(expired=True)
+    artists = [{'id': f'artist{i}', 'name': f'Artist {i}'} for i in range(20)]
+
+    new_albums = sp.albums_after('2024-01-01', artists, max_workers=8)
+
+    assert len(sp.refreshes) == 1
+    assert sorted(new_albums) == sorted(a['id'] for a in artists)
+
+
+def test_errors_are_reported_apart_from_empty_discographies(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    sp = ReleasingSpotify()
+    artists = [{'id': 'artist0', 'name': 'Artist 0'}, {'id': 'broken0', 'name': 'Broken'}]
+
+    new_albums = sp.albums_after('2024-01-01', artists)
+
+    assert list(new_albums) == ['artist0']
+    output = capsys.readouterr().out
+    assert "Couldn't find any albums" not in output
+    assert "Couldn't retrieve albums for 1 of 2 artists" in output and 'broken0' in output
@@ -0,0 +1,27 @@
+from conftest import make_track
+
+
+def test_get_tracks_by_id_batches_and_deduplicates(fake_spotify):
+    sp = fake_spotify
+    for i in range(120):
+        sp.catalog[f'track{i}'] = make_track(f'track{i}')
+    ids = [f'track{i}' for i in range(120)] + ['track0', 'missing']
+
+    tracks = sp.get_tracks_by_id(ids, market='from_token')
+
+    assert [t['id'] if t else None for t in tracks] == ids[:-1] + [None]
+    batches = [params for method, path, params, _ in sp.calls if path == 'tracks']
+    assert sorted(len(params['ids'].split(',')) for params in batches) == [21, 50, 50]
+    assert all(params['market'] == 'from_token' for params in batches)
+
+
+def test_get_artists_by_id_compact(fake_spotify):
+    sp = fake_spotify
+    ids = [f'artist{i}' for i in range(60)]
+    sp.calls.clear()
+
+    artists = sp.get_artists_by_id(ids, compact=True)
+
+    assert [a.id for a in artists] == ids
+    batches = [params for method, path, params, _ in sp.calls if path == 'artists']
+    assert len(batches) == 2 and all('market' not in params for params in batches)
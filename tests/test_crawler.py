@@ -0,0 +1,20 @@
+from conftest import make_track
+from crawler import CrawlFrontier, GraphCrawler
+from graph_backends import SQLiteBackend
+
+
+def test_unknown_user_is_skipped(fake_spotify):
+    sp = fake_spotify
+    for i in range(3):
+        sp.catalog[f'track{i}'] = make_track(f'track{i}')
+    sp.add_playlist('Theirs', ['track0', 'track1', 'track2'], owner='friend')
+    graph = SQLiteBackend(':memory:')
+    crawler = GraphCrawler(graph, sp, frontier=CrawlFrontier(path=None), budget=20)
+    crawler.seed(['no_such_user', 'friend'])
+
+    crawler.run()
+
+    assert 'user:no_such_user' in crawler.frontier.visited
+    assert 'user:friend' in crawler.frontier.visited
+    assert crawler.merged == {'playlist0': ['track0', 'track1', 'track2']}
+    assert {s['id'] for s in graph.nodes('Song')} == {'track0', 'track1', 'track2'}
@@ -0,0 +1,19 @@
+import lonely_songs
+from conftest import make_track
+from daemon import LibraryState
+
+
+def test_lonely_songs_ignores_the_lonely_songs_playlist(fake_spotify):
+    sp = fake_spotify
+    sp.save_tracks(*(make_track(f'track{i}') for i in range(4)))
+    sp.add_playlist('Favourites', ['track0'])
+    sp.add_playlist(lonely_songs.PLAYLIST_NAME, ['track1'], owner='someone_else')
+    lonely_songs.main(sp)
+
+    state = LibraryState(sp)
+    state.refresh()
+
+    # track1 is in someone else's playlist of the same name, which is a home like any other
+    assert sorted(t['id'] for t in state.lonely_songs()) == ['track2', 'track3']
+    # It's still where those songs appear, though
+    assert lonely_songs.PLAYLIST_NAME in {p['name'] for p in state.song_appearance('track2')}
@@ -0,0 +1,36 @@
+from conftest import make_track
+from library_snapshot import LibrarySnapshot
+
+
+def saved_track_requests(sp):
+    return [params for method, path, params, _ in sp.calls if (method, path) == ('GET', 'me/tracks')]
+
+
+def test_single_removal_is_found_by_binary_search(fake_spotify):
+    sp = fake_spotify
+    sp.save_tracks(*(make_track(f'track{i}') for i in range(1000)))
+    snapshot = LibrarySnapshot()
+    snapshot.refresh(sp)
+
+    del sp.saved[400]
+    sp.calls.clear()
+    snapshot.refresh(sp)
+
+    assert [item['track']['id'] for item in snapshot.items()] == [item['track']['id'] for item in sp.saved]
+    # One page to see nothing new, then ten single-item probes, well under the 20 pages of a re-scan
+    assert len(saved_track_requests(sp)) == 11
+    assert all(int(params['limit']) == 1 for params in saved_track_requests(sp)[1:])
+
+
+def test_many_removals_fall_back_to_a_rescan(fake_spotify):
+    sp = fake_spotify
+    sp.save_tracks(*(make_track(f'track{i}') for i in range(1000)))
+    snapshot = LibrarySnapshot()
+    snapshot.refresh(sp)
+
+    del sp.saved[100:103]
+    sp.calls.clear()
+    snapshot.refresh(sp)
+
+    assert [item['track']['id'] for item in snapshot.items()] == [item['track']['id'] for item in sp.saved]
+    assert all(int(params['limit']) == 50 for params in saved_track_requests(sp))
@@ -0,0 +1,48 @@
+import lonely_songs
+from conftest import make_track
+
+
+def lonely_playlists(sp, owner='me'):
+    return [p for p in sp.playlists.values() if p['name'] == 'All the Lonely Songs' and p['owner']['id'] == owner]
+
+
+def test_main_is_stable_across_runs(fake_spotify):
+    sp = fake_spotify
+    sp.save_tracks(*(make_track(f'track{i}') for i in range(5)))
+    sp.add_playlist('Favourites', ['track0', 'track1'])
+
+    lonely_songs.main(sp)
+    [playlist] = lonely_playlists(sp)
+    assert sorted(playlist['items']) == ['track2', 'track3', 'track4']
+    first = list(playlist['items'])
+
+    sp.calls.clear()
+    lonely_songs.main(sp)
+    assert lonely_playlists(sp) == [playlist]
+    assert playlist['items'] == first
+    assert sp.writes() == []
+
+
+def test_main_follows_library_changes(fake_spotify):
+    sp = fake_spotify
+    sp.save_tracks(*(make_track(f'track{i}') for i in range(3)))
+    lonely_songs.main(sp)
+
+    sp.save_tracks(make_track('track3'))
+    sp.add_playlist('Favourites', ['track0'])
+    lonely_songs.main(sp)
+
+    [playlist] = lonely_playlists(sp)
+    assert sorted(playlist['items']) == ['track1', 'track2', 'track3']
+
+
+def test_main_ignores_followed_playlist_with_the_same_name(fake_spotify):
+    sp = fake_spotify
+    sp.save_tracks(*(make_track(f'track{i}') for i in range(3)))
+    theirs = sp.add_playlist('All the Lonely Songs', ['track0'], owner='someone_else')
+
+    lonely_songs.main(sp)
+
+    assert sp.playlists[theirs]['items'] == ['track0']
+    [mine] = lonely_playlists(sp)
+    assert sorted(mine['items']) == ['track1', 'track2']
@@ -0,0 +1,76 @@
+import random
+
+from conftest import make_track
+from playlist_sync import plan_playlist_sync, sync_playlist
+
+
+def apply_plan(current_ids, operations):
+    current = list(current_ids)
+    for operation in operations:
+        if operation[0] == 'remove':
+            doomed = {position for _, positions in operation[1] for position in positions}
+            current = [t for i, t in enumerate(current) if i not in doomed]
+        elif operation[0] == 'move':
+            _, start, before, length = operation
+            moved = current[start:start+length]
+            del current[start:start+length]
+            position = before if before < start else before - length
+            current[position:position] = moved
+        else:
+            _, ids, position = operation
+            current[position:position] = ids
+    return current
+
+
+def test_plan_reaches_desired_order():
+    rng = random.Random(0)
+    pool = [f'track{i}' for i in range(40)]
+    for _ in range(200):
+        current = [rng.choice(pool) for _ in range(rng.randrange(30))]
+        desired = [rng.choice(pool) for _ in range(rng.randrange(30))]
+        assert apply_plan(current, plan_playlist_sync(current, desired)) == desired
+
+
+def test_block_move_is_one_reorder():
+    current = [f'track{i}' for i in range(5000)]
+    desired = current[:1000] + current[3000:3500] + current[1000:3000] + current[3500:]
+
+    operations = plan_playlist_sync(current, desired)
+
+    assert operations == [('move', 3000, 1000, 500)]
+    assert apply_plan(current, operations) == desired
+
+
+def test_sync_sends_playlist_item_edits_chained_on_snapshot_id(fake_spotify):
+    sp = fake_spotify
+    for track_id in 'abcdexy':
+        sp.catalog[track_id] = make_track(track_id)
+    playlist_id = sp.add_playlist('Mix', list('abcdex'))
+    playlist = sp.playlists[playlist_id]
+
+    edits = sync_playlist(sp, {'id': playlist_id, 'owner': playlist['owner'], 'name': 'Mix'}, list('dabcey'))
+
+    assert playlist['items'] == list('dabcey')
+    assert edits == len(sp.writes()) == 3
+
+    # Read through the playlist endpoint, not the deprecated users/{id}/playlists/{id} one
+    assert sp.calls[0][:2] == ('GET', f'playlists/{playlist_id}')
+    assert all(not path.startswith('users/') for _, path, _, _ in sp.calls)
+
+    (remove, _, _, remove_body), (move, _, _, move_body), (add, _, add_params, add_body) = sp.writes()
+    assert (remove, move, add) == ('DELETE', 'PUT', 'POST')
+    assert all(path == f'playlists/{playlist_id}/items' for _, path, _, _ in sp.writes())
+    assert remove_body == {'items': [{'uri': 'spotify:track:x', 'positions': [5]}], 'snapshot_id': 'snapshot1'}
+    # Each edit is made against the snapshot the one before it returned
+    assert move_body == {'range_start': 3, 'range_length': 1, 'insert_before': 0, 'snapshot_id': 'snapshot2'}
+    assert add_body == ['spotify:track:y'] and add_params == {'position': 5}
+
+
+def test_sync_leaves_matching_playlist_alone(fake_spotify):
+    sp = fake_spotify
+    for track_id in 'abc':
+        sp.catalog[track_id] = make_track(track_id)
+    playlist_id = sp.add_playlist('Mix', list('abc'))
+
+    assert sync_playlist(sp, sp.playlists[playlist_id], list('abc')) == 0
+    assert sp.writes() == []
@@ -0,0 +1,16 @@
+import requests
+
+import spotipyhelper
+from spotipyhelper import subSpotify
+
+
+def test_tracer_false_opts_out_of_the_configured_tracer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'config.cfg').write_text('[TRACE]\n')
+    monkeypatch.setattr(spotipyhelper, '_default_tracer', False)
+
+    traced = subSpotify(token='test', transport=requests.Session())
+    untraced = subSpotify(token='test', transport=requests.Session(), tracer=False)
+
+    assert traced.tracer is not None and traced.transport.hooks['response']
+    assert untraced.tracer is None and not untraced.transport.hooks['response']
@@ -0,0 +1,307 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import random
+import re
+import sys
+import threading
+from time import time
+from urllib.parse import urlsplit
+
+
+# The subSpotify helper (or nested helpers, joined with '/') that the current request is being made for
+_helper = contextvars.ContextVar('helper', default=None)
+# thread ident -> helper, so the sampling profiler can tell what another thread is working on
+_thread_helpers = {}
+
+
+def current_helper():
+    return _helper.get()
+
+@contextlib.contextmanager
+def _running_as(helper):
+    token = _helper.set(helper)
+    ident = threading.get_ident()
+    previous = _thread_helpers.get(ident)
+    _thread_helpers[ident] = helper
+    try:
+        yield
+    finally:
+        _helper.reset(token)
+        if previous is None:
+            _thread_helpers.pop(ident, None)
+        else:
+            _thread_helpers[ident] = previous
+
+def traced(method):
+    ''' Marks a subSpotify method as a helper, so the requests it makes are attributed to it.
+        This is only a context variable being set and reset, so it stays on whether anything is tracing or not.
+    '''
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        outer = _helper.get()
+        with _running_as(name if outer is None else f'{outer}/{name}'):
+            return method(*args, **kwargs)
+    return wrapper
+
+def carry_helper(fn):
+    ''' Wraps fn so it runs under the helper that's active right now, even when a thread pool calls it.
+        Worker threads don't inherit context variables on their own.
+    '''
+    helper = _helper.get()
+    if helper is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _running_as(helper):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+_SPOTIFY_ID = re.compile(r'^[0-9A-Za-z]{22}$')
+
+def endpoint_name(method, url):
+    ''' Collapses a request URL into its endpoint, e.g. 'GET /users/{id}/playlists/{id}/tracks',
+        so every page and every object of the same kind land in the same bucket.
+    '''
+    parts = urlsplit(url).path.rstrip('/').split('/')[1:]
+    if parts[:1] == ['v1']:
+        parts = parts[1:]
+    names = []
+    for index, part in enumerate(parts):
+        if _SPOTIFY_ID.match(part) or (index and parts[index-1] == 'users'):
+            names.append('{id}')
+        else:
+            names.append(part)
+    return f"{method} /{'/'.join(names)}"
+
+
+class _CallStats:
+
+    def __init__(self, reservoir_size):
+        self.reservoir_size = reservoir_size
+        self.calls = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.retries = 0
+        self.throttled = 0
+        self.server_errors = 0
+        self.samples = []
+
+    def add(self, call):
+        self.calls += 1
+        self.bytes += call['bytes']
+        self.seconds += call['seconds']
+        self.retries += call['retries']
+        self.throttled += call['throttled']
+        self.server_errors += call['server_errors']
+        # Reservoir sampling keeps a fixed-size, uniform sample of latencies no matter how many calls there are
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(call['seconds'])
+        else:
+            slot = random.randrange(self.calls)
+            if slot < self.reservoir_size:
+                self.samples[slot] = call['seconds']
+
+    def merge(self, other):
+        merged = _CallStats(self.reservoir_size)
+        for field in ('calls', 'bytes', 'seconds', 'retries', 'throttled', 'server_errors'):
+            setattr(merged, field, getattr(self, field) + getattr(other, field))
+        merged.samples = self.samples + other.samples
+        return merged
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class SummarySink:
+
+    ''' Keeps running totals in memory for every (helper, endpoint) pair.
+        Latency percentiles come from a bounded sample of each pair's calls, so memory doesn't grow with the run.
+    '''
+
+    def __init__(self, reservoir_size=512):
+        self.reservoir_size = reservoir_size
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, call):
+        key = (call['helper'], call['endpoint'])
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _CallStats(self.reservoir_size)
+            stats.add(call)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self, by=None):
+        ''' Returns {key: stats}, keyed by (helper, endpoint), or just by 'helper' or 'endpoint'.
+        '''
+        with self._lock:
+            items = list(self._stats.items())
+        if by is None:
+            return dict(items)
+        position = {'helper': 0, 'endpoint': 1}[by]
+        grouped = {}
+        for key, stats in items:
+            key = key[position]
+            grouped[key] = grouped[key].merge(stats) if key in grouped else stats
+        return grouped
+
+    def table(self, by=None):
+        from prettytable import PrettyTable
+        table = PrettyTable(['Helper / Endpoint' if by is None else by.capitalize(),
+            'Calls', 'KiB', 'Total s', 'p50 ms', 'p90 ms', 'p99 ms', 'Retries', '429s', '5xx'])
+        table.align = 'r'
+        table.align[table.field_names[0]] = 'l'
+        for key, stats in sorted(self.stats(by).items(), key=lambda item: -item[1].seconds):
+            table.add_row([
+                ' '.join(key) if by is None else key,
+                stats.calls,
+                f'{stats.bytes/1024:.0f}',
+                f'{stats.seconds:.1f}',
+                f'{stats.percentile(50)*1000:.0f}',
+                f'{stats.percentile(90)*1000:.0f}',
+                f'{stats.percentile(99)*1000:.0f}',
+                stats.retries,
+                stats.throttled,
+                stats.server_errors,
+                ])
+        return table.get_string()
+
+    def close(self):
+        pass
+
+
+class JSONLinesSink:
+
+    ''' Appends one JSON object per call to a file, for digging into a run afterwards.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, call):
+        line = json.dumps(call) + '\n'
+        with self._lock:
+            self._fp.write(line)
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+
+class SamplingProfiler:
+
+    ''' Every interval seconds, looks at what each thread that's inside a helper is executing
+        and counts the innermost frame under that helper. Threads outside helpers are left alone.
+    '''
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, helper in list(_thread_helpers.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    code = frame.f_code
+                    self.samples[(helper, f'{code.co_filename}:{frame.f_lineno} {code.co_name}')] += 1
+
+    def report(self, top=20):
+        total = sum(self.samples.values()) or 1
+        return '\n'.join(f'{count/total:6.1%}  {helper}  {where}' for (helper, where), count in self.samples.most_common(top))
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class Tracer:
+
+    ''' Records every response that comes back through the sessions it's attached to:
+        which endpoint and helper it was for, its status, size on the wire, latency, and how many retries and 429s it took.
+        Paging through next() goes through the same session, so those requests are counted too.
+
+        The in-memory summary is always kept; sinks (e.g. JSONLinesSink) get every call as a dict as well.
+        profile_interval starts a SamplingProfiler over the threads that are inside a helper.
+    '''
+
+    def __init__(self, sinks=(), profile_interval=None):
+        self.summary = SummarySink()
+        self.sinks = [self.summary, *sinks]
+        self.profiler = SamplingProfiler(profile_interval) if profile_interval else None
+
+    @classmethod
+    def from_config(cls, config):
+        ''' [TRACE]
+            jsonl = traces.jsonl            (also write every call to this file)
+            profile_interval = 0.01         (sample helper threads this often, in seconds)
+        '''
+        sinks = [JSONLinesSink(config.get('TRACE', 'jsonl'))] if config.has_option('TRACE', 'jsonl') else []
+        interval = config.getfloat('TRACE', 'profile_interval', fallback=0) or None
+        return cls(sinks, profile_interval=interval)
+
+    def attach(self, session):
+        if self._hook not in session.hooks['response']:
+            session.hooks['response'].append(self._hook)
+        if self.profiler:
+            self.profiler.start()
+
+    def _hook(self, response, *args, **kwargs):
+        # urllib3 retries happen below requests, so the only trace they leave is the history on the raw response
+        retries = getattr(response.raw, 'retries', None)
+        history = retries.history if retries is not None else ()
+        status = response.status_code
+        body = response.content
+        # What came over the network, compressed if the response was: tell() is how many bytes urllib3
+        # pulled off the socket before decompressing, and Content-Length covers responses without a socket behind them
+        wire_bytes = response.raw.tell() if hasattr(response.raw, 'tell') else 0
+        call = {
+            'time': time(),
+            'helper': _helper.get() or '-',
+            'endpoint': endpoint_name(response.request.method, response.request.url),
+            'status': status,
+            'seconds': response.elapsed.total_seconds(),
+            'bytes': wire_bytes or int(response.headers.get('Content-Length') or len(body)),
+            'retries': len(history),
+            'throttled': sum(1 for attempt in history if attempt.status == 429) + (status == 429),
+            'server_errors': sum(1 for attempt in history if (attempt.status or 0) >= 500) + (status >= 500),
+            }
+        for sink in self.sinks:
+            sink.record(call)
+
+    def report(self, by=None):
+        report = self.summary.table(by)
+        if self.profiler and self.profiler.samples:
+            report += '\n\nWhere helper threads spent their time (sampled):\n' + self.profiler.report()
+        return report
+
+    def close(self):
+        if self.profiler:
+            self.profiler.close()
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,223 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import json
+import threading
+from time import perf_counter
+
+
+def default_json_loads():
+    ''' Returns orjson.loads if it's installed, otherwise the standard library's json.loads.
+    '''
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        return json.loads
+
+def _accept_encoding():
+    encodings = ['gzip', 'deflate']
+    try:
+        import brotli
+        encodings.append('br')
+    except ImportError:
+        pass
+    return ', '.join(encodings)
+
+
+class TransportStats:
+
+    ''' Running totals for everything that went through a session made by make_session().
+        wire_bytes is what came over the network (compressed, if the response was),
+        body_bytes is the decompressed size, and decode_seconds is time spent turning bodies into JSON.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.responses = 0
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        self.decode_seconds = 0.0
+
+    def record(self, wire_bytes, body_bytes):
+        with self._lock:
+            self.responses += 1
+            self.wire_bytes += wire_bytes
+            self.body_bytes += body_bytes
+
+    def record_decode(self, seconds):
+        with self._lock:
+            self.decode_seconds += seconds
+
+    def __str__(self):
+        return (f"{self.responses} responses, {self.wire_bytes/1024:.0f} KiB on the wire, "
+            f"{self.body_bytes/1024:.0f} KiB decompressed, {self.decode_seconds*1000:.0f} ms decoding JSON")
+
+
+def make_session(pool_size=16, keep_alive=True, compress=True, json_loads=None,
+    retries=3, status_retries=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504)):
+    ''' Builds the requests.Session subSpotify talks to Spotify through.
+
+        pool_size: how many connections to keep open at once, which should be at least the number of threads
+            making requests (the concurrent helpers default to 8 workers).
+        keep_alive: reuse connections between requests instead of closing them.
+        compress: ask for gzip/deflate (and brotli, if installed) responses.
+        json_loads: the function used to decode response bodies, defaulting to orjson if it's installed.
+        The retry settings mirror the ones spotipy uses for the session it would have built itself.
+
+        The session's .stats attribute is a TransportStats that counts bytes and decode time.
+    '''
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=status_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+        )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    session.headers['Accept-Encoding'] = _accept_encoding() if compress else 'identity'
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    session.stats = TransportStats()
+    session.hooks['response'].append(_measure_and_decode(session.stats, json_loads or default_json_loads()))
+    return session
+
+def _measure_and_decode(stats, loads):
+    ''' Builds a response hook that counts bytes and swaps the given decoder in for response.json().
+    '''
+    def hook(response, *args, **kwargs):
+        body = response.content
+        # tell() is how many bytes urllib3 pulled off the socket, before decompression
+        wire_bytes = response.raw.tell() if hasattr(response.raw, 'tell') else 0
+        stats.record(wire_bytes or len(body), len(body))
+
+        def decode(**kwargs):
+            mark0 = perf_counter()
+            try:
+                return loads(body)
+            finally:
+                stats.record_decode(perf_counter() - mark0)
+        response.json = decode
+        return response
+    return hook
+
+
+def synthetic_tracks_payload(count=50, seed=0):
+    ''' A tracks() response body shaped like the real thing, including the available_markets arrays
+        and images that make up most of its size.
+    '''
+    import random
+    rng = random.Random(seed)
+    markets = [chr(65 + i // 26) + chr(65 + i % 26) for i in range(185)]
+
+    def spotify_id():
+        return ''.join(rng.choice('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(22))
+
+    def artist():
+        artist_id = spotify_id()
+        return {
+            'external_urls': {'spotify': f'https://open.spotify.com/artist/{artist_id}'},
+            'href': f'https://api.spotify.com/v1/artists/{artist_id}',
+            'id': artist_id,
+            'name': f'Artist {rng.randint(0, 10**6)}',
+            'type': 'artist',
+            'uri': f'spotify:artist:{artist_id}',
+            }
+
+    tracks = []
+    for _ in range(count):
+        track_id, album_id = spotify_id(), spotify_id()
+        artists = [artist() for _ in range(rng.randint(1, 3))]
+        tracks.append({
+            'album': {
+                'album_type': 'album',
+                'artists': artists[:1],
+                'available_markets': markets,
+                'external_urls': {'spotify': f'https://open.spotify.com/album/{album_id}'},
+                'href': f'https://api.spotify.com/v1/albums/{album_id}',
+                'id': album_id,
+                'images': [{'height': size, 'url': f'https://i.scdn.co/image/{spotify_id()}', 'width': size} for size in (640, 300, 64)],
+                'name': f'Album {rng.randint(0, 10**6)}',
+                'release_date': f'{rng.randint(1960, 2020)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}',
+                'release_date_precision': 'day',
+                'total_tracks': rng.randint(1, 20),
+                'type': 'album',
+                'uri': f'spotify:album:{album_id}',
+                },
+            'artists': artists,
+            'available_markets': markets,
+            'disc_number': 1,
+            'duration_ms': rng.randint(90000, 400000),
+            'explicit': rng.random() < 0.2,
+            'external_ids': {'isrc': f'US{rng.randint(10**9, 10**10)}'},
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+            'href': f'https://api.spotify.com/v1/tracks/{track_id}',
+            'id': track_id,
+            'is_local': False,
+            'name': f'Track {rng.randint(0, 10**6)}',
+            'popularity': rng.randint(0, 100),
+            'preview_url': None,
+            'track_number': rng.randint(1, 20),
+            'type': 'track',
+            'uri': f'spotify:track:{track_id}',
+            })
+    return json.dumps({'tracks': tracks}).encode()
+
+def decode_benchmark(tracks=1000, repeat=5):
+    ''' Offline half of the benchmark: bytes per 1,000 tracks with and without gzip,
+        and decode time per 1,000 tracks for the standard library versus the default decoder.
+    '''
+    import gzip
+    bodies = [synthetic_tracks_payload(50, seed) for seed in range(tracks // 50)]
+    raw_bytes = sum(len(body) for body in bodies)
+    gzip_bytes = sum(len(gzip.compress(body, 6)) for body in bodies)
+    print(f"Per {tracks} tracks: {raw_bytes/1024:.0f} KiB uncompressed, {gzip_bytes/1024:.0f} KiB gzipped.")
+
+    decoders = {'json.loads': json.loads}
+    if default_json_loads() is not json.loads:
+        decoders['orjson.loads'] = default_json_loads()
+    for name, loads in decoders.items():
+        best = min(_time_decode(loads, bodies) for _ in range(repeat))
+        print(f"{name:>12}: {best*1000:.1f} ms per {tracks} tracks")
+
+def _time_decode(loads, bodies):
+    mark0 = perf_counter()
+    for body in bodies:
+        loads(body)
+    return perf_counter() - mark0
+
+def live_benchmark(track_ids):
+    ''' Online half of the benchmark: fetches the same tracks through a plain session and a tuned one,
+        and reports bytes on the wire and decode time per 1,000 tracks for each.
+    '''
+    from spotipyhelper import subSpotify
+
+    token = subSpotify.generate_token(None)
+    sessions = {
+        'plain': make_session(pool_size=1, compress=False, json_loads=json.loads),
+        'tuned': make_session(),
+        }
+    for name, session in sessions.items():
+        sp = subSpotify(token, transport=session)
+        mark0 = perf_counter()
+        sp.get_tracks_by_id(track_ids)
+        elapsed = perf_counter() - mark0
+        per_thousand = 1000 / len(track_ids)
+        stats = session.stats
+        print(f"{name:>6}: {stats.wire_bytes*per_thousand/1024:.0f} KiB on the wire, "
+            f"{stats.decode_seconds*per_thousand*1000:.1f} ms decoding, {elapsed*per_thousand:.2f} s total per 1000 tracks")
+
+
+if __name__ == '__main__':
+    decode_benchmark()